@@ -32,12 +32,20 @@ ffi = cffi.FFI()
 
 ffi.cdef(header)
 
-if platform == "win32":
-      libbladeRF = ffi.dlopen("bladerf.dll")
-elif platform == "darwin":
-    libbladeRF = ffi.dlopen("libbladeRF.dylib")
-else:
-    libbladeRF = ffi.dlopen("libbladeRF.so")
+try:
+    if platform == "win32":
+          libbladeRF = ffi.dlopen("bladerf.dll")
+    elif platform == "darwin":
+        libbladeRF = ffi.dlopen("libbladeRF.dylib")
+    else:
+        libbladeRF = ffi.dlopen("libbladeRF.so")
+    library_loaded = True
+except OSError:
+    # Without libbladeRF the constants declared in the header are still
+    # usable which lets the simulated device in `lib.simbladerf` run
+    # on machines without the library. Opening a real device fails.
+    libbladeRF = ffi.dlopen(None)
+    library_loaded = False
 
 
 ###############################################################################
@@ -308,7 +316,10 @@ class BladeRFError(Exception):
             i_am = self.__class__.__name__
             code = getattr(ReturnCode, i_am).value
 
-        self.errstr = ffi.string(libbladeRF.bladerf_strerror(code)).decode()
+        if library_loaded:
+            self.errstr = ffi.string(libbladeRF.bladerf_strerror(code)).decode()
+        else:
+            self.errstr = str(ReturnCode(code))
 
         if msg is not None:
             self.errstr += " (" + msg + ")"
@@ -488,6 +499,8 @@ class BladeRF:
     # Open, close, devinfo
 
     def open(self, device_identifier=None, devinfo=None):
+        if not library_loaded:
+            raise OSError('libbladeRF could not be loaded')
         if devinfo is not None:
             ret = libbladeRF.bladerf_open_with_devinfo(self.dev,
                                                        devinfo.struct)
@@ -752,6 +765,27 @@ class BladeRF:
         _check_error(ret)
         return Range.from_struct(_range_ptr[0])
 
+    # Quick tune and scheduled retunes
+
+    def get_quick_tune(self, ch):
+        quick_tune = ffi.new("struct bladerf_quick_tune *")
+        ret = libbladeRF.bladerf_get_quick_tune(self.dev[0], ch, quick_tune)
+        _check_error(ret)
+        return quick_tune
+
+    def schedule_retune(self, ch, timestamp, frequency, quick_tune=None):
+        if quick_tune is None:
+            quick_tune = ffi.NULL
+        ret = libbladeRF.bladerf_schedule_retune(self.dev[0], ch,
+                                                 int(timestamp),
+                                                 int(frequency),
+                                                 quick_tune)
+        _check_error(ret)
+
+    def cancel_scheduled_retunes(self, ch):
+        ret = libbladeRF.bladerf_cancel_scheduled_retunes(self.dev[0], ch)
+        _check_error(ret)
+
     # RF Ports
 
     def set_rf_port(self, ch, port):
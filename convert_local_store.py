@@ -0,0 +1,20 @@
+"""Converts a pickle local store into the columnar format.
+
+The pickle store is the file `s3fetch.py` wrote before it could write
+the columnar format of `lib/colstore.py`. The blocks are appended to
+the output so it may be run again on a new pickle store.
+"""
+import argparse
+import time
+from lib.colstore import convert
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser()
+    c_help = 'The path to the pickle local store.'
+    ap.add_argument('--data-path', type=str, required=True, help=c_help)
+    c_help = 'The path to the columnar store to append to.'
+    ap.add_argument('--out-path', type=str, required=True, help=c_help)
+    args = ap.parse_args()
+    st = time.time()
+    count = convert(args.data_path, args.out_path)
+    print('converted %d objects in %.1fs' % (count, time.time() - st))
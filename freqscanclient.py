@@ -8,27 +8,35 @@ two `tx_signals` entries for each antenna. This was designed
 with the BladeRF A4 which has two transmit channels.
 """
 import yaml
-import socket
-import lib.bsocket as bsocket
+from lib.scanclient import ServerConnection, ShmConnection, read_servers
+from lib.groupwriter import GroupWriter
 import time
-import pickle
 import argparse
 
-def execute(config_path: str):
+def execute(config_path: str, raw: bool = False):
     """Yields measurements.
 
     The configuration specifies how to connect to the sources and what
     sources. This function yeilds, as a generator, the measurements
     and the source index. One may need to directly read the configuration
     to relate the source index back to specific parameters if needed.
+
+    If `raw` is true a `wire.Frame` is yielded in place of each
+    measurement dictionary. Its arrays are decoded without building
+    dictionaries. Servers that only send pickles are converted so
+    both kinds of server can be read the same way.
+
+    The servers are read as their data arrives and a server that goes
+    down is reconnected in the background. See `lib.scanclient`.
+    A server with an `shm` key is on this host and is read through
+    the shared memory segment of that name instead of TCP.
     """
     with open(config_path, 'r') as fd:
         cfg = yaml.unsafe_load(fd)
     
     sec = cfg['servers']
 
-    socks = []
-    socks_ndx = []
+    conns = []
 
     k_ndx = 0
     for k in sec:
@@ -36,48 +44,76 @@ def execute(config_path: str):
         if not scfg['enabled']:
             #print('disabled', scfg['host'], scfg['port'])
             continue
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        #print('connecting', scfg['host'], scfg['port'])
-        try:
-            print('connecting', scfg['host'], scfg['port'])
-            sock.connect((scfg['host'], scfg['port']))
-            print('connected')
-            socks.append(sock)
-            socks_ndx.append(k_ndx)
-        except ConnectionRefusedError as e:
-            print('connection refused', scfg['host'], scfg['port'])
+        if scfg.get('shm') is not None:
+            if scfg.get('credit-records') is not None or scfg.get('credit-bytes') is not None:
+                raise ValueError(
+                    'server %s: credit-records and credit-bytes can not be used with shm' % k
+                )
+            conns.append(ShmConnection(
+                scfg['shm'],
+                k_ndx,
+                raw=raw,
+                idle_timeout=float(scfg.get('idle-timeout', 60.0)),
+                subscribe=scfg.get('subscribe')
+            ))
+            k_ndx += 1
+            continue
+        conns.append(ServerConnection(
+            scfg['host'],
+            scfg['port'],
+            k_ndx,
+            raw=raw,
+            idle_timeout=float(scfg.get('idle-timeout', 60.0)),
+            subscribe=scfg.get('subscribe'),
+            credit_records=scfg.get('credit-records'),
+            credit_bytes=scfg.get('credit-bytes')
+        ))
         k_ndx += 1
 
     print('reading')
-    while True:
-        for ndx, sock in enumerate(socks):
-            try:
-                data = bsocket.recv_pickle(sock)
-            except bsocket.SocketException:
-                continue
-            yield data, socks_ndx[ndx]
+    yield from read_servers(conns)
 
-def main(config_path: str, data_output_path: str):
+def main(
+        config_path: str,
+        data_output_path: str,
+        group_records: int = 1000,
+        group_ms: float = 200.0,
+        fsync_s: float = None):
     """The main entry point of the program.
 
     If this module is called directly this will read the
     configuration, gather measurements, and write them to
     the `data_output_path` specified.
+
+    The measurements are written by a `GroupWriter` in checksummed
+    chunks of up to `group_records` or every `group_ms` milliseconds.
+    Use `lib.groupwriter.read_records` to read them back.
     """
-    fd = open(data_output_path, 'ab')
+    writer = GroupWriter(data_output_path, group_records, group_ms, fsync_s)
+    last_report = time.time()
 
-    for data, source_ndx in execute(config_path):
-        mt, freq = data['time'], data['freq']
-        b0, b1 = data['b0'], data['b1']
-        pickle.dump((
-            mt, freq, b0, b1, source_ndx
-        ), fd)
-        fd.flush()
-        print(mt, freq, b0, b1, source_ndx)
+    try:
+        for frame, source_ndx in execute(config_path, raw=True):
+            h = frame.headers
+            writer.write_many([
+                (mt, freq, b0, b1, source_ndx)
+                for mt, freq, b0, b1 in zip(
+                    h['time'].tolist(), h['freq'].tolist(),
+                    h['b0'].tolist(), h['b1'].tolist())
+            ])
+            if time.time() - last_report >= 10:
+                print(writer.report())
+                last_report = time.time()
+    finally:
+        writer.close()
+        print(writer.report())
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
     ap.add_argument('--config', type=str, default='config.yaml')
     ap.add_argument('--output', type=str, default='plot')
+    ap.add_argument('--group-records', type=int, default=1000)
+    ap.add_argument('--group-ms', type=float, default=200.0)
+    ap.add_argument('--fsync-s', type=float, default=None)
     args = ap.parse_args()
-    main(args.config, args.output)
\ No newline at end of file
+    main(args.config, args.output, args.group_records, args.group_ms, args.fsync_s)
\ No newline at end of file
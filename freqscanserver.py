@@ -1,22 +1,32 @@
 """Nuand BladeRF Frequency Scanner Server
 
 This module contains the frequency scanner server. It opens the
-device, randomly samples the frequency range, and queues the
+device, samples the frequency range, and queues the
 output. When a client connects over TCP the queued up measurements
 are sent without waiting for an acknowledgement.
 """
 import argparse
 import socket
 import threading
-import queue
 import yaml
 import bladerf
-from lib.bladeandnumpy import BladeRFAndNumpy
+from lib.bladeandnumpy import BladeRFAndNumpy, sc16_to_complex
+from lib.simbladerf import SimBladeRF, load_scene
+from lib.pipeline import CapturePipeline
+import lib.tuning as tuning
+import lib.hopschedule as hopschedule
+from lib.rxqueue import RecordQueue, RetentionWindow
+import lib.rxqueue as rxqueue
+from lib.spill import SpillLog
+from lib.fanout import FanoutRing
+from lib.subscription import Subscription
+from lib.shmring import ShmRing
+from lib.credit import CreditGate, read_grants
 import lib.bsocket as bsocket
-import random
+import lib.wire as wire
+import lib.channelizer as channelizer
 import numpy as np
 import time
-import scipy.signal as signal
 
 def secondary(
     serial: str,
@@ -32,15 +42,24 @@ def secondary(
         cfg = yaml.unsafe_load(fd)
     cfg = cfg['servers'][serial]
 
-    dev = BladeRFAndNumpy(f'libusb:serial={serial}')
+    if args.simulate is not None:
+        dev = SimBladeRF(load_scene(args.simulate), f'sim:serial={serial}')
+    else:
+        dev = BladeRFAndNumpy(f'libusb:serial={serial}')
 
     num_buffers = 16
     buffer_size = 1024 * 8
     buffer_samps = num_buffers * buffer_size
 
+    if args.settle == 'timestamp':
+        # Timestamped reads need the metadata format.
+        fmt = bladerf.Format.SC16_Q11_META
+    else:
+        fmt = bladerf.Format.SC16_Q11
+
     dev.sync_config(
         bladerf.ChannelLayout.RX_X2,
-        bladerf.Format.SC16_Q11,
+        fmt,
         num_buffers=num_buffers,
         buffer_size=buffer_size,
         num_transfers=8,
@@ -50,34 +69,74 @@ def secondary(
     dev.enable_module(0, True)
     dev.enable_module(2, True)
 
-    msock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    msock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    print('binded', cfg['host'], cfg['port'])
-    msock.bind((cfg['host'], cfg['port']))
-    msock.listen(1)
+    if args.shm is None:
+        msock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        msock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        print('binded', cfg['host'], cfg['port'])
+        msock.bind((cfg['host'], cfg['port']))
+        msock.listen(8 if args.fanout else 1)
+
+    if args.spill_dir is not None:
+        spill = SpillLog(
+            args.spill_dir,
+            int(args.spill_segment_mb * 1024 * 1024),
+            int(args.spill_max_mb * 1024 * 1024) if args.spill_max_mb is not None else None
+        )
+    else:
+        spill = None
 
-    rx_data_q = queue.Queue()
+    rx_data_q = RecordQueue(args.queue_size, args.queue_policy, spill)
 
-    core_th = threading.Thread(
-        target=core,
-        args=(
-            msock, dev, rx_data_q
+    if args.shm is not None:
+        shm_ring = ShmRing.create(
+            args.shm, args.shm_slots, int(args.shm_slot_kb * 1024), rx_data_q.epoch
+        )
+        print('shared memory', args.shm, shm_ring.slots, 'slots of', shm_ring.slot_bytes)
+        core_th = threading.Thread(
+            target=shm_core,
+            args=(shm_ring, rx_data_q, args),
+            daemon=True
+        )
+    elif args.fanout:
+        ring = FanoutRing(args.ring_size)
+        publisher_th = threading.Thread(
+            target=publisher,
+            args=(rx_data_q, ring, args),
+            daemon=True
+        )
+        publisher_th.start()
+        core_th = threading.Thread(
+            target=fanout_core,
+            args=(
+                msock, ring, rx_data_q.epoch, args
+            )
+        )
+    else:
+        retention = RetentionWindow(args.retention)
+        core_th = threading.Thread(
+            target=core,
+            args=(
+                msock, dev, rx_data_q, retention, args
+            )
         )
-    )
     core_th.start()
 
-    rx_thread(
-        cfg,
-        dev,
-        rx_data_q,
-        num_buffers,
-        buffer_size,
-        sps,
-        bw,
-        args
-    )
+    try:
+        rx_thread(
+            cfg,
+            dev,
+            rx_data_q,
+            num_buffers,
+            buffer_size,
+            sps,
+            bw,
+            args
+        )
+    finally:
+        if args.shm is not None:
+            shm_ring.close()
 
-def core(msock, dev, rx_data_q):
+def core(msock, dev, rx_data_q, retention, args):
     """The TCP client core loop.
 
     This function handles exceptions from the client.
@@ -88,7 +147,9 @@ def core(msock, dev, rx_data_q):
             _inner(
                 sock,
                 dev,
-                rx_data_q
+                rx_data_q,
+                retention,
+                args
             )
         except bsocket.SocketException:
             print('socket exception')
@@ -96,22 +157,378 @@ def core(msock, dev, rx_data_q):
             print('connection reset error')
         except BrokenPipeError:
             print('broken pipe error')
+        finally:
+            rx_data_q.set_live(False)
+            sock.close()
+
+def handshake(sock, epoch, args):
+    """Reads the client hello and answers it.
+
+    Returns the protocol, the `seq` the client last received if it
+    was reading this same server run or `None`, the client
+    `Subscription` or `None`, and the `CreditGate` of a client using
+    flow control or `None`. A subscription that can not be parsed is
+    reported back to the client and everything is sent. The credit
+    grants are read on a thread started here.
+    """
+    proto, hello = wire.read_hello(sock, args.hello_timeout)
+    resume = None
+    sub = None
+    gate = None
+    if hello is not None:
+        if proto > 0 and hello.get('epoch') == epoch and hello.get('seq') is not None:
+            # Pickle clients do not track the seq so they are never resumed.
+            resume = hello['seq']
+        error = None
+        if hello.get('subscribe') is not None:
+            try:
+                sub = Subscription(hello['subscribe'])
+            except (ValueError, TypeError, AttributeError) as e:
+                error = 'bad subscription: %s' % e
+                print(error)
+        if proto > 0:
+            gate = CreditGate.from_hello(hello.get('credit'))
+        wire.send_ack(
+            sock, proto, epoch=epoch, subscribed=sub is not None,
+            credit=gate is not None, error=error
+        )
+        if gate is not None:
+            threading.Thread(target=read_grants, args=(sock, gate), daemon=True).start()
+    print('client protocol', proto, 'resume after', resume, 'subscription', hello and hello.get('subscribe'))
+    if gate is not None:
+        print('client flow control', gate.report())
+    return proto, resume, sub, gate
+
+def fanout_core(msock, ring, epoch, args):
+    """The TCP accept loop when many clients may connect.
+
+    Each client is served by its own thread.
+    """
+    while True:
+        sock, addr = msock.accept()
+        print('subscriber connected', addr)
+        th = threading.Thread(
+            target=_subscriber,
+            args=(sock, ring, epoch, args),
+            daemon=True
+        )
+        th.start()
+
+def _subscriber(sock, ring, epoch, args):
+    """Sends the published batches to one client.
+
+    The batches are encoded once and shared by every client. A client
+    that resumes starts at the batches it missed if they are still in
+    the ring.
+    """
+    sub = None
+    try:
+        proto, resume, filt, gate = handshake(sock, epoch, args)
+        sub, behind = ring.subscribe(args.lag_limit, resume)
+        if resume is not None:
+            print('resuming %d batches back' % behind)
+        while True:
+            if gate is not None:
+                # Without credit the cursor falls behind and the lag
+                # limit applies.
+                while not gate.wait(1.0):
+                    pass
+            entries = ring.read(sub, 64 if gate is None else 1)
+            if filt is None:
+                parts = [
+                    entry.data(proto, args.wire_dtype, args.compress_level)
+                    for entry in entries
+                ]
+                bsocket.send_parts(sock, parts)
+                if gate is not None:
+                    gate.spend(
+                        sum(len(entry.records) for entry in entries),
+                        sum(len(part) for part in parts)
+                    )
+                continue
+            # A filtered client gets its own encoding.
+            records = []
+            for entry in entries:
+                records.extend(filt.apply(entry.records))
+            if len(records) > 0:
+                sent = _send(sock, records, proto, args)
+                if gate is not None:
+                    gate.spend(len(records), sent)
+    except bsocket.SocketException:
+        print('socket exception')
+    except ConnectionResetError:
+        print('connection reset error')
+    except BrokenPipeError:
+        print('broken pipe error')
+    finally:
+        if sub is not None:
+            ring.unsubscribe(sub)
+        sock.close()
+
+def publisher(rx_data_q, ring, args):
+    """Moves measurements from the queue into the fan out ring.
+
+    Nothing is taken off the queue while no client is subscribed so
+    the queue policy and the spill log work as they do with a single
+    client. The spill log is published first and no faster than the
+    slowest client takes it.
+    """
+    lt = time.time()
+    while True:
+        ring.wait_subscribers()
+
+        for batch in spilled_batches(rx_data_q, args):
+            ring.wait_room()
+            ring.publish(batch)
+
+        while len(ring.subscribers) > 0:
+            ring.publish(
+                rx_data_q.get_batch(args.batch_size, args.batch_ms / 1000.0)
+            )
+            if time.time() - lt > 10:
+                print(ring.report())
+                lt = time.time()
+
+        rx_data_q.set_live(False)
+
+def spilled_batches(rx_data_q, args):
+    """Yields the spill log in batches oldest first.
+
+    A segment is deleted once all of its batches were taken and the
+    queue becomes live once the log is empty.
+    """
+    if rx_data_q.spill is None:
+        return
+    while True:
+        segs = rx_data_q.spill_segments()
+        if len(segs) == 0:
+            break
+        for path in segs:
+            batch = []
+            try:
+                for item in SpillLog.read_items(path):
+                    batch.append(item)
+                    if len(batch) >= args.batch_size:
+                        yield batch
+                        batch = []
+            except FileNotFoundError:
+                # Dropped by --spill-max-mb since it was sealed.
+                print('spill segment', path, 'was dropped before it was replayed')
+                continue
+            if len(batch) > 0:
+                yield batch
+            rx_data_q.remove_spilled(path)
+            print('replayed', path)
+
+def shm_core(ring, rx_data_q, args):
+    """Moves measurements from the queue into a shared memory ring.
+
+    Like the TCP loops nothing is taken off the queue while the client
+    is not polling the ring so the queue policy and the spill log work
+    the same. The read position is kept in the ring so a client that
+    restarts continues where it stopped and no resume is needed.
+    """
+    lt = time.time()
+    while True:
+        while not ring.reader_alive(args.shm_timeout):
+            time.sleep(0.1)
+        print('shared memory client polling')
+
+        for batch in spilled_batches(rx_data_q, args):
+            shm_put(ring, batch, args)
+
+        while ring.reader_alive(args.shm_timeout):
+            batch = rx_data_q.get_batch(args.batch_size, args.batch_ms / 1000.0)
+            if len(batch) > 0:
+                shm_put(ring, batch, args)
+            if time.time() - lt > 10:
+                print(rx_data_q.report(), 'ring used', ring.used())
+                lt = time.time()
+
+        print('shared memory client stopped polling')
+        rx_data_q.set_live(False)
+
+def shm_put(ring, batch, args):
+    """Writes a batch into the ring as one or more frames.
+
+    A batch whose frame does not fit a slot is split. This waits for
+    room while the ring is full.
+    """
+    data = wire.encode(batch, args.wire_dtype, level=args.compress_level)
+    if len(data) > ring.max_data():
+        if len(batch) == 1:
+            print('measurement of %d bytes does not fit a slot, dropped' % len(data))
+            return
+        half = len(batch) // 2
+        shm_put(ring, batch[:half], args)
+        shm_put(ring, batch[half:], args)
+        return
+    while not ring.put(data):
+        time.sleep(0.001)
 
-def _inner(sock, dev, rx_data_q):
+def _inner(sock, dev, rx_data_q, retention, args):
     """The core client loop function.
 
     This is a simple function that moves data from
-    the queue to the client.
+    the queue to the client. Clients that send a hello get
+    binary frames and others get one pickle per measurement.
+
+    Up to `--batch-size` measurements or what arrives within
+    `--batch-ms` are sent at once. For binary clients they are one
+    frame which may be compressed.
+
+    Sent measurements are kept in `retention` and a client that
+    resumes is first sent those it missed. A client subscription is
+    applied before encoding.
+
+    A client using flow control is only sent what it has credit for.
+    While it has none nothing is taken off the queue and the queue
+    stops being live so the queue policy or the spill log take over.
     """
+    proto, resume, filt, gate = handshake(sock, rx_data_q.epoch, args)
+
+    if resume is not None:
+        missed = retention.after(resume)
+        print('resending', len(missed))
+        _send_records(sock, missed, proto, filt, args, gate)
+
+    if rx_data_q.spill is not None:
+        replay_spill(sock, rx_data_q, retention, proto, filt, args, gate)
+
+    sent_cnt = 0
+    frame_cnt = 0
+    byte_cnt = 0
+    lt = time.time()
+    stalled = False
+
     while True:
-        ret = rx_data_q.get()
-        print('sending')
-        bsocket.send_pickle(sock, ret)
+        max_items = args.batch_size
+        if gate is not None:
+            if not gate.wait(1.0):
+                if not stalled:
+                    print('client is out of credit')
+                    stalled = True
+                    rx_data_q.set_live(False)
+                continue
+            if stalled:
+                print('client granted credit')
+                stalled = False
+                if rx_data_q.spill is not None:
+                    replay_spill(sock, rx_data_q, retention, proto, filt, args, gate)
+            max_items = gate.limit(args.batch_size)
+
+        batch = rx_data_q.get_batch(max_items, args.batch_ms / 1000.0)
+        # Kept before sending so a failed send can be resumed.
+        retention.add(batch)
+        if filt is not None:
+            batch = filt.apply(batch)
+            if len(batch) == 0:
+                continue
+        nbytes = _send(sock, batch, proto, args)
+        if gate is not None:
+            gate.spend(len(batch), nbytes)
+
+        sent_cnt += len(batch)
+        frame_cnt += 1
+        byte_cnt += nbytes
+        if time.time() - lt > 10:
+            print('sent %d measurements in %d sends, %.1f bytes per measurement' % (
+                sent_cnt, frame_cnt, byte_cnt / sent_cnt
+            ))
+            if gate is not None:
+                print(gate.report())
+            lt = time.time()
+
+def replay_spill(sock, rx_data_q, retention, proto, filt, args, gate=None):
+    """Sends the spilled measurements before the live ones.
+
+    The spill segments hold frames in the same format as `send_pickle`
+    so for pickle clients they are sent in large chunks without
+    decoding. For binary clients they are decoded and sent as binary
+    frames. Measurements keep spilling while this runs and once the
+    log is empty the queue becomes live. Segments dropped by
+    --spill-max-mb before they are reached are skipped.
+    """
+    while True:
+        segs = rx_data_q.spill_segments()
+        if len(segs) == 0:
+            break
+        for path in segs:
+            st = time.time()
+            sent = 0
+            try:
+                if proto == 0:
+                    for chunk in SpillLog.read_chunks(path):
+                        sock.sendall(chunk)
+                        sent += len(chunk)
+                else:
+                    batch = []
+                    for item in SpillLog.read_items(path):
+                        batch.append(item)
+                        if len(batch) >= args.batch_size:
+                            sent += _send_replayed(sock, batch, retention, proto, filt, args, gate)
+                            batch = []
+                    if len(batch) > 0:
+                        sent += _send_replayed(sock, batch, retention, proto, filt, args, gate)
+            except FileNotFoundError:
+                print('spill segment', path, 'was dropped before it was replayed')
+                continue
+            rx_data_q.remove_spilled(path)
+            dt = max(time.time() - st, 1e-6)
+            print('replayed %s %d bytes at %.1f MB/s' % (path, sent, sent / dt / 1e6))
+
+def _send_replayed(sock, batch, retention, proto, filt, args, gate=None) -> int:
+    """Sends a batch read from the spill log to a binary client.
+
+    Returns the number of bytes sent.
+    """
+    retention.add(batch)
+    return _send_records(sock, batch, proto, filt, args, gate)
+
+def _send(sock, batch, proto, args) -> int:
+    """Sends one batch as pickles or as one binary frame.
+
+    Returns the number of bytes sent with their length prefixes.
+    """
+    if proto == 0:
+        data = bsocket.pack_pickles(batch)
+        bsocket.send_exact(sock, data)
+        return len(data)
+    data = wire.encode(
+        batch, args.wire_dtype, level=args.compress_level, version=proto
+    )
+    bsocket.send_frame(sock, data)
+    return len(data) + 4
+
+def _send_records(sock, records, proto, filt, args, gate=None) -> int:
+    """Sends measurements that are not live, such as resent or replayed ones.
+
+    They are filtered and sent in batches like the live ones. With a
+    `gate` each batch waits for credit and is no larger than it.
+    Returns the number of bytes sent.
+    """
+    if filt is not None:
+        records = filt.apply(records)
+    sent = 0
+    pos = 0
+    while pos < len(records):
+        count = args.batch_size
+        if gate is not None:
+            while not gate.wait(1.0):
+                pass
+            count = gate.limit(count)
+        batch = records[pos:pos + count]
+        pos += len(batch)
+        nbytes = _send(sock, batch, proto, args)
+        if gate is not None:
+            gate.spend(len(batch), nbytes)
+        sent += nbytes
+    return sent
 
 def rx_thread(
         cfg: dict[any, any],
         dev: BladeRFAndNumpy,
-        rx_data_q: queue.Queue,
+        rx_data_q: RecordQueue,
         num_buffers: int,
         buffer_size: int,
         sps: int,
@@ -141,59 +558,127 @@ def rx_thread(
 
     samp_count = 25000
 
-    if args.channel_bw is not None:
-        slide_cnt = int(sps / args.channel_bw)
-        t = samp_count / sps
-        shifter = np.exp(1j * np.linspace(
-            0, np.pi * 2 * -args.channel_bw * t, samp_count
-        ))
-        shifter_filter = signal.butter(8, args.channel_bw, btype='low', output='sos', fs=sps)
-
-    while True:
-        freq = random.randint(
-            int(float(cfg['freq-min'])), 
-            int(float(cfg['freq-max']))
+    if args.channel_bw is not None and args.workers == 0:
+        chz = channelizer.get_plan(
+            args.channelizer,
+            sps,
+            args.channel_bw,
+            samp_count,
+            np.complex128,
+            args.plan_cache
         )
-        dev.set_frequency(0, freq)
-        dev.sample_as_f64(buffer_samps, 2, 4, 0)
-        b0, b1 = dev.sample_as_f64(samp_count, 2, 4, 0)
-        b0m = np.mean(np.abs(b0))
-        b1m = np.mean(np.abs(b1))
-
-        if args.channel_bw is not None:
-            dbg = []
-            cout = []
-            b0b = b0.copy()
-            b1b = b1.copy()
-            for slide_ndx in range(slide_cnt):
-                cur_center = slide_ndx * args.channel_bw
-                if cur_center > sps * 0.5:
-                    cur_center = -(sps * 0.5) + (cur_center - sps * 0.5)
-                b0bf = np.mean(np.abs(signal.sosfilt(shifter_filter, b0b)))
-                b1bf = np.mean(np.abs(signal.sosfilt(shifter_filter, b1b)))
-                cout.append({
-                    'freq': cur_center,
-                    'b0': b0bf,
-                    'b1': b1bf,
-                })
-                b0b *= shifter
-                b1b *= shifter                
+
+    if args.retune == 'quicktune':
+        # Quick tune entries only exist for a grid of frequencies.
+        quantize = args.quick_tune_step or sps
+    else:
+        quantize = None
+
+    scheduler = hopschedule.create(
+        args.scheduler,
+        cfg['freq-min'],
+        cfg['freq-max'],
+        sps,
+        quantize,
+        cfg.get('priority', None)
+    )
+    pick_freq = scheduler.next
+
+    if args.settle == 'timestamp':
+        settle_time = args.settle_time
+        if settle_time is None:
+            settle_time = tuning.measure_settle_time(
+                dev, sps, [pick_freq() for _ in range(8)]
+            )
+            print('measured settle time', settle_time)
+        settle_samps = int(settle_time * sps)
+
+        if args.retune == 'quicktune':
+            tuner = tuning.QuickTuneTuner(
+                dev,
+                settle_samps,
+                tuning.QuickTuneTable(dev, scheduler.grid()),
+                buffer_size
+            )
         else:
-            cout = None
-
-        while rx_data_q.qsize() > 100:
-            time.sleep(0)
-
-        print('loaded', freq, b0m, b1m)
-        rx_data_q.put({
-            'time': time.time(),
-            'freq': freq, 
-            'b0': b0m, 
-            'b1': b1m, 
-            'bw': bw,
-            'sps': sps,
-            'channel': cout,
-        })
+            tuner = tuning.TimestampTuner(dev, settle_samps)
+    else:
+        tuner = tuning.BufferTuner(dev, buffer_samps)
+
+    raw = np.zeros((samp_count, 2, 2), np.int16)
+    # The conversion outputs are reused for every hop.
+    cbuf = [np.empty(samp_count, np.complex128) for _ in range(2)]
+    mag = np.empty(samp_count, np.float64)
+
+    if args.workers > 0:
+        pipeline = CapturePipeline(
+            args.workers,
+            samp_count,
+            sps,
+            bw,
+            args.channel_bw,
+            args.channelizer,
+            args.plan_cache,
+            rx_data_q
+        )
+    else:
+        pipeline = None
+
+    try:
+        hop_cnt = 0
+        hop_st = time.time()
+
+        freq = pick_freq()
+
+        while True:
+            if time.time() - hop_st > 10:
+                print('hops/sec %.2f' % (hop_cnt / (time.time() - hop_st)))
+                print(scheduler.coverage.report())
+                print(rx_data_q.report())
+                hop_cnt = 0
+                hop_st = time.time()
+
+            cur_freq = freq
+            freq = pick_freq()
+
+            if pipeline is not None:
+                # Only capture here. The workers convert and channelize.
+                slot_ndx, slot = pipeline.acquire()
+                if not tuner.capture(cur_freq, freq, slot):
+                    pipeline.release(slot_ndx)
+                    continue
+                pipeline.submit(slot_ndx, cur_freq, time.time())
+                scheduler.captured(cur_freq)
+                hop_cnt += 1
+                continue
+
+            if not tuner.capture(cur_freq, freq, raw):
+                continue
+            scheduler.captured(cur_freq)
+            hop_cnt += 1
+
+            b0, b1 = sc16_to_complex(raw, out=cbuf)
+            b0m = np.mean(np.abs(b0, out=mag))
+            b1m = np.mean(np.abs(b1, out=mag))
+
+            if args.channel_bw is not None:
+                cout = chz(b0, b1)
+            else:
+                cout = None
+
+            print('loaded', cur_freq, b0m, b1m)
+            rx_data_q.put({
+                'time': time.time(),
+                'freq': cur_freq, 
+                'b0': b0m, 
+                'b1': b1m, 
+                'bw': bw,
+                'sps': sps,
+                'channel': cout,
+            })
+    finally:
+        if pipeline is not None:
+            pipeline.close()
 
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
@@ -205,5 +690,63 @@ if __name__ == '__main__':
     ap.add_argument('--bw', type=float, default=None, help=bw_help)
     cbw_help = 'This controls the channel bandwidth. If specified the baseband is broken down into channels.'
     ap.add_argument('--channel-bw', type=float, default=None, help=cbw_help)
+    chz_help = 'This selects how channels are computed. The pfb channelizer uses a polyphase filter bank and is much faster for narrow channels.'
+    ap.add_argument('--channelizer', type=str, default='sosfilt', choices=list(channelizer.CHANNELIZERS), help=chz_help)
+    pc_help = 'A directory used to cache the designed channelizer filters so they are not designed again on restart.'
+    ap.add_argument('--plan-cache', type=str, default=None, help=pc_help)
+    sim_help = 'Use a simulated device instead of hardware. The value is the path to a scene YAML file. See sim-scene-example.yaml.'
+    ap.add_argument('--simulate', type=str, default=None, help=sim_help)
+    workers_help = 'The number of worker processes used to convert and channelize captures. With zero the capture and processing are done in sequence.'
+    ap.add_argument('--workers', type=int, default=0, help=workers_help)
+    settle_help = 'How the samples are discarded after a retune. With buffer a fixed number of samples is read and thrown away. With timestamp the capture starts at a device timestamp the settle time after the retune.'
+    ap.add_argument('--settle', type=str, default='buffer', choices=['buffer', 'timestamp'], help=settle_help)
+    st_help = 'The settle time in seconds used with --settle timestamp. If not specified it is measured at startup.'
+    ap.add_argument('--settle-time', type=float, default=None, help=st_help)
+    retune_help = 'How the card is retuned. With quicktune a quick tune table is built for a grid of frequencies and the retune to the next frequency is scheduled while the current capture is in flight. This requires --settle timestamp.'
+    ap.add_argument('--retune', type=str, default='set', choices=['set', 'quicktune'], help=retune_help)
+    qts_help = 'The spacing of the quick tune frequency grid in hertz. Defaults to the sample rate.'
+    ap.add_argument('--quick-tune-step', type=float, default=None, help=qts_help)
+    sched_help = 'How the frequency of each hop is chosen. The random scheduler picks at random. The stratified scheduler visits every baseband wide cell of the band once per pass and the grid scheduler does the same at the cell centers so the channels tile exactly.'
+    ap.add_argument('--scheduler', type=str, default='random', choices=list(hopschedule.SCHEDULERS), help=sched_help)
+    qs_help = 'The number of measurements queued for the client before the queue policy applies.'
+    ap.add_argument('--queue-size', type=int, default=100, help=qs_help)
+    qp_help = 'What to do when the queue is full. The block policy pauses the capture until the client catches up, drop-oldest and drop-newest discard a measurement, and coalesce averages the new measurement into a queued one of the same frequency.'
+    ap.add_argument('--queue-policy', type=str, default='block', choices=rxqueue.POLICIES, help=qp_help)
+    spill_help = 'A directory where measurements are written when the queue is full and no client is connected. They are sent to the next client before the live measurements.'
+    ap.add_argument('--spill-dir', type=str, default=None, help=spill_help)
+    ssm_help = 'The size in megabytes at which a new spill segment is started.'
+    ap.add_argument('--spill-segment-mb', type=float, default=64.0, help=ssm_help)
+    smm_help = 'The most megabytes kept in the spill directory. The oldest segments are deleted past it. Unlimited if not specified.'
+    ap.add_argument('--spill-max-mb', type=float, default=None, help=smm_help)
+    ht_help = 'How long in seconds to wait for a client hello before falling back to sending pickles.'
+    ap.add_argument('--hello-timeout', type=float, default=0.5, help=ht_help)
+    wd_help = 'The type of the channel arrays in binary frames. float32 halves their size.'
+    ap.add_argument('--wire-dtype', type=str, default='float64', choices=list(wire.CHANNEL_CODES), help=wd_help)
+    bs_help = 'The most measurements sent to the client at once.'
+    ap.add_argument('--batch-size', type=int, default=64, help=bs_help)
+    bms_help = 'How long in milliseconds to wait for more measurements before sending a batch that is not full.'
+    ap.add_argument('--batch-ms', type=float, default=20.0, help=bms_help)
+    cl_help = 'The zlib level used to compress binary frames. Zero sends them uncompressed.'
+    ap.add_argument('--compress-level', type=int, default=0, choices=range(10), help=cl_help)
+    fo_help = 'Let any number of clients connect. Each measurement is encoded once and sent to every client.'
+    ap.add_argument('--fanout', action='store_true', default=False, help=fo_help)
+    rs_help = 'The number of batches kept for the clients with --fanout.'
+    ap.add_argument('--ring-size', type=int, default=256, help=rs_help)
+    ll_help = 'How many batches a client may fall behind with --fanout before it skips ahead to newer ones.'
+    ap.add_argument('--lag-limit', type=int, default=128, help=ll_help)
+    ret_help = 'The number of sent measurements kept for a client that reconnects and resumes. With --fanout the ring is used instead.'
+    ap.add_argument('--retention', type=int, default=1000, help=ret_help)
+    shm_help = 'Hand measurements to a client on the same host through a shared memory segment of this name instead of TCP.'
+    ap.add_argument('--shm', type=str, default=None, help=shm_help)
+    shs_help = 'The number of slots in the shared memory ring. Each slot holds one batch.'
+    ap.add_argument('--shm-slots', type=int, default=1024, help=shs_help)
+    shk_help = 'The size of a shared memory slot in kilobytes. Batches that do not fit are split.'
+    ap.add_argument('--shm-slot-kb', type=float, default=64.0, help=shk_help)
+    sht_help = 'How long in seconds the client may go without polling the shared memory ring before it is treated as disconnected.'
+    ap.add_argument('--shm-timeout', type=float, default=2.0, help=sht_help)
     args = ap.parse_args()
+    if args.retune == 'quicktune' and args.settle != 'timestamp':
+        ap.error('--retune quicktune requires --settle timestamp')
+    if args.channelizer == 'pfb' and args.channel_bw is not None and not channelizer.whole_channels(args.sps, args.channel_bw):
+        ap.error('--channelizer pfb requires --sps to be a whole multiple of --channel-bw')
     secondary(args.serial, args.config, args.sps, args.bw, args)
\ No newline at end of file
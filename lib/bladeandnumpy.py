@@ -2,11 +2,109 @@ import bladerf
 import numpy as np
 import numpy.typing as npt
 
+SC16_SCALE = 1.0 / 2049
+
+def sc16_view(buf, chan_cnt: int = 2) -> npt.NDArray:
+    """Views a `bytearray` or numpy buffer as an `(n, chan_cnt, 2)` int16 array.
+
+    Nothing is copied. Any bytes past the last whole sample are left
+    out of the view.
+    """
+    if isinstance(buf, np.ndarray):
+        buf = buf.reshape(-1).view(np.uint8)
+    samp_bytes = chan_cnt * 4
+    samps = len(buf) // samp_bytes
+    return np.ndarray((samps, chan_cnt, 2), np.int16, buffer=buf)
+
+def sc16_to_complex(raw: npt.NDArray, dtype=np.complex128, out: list = None):
+    """Converts an `(n, chan_cnt, 2)` int16 SC16_Q11 array to complex.
+
+    Returns one array per channel scaled the same way as `sample_as_f64`.
+    If `out` is given it must hold one complex64 or complex128 array of
+    length `n` per channel and the samples are converted into them
+    without any temporaries.
+    """
+    if out is None:
+        out = [np.empty(raw.shape[0], dtype) for _ in range(raw.shape[1])]
+    for ch, b in enumerate(out):
+        # A complex array is a float array of interleaved real and
+        # imaginary parts which is the layout of the raw samples.
+        pairs = b.view(b.real.dtype).reshape(-1, 2)
+        np.multiply(raw[:, ch, :], SC16_SCALE, out=pairs, casting='unsafe')
+    return out
+
+def sc16_iq(raw: npt.NDArray, ch: int):
+    """Returns int16 views of the in phase and quadrature parts of a channel.
+    """
+    return raw[:, ch, 0], raw[:, ch, 1]
+
+def sc16_power(raw: npt.NDArray, ch: int, out: npt.NDArray, scratch: npt.NDArray):
+    """Computes `i * i + q * q` of a channel with integers only.
+
+    `out` and `scratch` are caller owned int32 arrays of length `n`.
+    The result is the squared magnitude in raw units which is exact
+    since a SC16_Q11 sample is 12 bits.
+    """
+    i, q = sc16_iq(raw, ch)
+    np.multiply(i, i, out=out, dtype=np.int32)
+    np.multiply(q, q, out=scratch, dtype=np.int32)
+    out += scratch
+    return out
+
 class BladeRFAndNumpy(bladerf.BladeRF):
     """A helper class that assists in converting the raw samples from the BladeRF
     card into a Numpy array of floating point numbers. *It currently does not support
     8-bit samples but could easily be modified to do so.*
+
+    The read buffers are kept between calls and only grow so repeated
+    reads of the same size do not allocate.
     """
+    def _rx_buffer(self, name: str, total_bytes: int) -> bytearray:
+        """Returns a cached `bytearray` of at least `total_bytes`.
+        """
+        buf = getattr(self, name, None)
+        if buf is None or len(buf) < total_bytes:
+            buf = bytearray(total_bytes)
+            setattr(self, name, buf)
+        return buf
+
+    def _read_raw(
+            self,
+            samps: int,
+            chan_cnt: int,
+            samp_size: int,
+            trash_samps: int,
+            when_timestamp: int = None):
+        """Reads into the cached buffer and returns an int16 view of the kept samples.
+
+        If `when_timestamp` is given the read starts at that device
+        timestamp. The view is only valid until the next read.
+        """
+        debug_tail = 8
+        data_bytes = (trash_samps + samps) * (samp_size * chan_cnt)
+        buf = self._rx_buffer('_raw_buf', data_bytes + debug_tail)
+        buf[data_bytes:data_bytes + debug_tail] = bytes(debug_tail)
+
+        if when_timestamp is None:
+            self.sync_rx(
+                buf,
+                (trash_samps + samps) * chan_cnt,
+                timeout_ms=5000
+            )
+        else:
+            self.sync_rx_with_metadata(
+                buf,
+                (trash_samps + samps) * chan_cnt,
+                meta_flags = 1 << 31,
+                meta_timestamp = when_timestamp,
+                timeout_ms=20000
+            )
+
+        assert (buf[data_bytes:data_bytes + debug_tail] == b'\x00' * debug_tail)
+
+        mv = memoryview(buf)[trash_samps * (samp_size * chan_cnt):data_bytes]
+        return sc16_view(mv, chan_cnt)
+
     def sample_as_null(
             self,
             samps: int,
@@ -22,7 +120,7 @@ class BladeRFAndNumpy(bladerf.BladeRF):
         debug_tail = 8
         total_bytes = \
             (trash_samps + samps) * (samp_size * chan_cnt) + debug_tail
-        buf = bytes(total_bytes)
+        buf = self._rx_buffer('_trash_buf', total_bytes)
 
         self.sync_rx(
             buf,
@@ -37,6 +135,69 @@ class BladeRFAndNumpy(bladerf.BladeRF):
         else:
             raise Exception('unexpected channel count')
 
+    def sample_into_i16(
+            self,
+            out,
+            trash_samps: int = 1000,
+            timestamp: int = None
+            ):
+        """Fills a caller owned `(n, chan_cnt, 2)` int16 array with samples.
+
+        No conversion is done so the raw samples can be handed to
+        another process, for example through shared memory. A
+        `bytearray` may be passed instead and is filled as two channels.
+        Use `sc16_view` to look at it as samples.
+
+        If `timestamp` is given the samples start exactly at that device
+        timestamp and `trash_samps` is ignored. The library discards
+        anything before it so nothing is converted just to be thrown
+        away. This requires the stream to be configured with
+        `Format.SC16_Q11_META`. The timestamp of the first sample is
+        returned.
+        """
+        if not isinstance(out, np.ndarray):
+            out = sc16_view(out)
+        samps, chan_cnt, _ = out.shape
+        trash_samps = int(trash_samps)
+
+        if timestamp is not None:
+            _status, _actual_count, ts = self.sync_rx_with_metadata(
+                out,
+                samps * chan_cnt,
+                timeout_ms=5000,
+                meta_flags=0,
+                meta_timestamp=int(timestamp)
+            )
+            return ts
+
+        if trash_samps > 0:
+            self.sync_rx(
+                self._rx_buffer('_trash_buf', trash_samps * chan_cnt * 4),
+                trash_samps * chan_cnt,
+                timeout_ms=5000
+            )
+
+        self.sync_rx(out, samps * chan_cnt, timeout_ms=5000)
+        return None
+
+    def sample_into_complex(
+            self,
+            raw: npt.NDArray,
+            out: list,
+            trash_samps: int = 1000,
+            timestamp: int = None
+            ):
+        """Fills `raw` like `sample_into_i16` then converts it into `out`.
+
+        `out` holds one preallocated complex64 or complex128 array per
+        channel. Nothing is allocated per call.
+        """
+        ts = self.sample_into_i16(raw, trash_samps, timestamp)
+        if not isinstance(raw, np.ndarray):
+            raw = sc16_view(raw)
+        sc16_to_complex(raw, out=out)
+        return ts
+
     def sample_as_f64(
             self,
             samps: int,
@@ -49,35 +210,16 @@ class BladeRFAndNumpy(bladerf.BladeRF):
         chan_cnt = int(chan_cnt)
         trash_samps = int(trash_samps)
 
-        debug_tail = 8
-        total_bytes = \
-            (trash_samps + samps) * (samp_size * chan_cnt) + debug_tail
-        buf = bytes(total_bytes)
-
-        self.sync_rx(
-            buf, 
-            (trash_samps + samps) * chan_cnt,
-            timeout_ms=5000
-        )
-
-        assert (buf[-debug_tail:] == b'\x00' * debug_tail)
-
-        buf = buf[trash_samps * (samp_size * chan_cnt):-debug_tail]
-
-        sbuf = np.ndarray((len(buf) // 2,), buffer=buf, dtype=np.int16)
-        del buf
+        if chan_cnt not in (1, 2):
+            raise Exception('unexpected channel count')
 
-        sbuf = sbuf.astype(np.float64) / 2049
+        raw = self._read_raw(samps, chan_cnt, samp_size, trash_samps)
+        out = sc16_to_complex(raw, np.complex128)
 
         if chan_cnt == 2:
-            b0 = sbuf[0::2][0::2] + 1j * sbuf[1::2][0::2]
-            b1 = sbuf[0::2][1::2] + 1j * sbuf[1::2][1::2]
-            return b0, b1
-        elif chan_cnt == 1:
-            b0 = sbuf[0::2] + 1j * sbuf[1::2]
-            return b0
+            return out[0], out[1]
         else:
-            raise Exception('unexpected channel count')
+            return out[0]
 
     def sample_as_f32(
             self,
@@ -91,35 +233,16 @@ class BladeRFAndNumpy(bladerf.BladeRF):
         chan_cnt = int(chan_cnt)
         trash_samps = int(trash_samps)
 
-        debug_tail = 8
-        total_bytes = \
-            (trash_samps + samps) * (samp_size * chan_cnt) + debug_tail
-        buf = bytes(total_bytes)
-
-        self.sync_rx(
-            buf, 
-            (trash_samps + samps) * chan_cnt,
-            timeout_ms=5000
-        )
-
-        assert (buf[-debug_tail:] == b'\x00' * debug_tail)
-
-        buf = buf[trash_samps * (samp_size * chan_cnt):-debug_tail]
-
-        sbuf = np.ndarray((len(buf) // 2,), buffer=buf, dtype=np.int16)
-        del buf
+        if chan_cnt not in (1, 2):
+            raise Exception('unexpected channel count')
 
-        sbuf = sbuf.astype(np.float32) / 2049
+        raw = self._read_raw(samps, chan_cnt, samp_size, trash_samps)
+        out = sc16_to_complex(raw, np.complex64)
 
         if chan_cnt == 2:
-            b0 = sbuf[0::2][0::2] + 1j * sbuf[1::2][0::2]
-            b1 = sbuf[0::2][1::2] + 1j * sbuf[1::2][1::2]
-            return b0, b1
-        elif chan_cnt == 1:
-            b0 = sbuf[0::2] + 1j * sbuf[1::2]
-            return b0
+            return out[0], out[1]
         else:
-            raise Exception('unexpected channel count')
+            return out[0]
 
     def sample_as_f64_with_meta(
             self,
@@ -134,38 +257,17 @@ class BladeRFAndNumpy(bladerf.BladeRF):
         chan_cnt = int(chan_cnt)
         trash_samps = int(trash_samps)
 
-        debug_tail = 8
-        total_bytes = \
-            (trash_samps + samps) * (samp_size * chan_cnt) + debug_tail
-        buf = bytes(total_bytes)
+        if chan_cnt not in (1, 2):
+            raise Exception('unexpected channel count')
 
         print('meta_timestamp', when_timestamp, self.get_timestamp(bladerf.Direction.RX))
         print('samps', samps, 'chan_cnt', chan_cnt, 'trash_samps', trash_samps)
         print('(trash_samps + samps) * chan_cnt', (trash_samps + samps) * chan_cnt)
 
-        status, actual_count, timestamp = self.sync_rx_with_metadata(
-            buf, 
-            (trash_samps + samps) * chan_cnt,
-            meta_flags = 1 << 31,
-            meta_timestamp = when_timestamp,
-            timeout_ms=20000
-        )
-
-        assert (buf[-debug_tail:] == b'\x00' * debug_tail)
-
-        buf = buf[trash_samps * (samp_size * chan_cnt):]
-
-        sbuf = np.ndarray((len(buf) // 2,), buffer=buf, dtype=np.int16)
-        del buf
-
-        sbuf = sbuf.astype(np.float64) / 2049
+        raw = self._read_raw(samps, chan_cnt, samp_size, trash_samps, when_timestamp)
+        out = sc16_to_complex(raw, np.complex128)
 
         if chan_cnt == 2:
-            b0 = sbuf[0::2][0::2] + 1j * sbuf[1::2][0::2]
-            b1 = sbuf[0::2][1::2] + 1j * sbuf[1::2][1::2]
-            return b0, b1
-        elif chan_cnt == 1:
-            b0 = sbuf[0::2] + 1j * sbuf[1::2]
-            return b0
+            return out[0], out[1]
         else:
-            raise Exception('unexpected channel count')
+            return out[0]
@@ -1,4 +1,9 @@
 """Provides helper routines so I don't have to rewrite them each time.
+
+Receives are done with `recv_into` straight into the destination
+buffer and sends slice a `memoryview` so a partial write never copies
+the rest of the data. A length prefix and its payload are sent with
+one `sendmsg` call instead of being joined first.
 """
 import socket
 import pickle
@@ -7,64 +12,123 @@ import struct
 class SocketException(Exception):
     pass
 
-def recv_pickle(sock):
+class RecvBuffer:
+    """A reusable receive buffer that grows as needed.
+
+    The views it returns are only valid until the next `get`.
+    """
+    def __init__(self, size: int = 0x10000):
+        self.buf = bytearray(size)
+
+    def get(self, amount: int) -> memoryview:
+        if len(self.buf) < amount:
+            self.buf = bytearray(max(amount, len(self.buf) * 2))
+        return memoryview(self.buf)[:amount]
+
+def recv_frame(sock, rbuf: RecvBuffer = None):
+    """Receives a length prefixed message.
+
+    If `rbuf` is given the message is a view of it that is only valid
+    until the next receive. Otherwise a new `bytearray` is returned.
+    """
     sz = struct.unpack('>I', recv_exact(sock, 4))[0]
-    return pickle.loads(recv_exact(sock, sz))
+    return recv_exact(sock, sz, rbuf.get(sz) if rbuf is not None else None)
+
+def send_frame(sock, data):
+    """Sends a length prefixed message.
+    """
+    send_parts(sock, [struct.pack('>I', len(data)), data])
+
+def pack_pickles(objs):
+    """Returns the bytes `send_pickle` would send for each object in turn.
+
+    Sending them at once costs one call instead of one per object.
+    """
+    parts = []
+    for obj in objs:
+        data = pickle.dumps(obj)
+        parts.append(struct.pack('>I', len(data)))
+        parts.append(data)
+    return b''.join(parts)
+
+def recv_pickle(sock, rbuf: RecvBuffer = None):
+    return pickle.loads(recv_frame(sock, rbuf))
 
 def send_pickle(sock, obj):
-    data = pickle.dumps(obj)
-    sz_field = struct.pack('>I', len(data))
-    send_exact(sock, sz_field + data)
-
-def recv_exact(sock, amount):
-    buf = []
-    while amount > 0:
-        chunk = sock.recv(amount)
-        if not chunk:
+    send_frame(sock, pickle.dumps(obj))
+
+def recv_exact(sock, amount, out=None):
+    """Receives exactly `amount` bytes.
+
+    They are written into `out` if given, which must be a writable
+    buffer of `amount` bytes, and otherwise into a new `bytearray`.
+    """
+    if out is None:
+        out = bytearray(amount)
+    view = memoryview(out).cast('B')
+    got = 0
+    while got < amount:
+        n = sock.recv_into(view[got:amount])
+        if n == 0:
             raise SocketException()
-        amount -= len(chunk)
-        buf.append(chunk)
-    return b''.join(buf)
+        got += n
+    return out
 
 def send_exact(sock, data):
-    sent = 0
-    while sent < len(data):
-        wrote = sock.send(data[sent:])
+    view = memoryview(data).cast('B')
+    while len(view) > 0:
+        wrote = sock.send(view)
         if wrote < 1:
             raise SocketException()
-        sent += wrote
+        view = view[wrote:]
+
+def send_parts(sock, parts):
+    """Sends several buffers in order with scatter gather writes.
+    """
+    if not hasattr(sock, 'sendmsg'):
+        for part in parts:
+            send_exact(sock, part)
+        return
+
+    views = [memoryview(part).cast('B') for part in parts if len(part) > 0]
+    while len(views) > 0:
+        wrote = sock.sendmsg(views)
+        if wrote < 1:
+            raise SocketException()
+        while wrote > 0:
+            if wrote >= len(views[0]):
+                wrote -= len(views[0])
+                views.pop(0)
+            else:
+                views[0] = views[0][wrote:]
+                wrote = 0
 
 def recv_until_close(sock):
-    buf = []
+    buf = bytearray(0x10000)
+    got = 0
     while True:
-        chunk = sock.recv(0xffff)
-        if not chunk:
-            return b''.join(buf)
-        buf.append(chunk)   
+        if got == len(buf):
+            buf.extend(bytes(len(buf)))
+        n = sock.recv_into(memoryview(buf)[got:])
+        if n == 0:
+            return bytes(memoryview(buf)[:got])
+        got += n
 
 class bsocket(socket.socket):
-    def recv_exact(self, amount):
-        buf = []
-        while amount > 0:
-            chunk = self.recv(amount)
-            if not chunk:
-                raise SocketException()
-            amount -= len(chunk)
-            buf.append(chunk)
-        return b''.join(buf)
+    def recv_exact(self, amount, out=None):
+        return recv_exact(self, amount, out)
 
     def send_exact(self, data):
-        sent = 0
-        while sent < len(data):
-            wrote = self.send(data[sent:])
-            if wrote < 1:
-                raise SocketException()
-            sent += wrote
+        send_exact(self, data)
+
+    def send_parts(self, parts):
+        send_parts(self, parts)
+
+    def recv_frame(self, rbuf: RecvBuffer = None):
+        return recv_frame(self, rbuf)
+
+    def send_frame(self, data):
+        send_frame(self, data)
 
     def recv_until_close(self):
-        buf = []
-        while True:
-            chunk = self.recv(0xffff)
-            if not chunk:
-                return b''.join(buf)
-            buf.append(chunk)                
\ No newline at end of file
+        return recv_until_close(self)
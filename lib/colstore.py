@@ -0,0 +1,315 @@
+"""A columnar local store that is read through `np.memmap`.
+
+The pickle store written by `s3fetch.py` is one pickled
+`(key, [{'data': measurement, 'src_ndx': n}, ...])` per S3 object so
+reading a single channel value unpickles every dictionary around it.
+This store keeps the objects as blocks instead, one per object or
+one per block of a columnar package (see `lib.package`). A block is
+
+    header   magic 'NBCB', version, key length, hops, channels,
+             body bytes
+    body     the key padded to 8 bytes, then the arrays below
+    footer   magic 'NBCE', hops, min and max time, min and max freq,
+             block bytes
+
+and the body holds, each array starting on an 8 byte boundary,
+
+    per hop      time f8, freq i8, b0 f8, b1 f8, src u4
+    chan_start   i8 per hop plus one, where each hop's channels start
+    per channel  freq offset from the hop f8, b0 f8, b1 f8
+
+Everything is little endian. Opening a store walks the headers only
+and every array is a view of the mapped file so scanning it runs at
+disk speed. The footer lets blocks outside a time or frequency range
+be skipped without touching their arrays.
+
+The file is only appended to. A block that was cut short is found
+because its footer is missing and is truncated away by `ColumnWriter`.
+"""
+import os
+import pickle
+import struct
+import numpy as np
+
+VERSION = 1
+
+HEADER = struct.Struct('<4sHHIIQ')
+HEADER_MAGIC = b'NBCB'
+
+FOOTER = struct.Struct('<4sIddqqQ')
+FOOTER_MAGIC = b'NBCE'
+
+_HOP_FIELDS = [
+    ('time', '<f8'),
+    ('freq', '<i8'),
+    ('b0', '<f8'),
+    ('b1', '<f8'),
+    ('src', '<u4'),
+]
+
+_CHAN_FIELDS = [
+    ('chan_freq', '<f8'),
+    ('chan_b0', '<f8'),
+    ('chan_b1', '<f8'),
+]
+
+def _pad(n: int) -> int:
+    return (n + 7) & ~7
+
+def is_colstore(path: str) -> bool:
+    """Returns true if `path` exists and starts with a block.
+    """
+    try:
+        with open(path, 'rb') as fd:
+            return fd.read(len(HEADER_MAGIC)) == HEADER_MAGIC
+    except FileNotFoundError:
+        return False
+
+def encode_block(key: str, samples: list) -> bytes:
+    """Encodes the samples of one S3 object as a block.
+
+    `samples` is a list of `{'data': measurement, 'src_ndx': n}` as
+    kept in the pickle store.
+    """
+    nhops = len(samples)
+    hops = {name: np.zeros(nhops, dt) for name, dt in _HOP_FIELDS}
+    chan_start = np.zeros(nhops + 1, '<i8')
+    cfreq = []
+    cb0 = []
+    cb1 = []
+    for ndx, sample in enumerate(samples):
+        rec = sample['data']
+        hops['time'][ndx] = rec['time']
+        hops['freq'][ndx] = rec['freq']
+        hops['b0'][ndx] = rec['b0']
+        hops['b1'][ndx] = rec['b1']
+        hops['src'][ndx] = sample['src_ndx']
+        for c in rec.get('channel') or []:
+            cfreq.append(c['freq'])
+            cb0.append(c['b0'])
+            cb1.append(c['b1'])
+        chan_start[ndx + 1] = len(cfreq)
+    chans = {
+        'chan_freq': np.array(cfreq, '<f8'),
+        'chan_b0': np.array(cb0, '<f8'),
+        'chan_b1': np.array(cb1, '<f8'),
+    }
+
+    key_data = key.encode('utf8')
+    parts = [key_data, bytes(_pad(len(key_data)) - len(key_data))]
+    for name, _ in _HOP_FIELDS:
+        data = hops[name].tobytes()
+        parts.append(data)
+        parts.append(bytes(_pad(len(data)) - len(data)))
+    parts.append(chan_start.tobytes())
+    for name, _ in _CHAN_FIELDS:
+        parts.append(chans[name].tobytes())
+    body = b''.join(parts)
+
+    if nhops > 0:
+        freqs = hops['freq'].astype(np.float64)
+        if len(cfreq) > 0:
+            abs_freqs = np.repeat(freqs, np.diff(chan_start)) + chans['chan_freq']
+            freqs = np.concatenate([freqs, abs_freqs])
+        stats = (
+            float(hops['time'].min()), float(hops['time'].max()),
+            int(freqs.min()), int(freqs.max()),
+        )
+    else:
+        stats = (0.0, 0.0, 0, 0)
+
+    total = HEADER.size + len(body) + FOOTER.size
+    return b''.join([
+        HEADER.pack(HEADER_MAGIC, VERSION, len(key_data), nhops, len(cfreq), len(body)),
+        body,
+        FOOTER.pack(FOOTER_MAGIC, nhops, *stats, total),
+    ])
+
+def _walk(buf, end: int):
+    """Yields `(offset, header fields, footer fields)` of each whole block.
+    """
+    pos = 0
+    while pos + HEADER.size <= end:
+        magic, version, key_len, nhops, nchans, body_bytes = HEADER.unpack_from(buf, pos)
+        if magic != HEADER_MAGIC or version != VERSION:
+            return
+        fpos = pos + HEADER.size + body_bytes
+        if fpos + FOOTER.size > end:
+            return
+        footer = FOOTER.unpack_from(buf, fpos)
+        if footer[0] != FOOTER_MAGIC:
+            return
+        yield pos, (key_len, nhops, nchans, body_bytes), footer
+        pos = fpos + FOOTER.size
+
+class Block:
+    """The arrays of one block, all views of the mapped file.
+    """
+    def __init__(self, buf, pos: int, header: tuple, footer: tuple):
+        key_len, nhops, nchans, _ = header
+        _, _, self.min_time, self.max_time, self.min_freq, self.max_freq, _ = footer
+        self.nhops = nhops
+        self.nchans = nchans
+
+        off = pos + HEADER.size
+        self.key = bytes(buf[off:off + key_len]).decode('utf8')
+        off += _pad(key_len)
+        for name, dt in _HOP_FIELDS:
+            arr = np.ndarray(nhops, dt, buf, off)
+            setattr(self, name, arr)
+            off += _pad(arr.nbytes)
+        self.chan_start = np.ndarray(nhops + 1, '<i8', buf, off)
+        off += self.chan_start.nbytes
+        for name, dt in _CHAN_FIELDS:
+            arr = np.ndarray(nchans, dt, buf, off)
+            setattr(self, name, arr)
+            off += arr.nbytes
+
+    def overlaps(self, t0=None, t1=None, f0=None, f1=None) -> bool:
+        return not (
+            (t0 is not None and self.max_time < t0) or
+            (t1 is not None and self.min_time > t1) or
+            (f0 is not None and self.max_freq < f0) or
+            (f1 is not None and self.min_freq > f1)
+        )
+
+    def channels(self, ndx: int):
+        """Returns the `(offsets, b0, b1)` channel arrays of one hop.
+        """
+        a, b = self.chan_start[ndx], self.chan_start[ndx + 1]
+        return self.chan_freq[a:b], self.chan_b0[a:b], self.chan_b1[a:b]
+
+    def samples(self) -> list:
+        """Returns the hops as `{'data': measurement, 'src_ndx': n}`.
+
+        This is the form of the pickle store and is slow, it is meant
+        for converting back.
+        """
+        out = []
+        starts = self.chan_start.tolist()
+        cfreq = self.chan_freq.tolist()
+        cb0 = self.chan_b0.tolist()
+        cb1 = self.chan_b1.tolist()
+        for ndx, (t, f, b0, b1, src) in enumerate(zip(
+                self.time.tolist(), self.freq.tolist(), self.b0.tolist(),
+                self.b1.tolist(), self.src.tolist())):
+            a, b = starts[ndx], starts[ndx + 1]
+            out.append({
+                'data': {
+                    'time': t,
+                    'freq': f,
+                    'b0': b0,
+                    'b1': b1,
+                    'channel': [
+                        {'freq': cfreq[c], 'b0': cb0[c], 'b1': cb1[c]}
+                        for c in range(a, b)
+                    ],
+                },
+                'src_ndx': src,
+            })
+        return out
+
+def read_blocks(buf) -> list:
+    """Returns the whole blocks in a buffer as `Block` views of it.
+    """
+    return [Block(buf, pos, header, footer) for pos, header, footer in _walk(buf, len(buf))]
+
+def rekey(raw, key: str) -> bytes:
+    """Returns a single encoded block with its key replaced.
+    """
+    _, version, key_len, nhops, nchans, body_bytes = HEADER.unpack_from(raw, 0)
+    key_data = key.encode('utf8')
+    body = memoryview(raw)[HEADER.size + _pad(key_len):HEADER.size + body_bytes]
+    footer = list(FOOTER.unpack_from(raw, HEADER.size + body_bytes))
+    new_body_bytes = _pad(len(key_data)) + len(body)
+    footer[-1] = HEADER.size + new_body_bytes + FOOTER.size
+    return b''.join([
+        HEADER.pack(HEADER_MAGIC, version, len(key_data), nhops, nchans, new_body_bytes),
+        key_data,
+        bytes(_pad(len(key_data)) - len(key_data)),
+        body,
+        FOOTER.pack(*footer),
+    ])
+
+class ColumnStore:
+    """A store opened for reading.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.blocks = []
+        if os.path.getsize(path) == 0:
+            self.mm = None
+            return
+        self.mm = np.memmap(path, np.uint8, 'r')
+        for pos, header, footer in _walk(self.mm, len(self.mm)):
+            self.blocks.append(Block(self.mm, pos, header, footer))
+
+    def keys(self) -> list:
+        return [block.key for block in self.blocks]
+
+    def select(self, t0=None, t1=None, f0=None, f1=None):
+        """Yields the blocks whose footer overlaps the given ranges.
+        """
+        for block in self.blocks:
+            if block.overlaps(t0, t1, f0, f1):
+                yield block
+
+class ColumnWriter:
+    """Appends blocks to a store, first truncating a block cut short.
+    """
+    def __init__(self, path: str):
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            if not is_colstore(path):
+                raise ValueError('%s is not a columnar store' % path)
+            mm = np.memmap(path, np.uint8, 'r')
+            end = len(mm)
+            good = 0
+            for pos, header, footer in _walk(mm, end):
+                good = pos + footer[-1]
+            del mm
+            if good != end:
+                print('truncating %d bytes of partial block in %s' % (end - good, path))
+                with open(path, 'r+b') as fd:
+                    fd.truncate(good)
+        self.fd = open(path, 'ab')
+
+    def append(self, key: str, samples: list):
+        self.fd.write(encode_block(key, samples))
+
+    def append_raw(self, raw):
+        """Appends an already encoded block.
+        """
+        self.fd.write(raw)
+
+    def flush(self):
+        self.fd.flush()
+
+    def close(self):
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def convert(pickle_path: str, out_path: str) -> int:
+    """Appends every object of a pickle store to a columnar store.
+
+    The pickle store key tuple is joined with '-' as `s3fetch.py` does
+    for its index. Returns the number of blocks written.
+    """
+    writer = ColumnWriter(out_path)
+    count = 0
+    try:
+        with open(pickle_path, 'rb') as fd:
+            while True:
+                try:
+                    key, data = pickle.load(fd)
+                except EOFError:
+                    break
+                writer.append('-'.join(str(v) for v in key), data)
+                count += 1
+    finally:
+        writer.close()
+    return count
@@ -0,0 +1,124 @@
+"""Credit based flow control between a client and the server.
+
+A client that wants it puts `credit` in its hello with the number of
+measurements and bytes it is willing to receive, either may be left
+out for no limit. The server only sends while both are above zero and
+never takes more measurements off its queue than the measurement
+credit, so a client that stops granting leaves them in the queue
+where the queue policy and spill log deal with them right away
+instead of in the socket buffers. Bytes are only known after encoding
+so the byte credit may be overdrawn by one batch.
+
+As the client consumes measurements it sends more credit as fixed
+`GRANT` records of a magic, the measurements and the bytes granted.
+The server reads them on its own thread and drops a client that sends
+anything else or a negative grant.
+"""
+import socket
+import struct
+import threading
+import lib.bsocket as bsocket
+
+GRANT = struct.Struct('<4sqq')
+GRANT_MAGIC = b'NBCR'
+
+def grant_message(records: int, nbytes: int) -> bytes:
+    """Returns a credit grant ready to send.
+    """
+    return GRANT.pack(GRANT_MAGIC, records, nbytes)
+
+class CreditGate:
+    """The credit a client has granted the server.
+
+    A limit of `None` is never exhausted.
+    """
+    def __init__(self, records: int = None, nbytes: int = None):
+        self.records = records
+        self.bytes = nbytes
+        self.closed = False
+        self.stalls = 0
+        self.cond = threading.Condition()
+
+    @classmethod
+    def from_hello(cls, spec) -> 'CreditGate':
+        """Returns a gate for the `credit` of a hello or `None`.
+        """
+        if not isinstance(spec, dict):
+            return None
+        records = spec.get('records')
+        nbytes = spec.get('bytes')
+        return cls(
+            int(records) if records is not None else None,
+            int(nbytes) if nbytes is not None else None
+        )
+
+    def _open(self) -> bool:
+        return (
+            (self.records is None or self.records > 0) and
+            (self.bytes is None or self.bytes > 0)
+        )
+
+    def grant(self, records: int = 0, nbytes: int = 0):
+        with self.cond:
+            if self.records is not None:
+                self.records += records
+            if self.bytes is not None:
+                self.bytes += nbytes
+            self.cond.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        """Waits for credit and returns true if there is some.
+
+        Raises `bsocket.SocketException` once the client is gone.
+        """
+        with self.cond:
+            if not self._open() and not self.closed:
+                self.stalls += 1
+            self.cond.wait_for(lambda: self.closed or self._open(), timeout)
+            if self.closed:
+                raise bsocket.SocketException()
+            return self._open()
+
+    def limit(self, max_items: int) -> int:
+        """Returns how many measurements may be sent at most.
+        """
+        with self.cond:
+            if self.records is None:
+                return max_items
+            return max(0, min(max_items, self.records))
+
+    def spend(self, records: int, nbytes: int):
+        with self.cond:
+            if self.records is not None:
+                self.records -= records
+            if self.bytes is not None:
+                self.bytes -= nbytes
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def report(self) -> str:
+        with self.cond:
+            return 'credit records %s bytes %s stalls %d' % (
+                self.records, self.bytes, self.stalls
+            )
+
+def read_grants(sock, gate: CreditGate):
+    """Reads credit grants from a client until it disconnects.
+
+    This runs on its own thread next to the one sending.
+    """
+    try:
+        while True:
+            magic, records, nbytes = GRANT.unpack(bsocket.recv_exact(sock, GRANT.size))
+            if magic != GRANT_MAGIC or records < 0 or nbytes < 0:
+                print('malformed credit grant, dropping the client')
+                sock.shutdown(socket.SHUT_RDWR)
+                break
+            gate.grant(records, nbytes)
+    except (bsocket.SocketException, OSError):
+        pass
+    finally:
+        gate.close()
@@ -0,0 +1,70 @@
+"""Downloads objects from an object store on a pool of threads.
+
+`fetch` yields the objects in the order of the keys it is given while
+`workers` threads keep downloading the ones after it, so a slow round
+trip to the store no longer holds up the next object. At most
+`max_buffered` objects are downloaded or waiting to be taken at once,
+which bounds the memory used. Each get is retried with a doubling
+backoff like the uploads in `lib.uploader`.
+
+`decode(key, payload)` runs on the downloading thread so unpacking is
+done in parallel too and the caller only has to write the result.
+"""
+import collections
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def _get(store, key: str, decode, attempts: int, min_backoff: float, max_backoff: float):
+    backoff = min_backoff
+    for attempt in range(attempts):
+        try:
+            payload = store.get(key)
+            break
+        except Exception as e:
+            if attempt + 1 == attempts:
+                raise
+            print('[DOWN] get %s failed: %s, retry in %.1fs' % (key, e, backoff))
+            time.sleep(backoff * random.uniform(1.0, 1.5))
+            backoff = min(backoff * 2, max_backoff)
+    size = len(payload)
+    if decode is not None:
+        payload = decode(key, payload)
+    return size, payload
+
+def fetch(
+        store,
+        keys,
+        decode=None,
+        workers: int = 8,
+        max_buffered: int = 16,
+        attempts: int = 5,
+        min_backoff: float = 0.5,
+        max_backoff: float = 30.0):
+    """Yields `(key, size, payload)` for each key in order.
+
+    `size` is the number of bytes downloaded and `payload` what
+    `decode` returned for them, or the bytes if there is no `decode`.
+    Raises the last error of a key that could not be fetched.
+    """
+    keys = iter(keys)
+    window = collections.deque()
+    pool = ThreadPoolExecutor(max_workers=workers)
+
+    def submit():
+        key = next(keys, None)
+        if key is not None:
+            window.append((key, pool.submit(
+                _get, store, key, decode, attempts, min_backoff, max_backoff
+            )))
+
+    try:
+        for _ in range(max(max_buffered, 1)):
+            submit()
+        while len(window) > 0:
+            key, future = window.popleft()
+            size, payload = future.result()
+            submit()
+            yield key, size, payload
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
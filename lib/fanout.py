@@ -0,0 +1,150 @@
+"""Publishes measurements to any number of clients.
+
+A single publisher takes batches of measurements off the queue and
+appends them to a ring. Every subscribed client has its own cursor
+into the ring and sends the batches it has not sent yet. A batch is
+encoded at most once per wire format and the bytes are shared by
+every client using that format, so adding clients costs only the
+sends.
+
+The ring keeps the last `capacity` batches. A client whose cursor
+falls more than its lag limit behind the newest batch skips ahead and
+the skipped batches are counted as dropped for that client. The ring
+is also the retention window for clients that reconnect and ask to
+resume after the last `seq` they received.
+"""
+import collections
+import struct
+import threading
+import lib.bsocket as bsocket
+import lib.wire as wire
+
+class Entry:
+    """One published batch and its encodings.
+    """
+    def __init__(self, seq: int, records: list):
+        self.seq = seq
+        self.records = records
+        # The highest measurement `seq` in the batch.
+        self.last_seq = max((rec.get('seq', -1) for rec in records), default=-1)
+        self.encoded = {}
+        self.lock = threading.Lock()
+
+    def data(self, proto: int, wire_dtype: str, level: int) -> bytes:
+        """Returns the bytes to send to a client using `proto`.
+
+        The first client to ask for a format encodes it.
+        """
+        with self.lock:
+            data = self.encoded.get(proto)
+            if data is None:
+                if proto == 0:
+                    data = bsocket.pack_pickles(self.records)
+                else:
+                    frame = wire.encode(
+                        self.records, wire_dtype, level=level, version=proto
+                    )
+                    data = struct.pack('>I', len(frame)) + frame
+                self.encoded[proto] = data
+            return data
+
+class Subscriber:
+    """The read position of one client.
+    """
+    def __init__(self, cursor: int, lag_limit: int):
+        self.cursor = cursor
+        self.lag_limit = lag_limit
+        self.sent = 0
+        self.dropped = 0
+
+class FanoutRing:
+    """A ring of published batches read by many subscribers.
+    """
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self.entries = collections.deque()
+        # The sequence number the next published batch gets.
+        self.head = 0
+        self.subscribers = set()
+        self.cond = threading.Condition()
+
+    @property
+    def tail(self) -> int:
+        return self.head - len(self.entries)
+
+    def publish(self, records: list):
+        with self.cond:
+            self.entries.append(Entry(self.head, records))
+            self.head += 1
+            while len(self.entries) > self.capacity:
+                self.entries.popleft()
+            self.cond.notify_all()
+
+    def subscribe(self, lag_limit: int, resume_seq: int = None) -> tuple:
+        """Adds a subscriber that starts at the next published batch.
+
+        If `resume_seq` is given it starts at the oldest kept batch
+        holding a measurement after it instead. Returns the subscriber
+        and the number of batches it starts behind.
+        """
+        with self.cond:
+            cursor = self.head
+            if resume_seq is not None:
+                for entry in self.entries:
+                    if entry.last_seq > resume_seq:
+                        cursor = entry.seq
+                        break
+            sub = Subscriber(cursor, min(lag_limit, self.capacity))
+            self.subscribers.add(sub)
+            self.cond.notify_all()
+            return sub, self.head - cursor
+
+    def unsubscribe(self, sub: Subscriber):
+        with self.cond:
+            self.subscribers.discard(sub)
+            self.cond.notify_all()
+
+    def wait_subscribers(self):
+        """Blocks until at least one client is subscribed.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.subscribers) > 0)
+
+    def wait_room(self):
+        """Blocks until no subscriber is at its lag limit.
+
+        This lets a backlog be published no faster than the slowest
+        client takes it instead of having the clients skip it.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: all(
+                self.head - sub.cursor < sub.lag_limit for sub in self.subscribers
+            ))
+
+    def read(self, sub: Subscriber, max_entries: int = 64) -> list:
+        """Blocks until there is something for `sub` and returns the entries.
+
+        The cursor is advanced past the returned entries.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: sub.cursor < self.head)
+            lowest = max(self.tail, self.head - sub.lag_limit)
+            if sub.cursor < lowest:
+                sub.dropped += lowest - sub.cursor
+                sub.cursor = lowest
+            start = sub.cursor - self.tail
+            out = [self.entries[ndx] for ndx in range(
+                start, min(start + max_entries, len(self.entries))
+            )]
+            sub.cursor += len(out)
+            sub.sent += len(out)
+            self.cond.notify_all()
+            return out
+
+    def report(self) -> str:
+        with self.cond:
+            return 'fanout %d clients ring %d of %d lag %s dropped %s' % (
+                len(self.subscribers), len(self.entries), self.capacity,
+                [self.head - sub.cursor for sub in self.subscribers],
+                [sub.dropped for sub in self.subscribers],
+            )
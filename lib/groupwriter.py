@@ -0,0 +1,208 @@
+"""Writes measurements to a file in checksummed chunks.
+
+Measurements are handed to `GroupWriter.write` and a background thread
+writes them as one chunk once `max_records` are waiting or `max_ms`
+has passed, so the file is flushed once per chunk instead of once per
+measurement. Each chunk is
+
+    magic 'NBCK', big endian 32-bit length, big endian 32-bit crc32
+
+followed by that many bytes of back to back pickles, one per
+measurement, so a chunk can be read with repeated `pickle.load`.
+
+The file is only ever appended to. A chunk cut short or garbled by a
+crash is found by its length or checksum and truncated away when the
+file is opened again, and `read_records` stops at it.
+
+A file of bare pickles written by older clients is not appended to.
+It is renamed to `<path>.legacy`, where it can still be read with
+repeated `pickle.load`, and a new file is started.
+
+If `fsync_s` is `None` the file is never synced, if it is zero it is
+synced after every chunk, and otherwise at most once every `fsync_s`
+seconds.
+"""
+import io
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b'NBCK'
+
+CHUNK = struct.Struct('>4sII')
+
+def _scan(fd):
+    """Yields `(offset, payload)` of each good chunk from the start of `fd`.
+    """
+    pos = 0
+    while True:
+        hdr = fd.read(CHUNK.size)
+        if len(hdr) < CHUNK.size:
+            return
+        magic, sz, crc = CHUNK.unpack(hdr)
+        if magic != MAGIC:
+            return
+        payload = fd.read(sz)
+        if len(payload) < sz or zlib.crc32(payload) != crc:
+            return
+        yield pos, payload
+        pos += CHUNK.size + sz
+
+def _move_legacy(path: str) -> str:
+    """Renames a file of bare pickles out of the way and returns the new name.
+    """
+    new_path = path + '.legacy'
+    ndx = 1
+    while os.path.exists(new_path):
+        new_path = '%s.legacy%d' % (path, ndx)
+        ndx += 1
+    os.rename(path, new_path)
+    return new_path
+
+def _repair(path: str):
+    """Truncates anything after the last good chunk.
+
+    A file of bare pickles is moved aside so a new file is started.
+    """
+    with open(path, 'rb') as fd:
+        head = fd.read(len(MAGIC))
+    if len(head) == 0:
+        return
+    if head != MAGIC:
+        # Pickle protocol 2 and later start with the PROTO opcode.
+        if head[:1] != b'\x80':
+            raise ValueError('%s is not a chunked measurement file' % path)
+        new_path = _move_legacy(path)
+        print('%s holds pickles written by an older client, moved it to %s and starting a new file' % (
+            path, new_path
+        ))
+        return
+
+    with open(path, 'r+b') as fd:
+        end = fd.seek(0, 2)
+        fd.seek(0)
+        good = 0
+        for pos, payload in _scan(fd):
+            good = pos + CHUNK.size + len(payload)
+        if good != end:
+            print('truncating %d bytes of partial chunk in %s' % (end - good, path))
+            fd.truncate(good)
+
+def read_records(path: str):
+    """Yields the measurements of a file written by `GroupWriter`.
+    """
+    with open(path, 'rb') as fd:
+        for _, payload in _scan(fd):
+            bio = io.BytesIO(payload)
+            while bio.tell() < len(payload):
+                yield pickle.load(bio)
+
+class GroupWriter:
+    """Appends measurements to a file from a background thread.
+    """
+    def __init__(
+            self,
+            path: str,
+            max_records: int = 1000,
+            max_ms: float = 200.0,
+            fsync_s: float = None,
+            max_pending: int = 100000):
+        self.path = path
+        self.max_records = max_records
+        self.max_ms = max_ms
+        self.fsync_s = fsync_s
+        self.max_pending = max_pending
+
+        if os.path.exists(path):
+            _repair(path)
+        self.fd = open(path, 'ab')
+
+        self.pending = []
+        self.closed = False
+        self.error = None
+        self.cond = threading.Condition()
+
+        self.records = 0
+        self.chunks = 0
+        self.bytes = 0
+        self.syncs = 0
+        self.last_sync = time.time()
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, record):
+        self.write_many([record])
+
+    def write_many(self, records: list):
+        """Queues measurements to be written.
+
+        This blocks only if `max_pending` are already waiting.
+        """
+        with self.cond:
+            self.cond.wait_for(
+                lambda: len(self.pending) < self.max_pending or self.error is not None
+            )
+            if self.error is not None:
+                raise self.error
+            self.pending.extend(records)
+            if len(self.pending) >= self.max_records:
+                self.cond.notify_all()
+
+    def _write_chunk(self, batch: list):
+        payload = b''.join(pickle.dumps(rec) for rec in batch)
+        self.fd.write(CHUNK.pack(MAGIC, len(payload), zlib.crc32(payload)))
+        self.fd.write(payload)
+        self.fd.flush()
+        self.records += len(batch)
+        self.chunks += 1
+        self.bytes += CHUNK.size + len(payload)
+
+        if self.fsync_s is not None:
+            now = time.time()
+            if now - self.last_sync >= self.fsync_s:
+                os.fsync(self.fd.fileno())
+                self.last_sync = now
+                self.syncs += 1
+
+    def _run(self):
+        try:
+            while True:
+                with self.cond:
+                    self.cond.wait_for(
+                        lambda: self.closed or len(self.pending) >= self.max_records,
+                        self.max_ms / 1000.0
+                    )
+                    batch = self.pending
+                    self.pending = []
+                    closed = self.closed
+                    self.cond.notify_all()
+                if len(batch) > 0:
+                    self._write_chunk(batch)
+                if closed:
+                    break
+        except OSError as e:
+            with self.cond:
+                self.error = e
+                self.cond.notify_all()
+
+    def close(self):
+        """Writes what is left, syncs if syncing at all, and closes the file.
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        if self.error is None and self.fsync_s is not None:
+            os.fsync(self.fd.fileno())
+        self.fd.close()
+        if self.error is not None:
+            raise self.error
+
+    def report(self) -> str:
+        return 'wrote %d records in %d chunks %d bytes synced %d times' % (
+            self.records, self.chunks, self.bytes, self.syncs
+        )
@@ -0,0 +1,254 @@
+"""Chooses the frequency of each hop.
+
+Picking every frequency at random revisits some parts of the band
+while others wait. The time to cover the whole band then follows the
+coupon collector problem and grows faster than the band width. The
+schedulers here make passes over the band instead.
+
+`random` is the original behavior. `stratified` splits the band into
+cells one baseband wide and visits every cell once per pass in a
+random order at a random offset within the cell. `grid` is the same
+but always tunes to the center of the cell so the channel outputs of
+neighboring hops tile exactly.
+
+Bands can be given a priority weight in the server configuration.
+A cell with weight `w` is visited `w` times per pass with the visits
+spread through the pass.
+
+    priority:
+      - min: 430e6
+        max: 440e6
+        weight: 4
+
+Every scheduler tracks the coverage of the band in cells of the same
+width so the schedulers can be compared. A hop only counts once
+`captured` is called for it so failed captures leave their cell
+uncovered.
+"""
+import math
+import random
+import time
+import numpy as np
+
+class Coverage:
+    """Tracks how often and how recently each part of the band was visited.
+    """
+    def __init__(self, freq_min: float, freq_max: float, cell: float):
+        self.freq_min = freq_min
+        self.cell = cell
+        self.cell_cnt = max(1, int(math.ceil((freq_max - freq_min) / cell)))
+        self.visits = np.zeros(self.cell_cnt, np.int64)
+        self.last_seen = np.full(self.cell_cnt, np.nan)
+        self.started = time.time()
+        self.hops = 0
+        # The times at which every cell had been visited once more.
+        self.full_times = []
+        self.full_level = 0
+
+    def mark(self, freq: float, width: float):
+        """Marks the band `freq - width / 2` to `freq + width / 2` as visited.
+        """
+        now = time.time()
+        a = int((freq - width * 0.5 - self.freq_min) // self.cell)
+        b = int(math.ceil((freq + width * 0.5 - self.freq_min) / self.cell)) - 1
+        a = max(a, 0)
+        b = min(b, self.cell_cnt - 1)
+        if a <= b:
+            self.visits[a:b + 1] += 1
+            self.last_seen[a:b + 1] = now
+        self.hops += 1
+        level = int(np.min(self.visits))
+        while self.full_level < level:
+            self.full_level += 1
+            self.full_times.append(now)
+
+    def stats(self) -> dict:
+        """Returns a summary of the coverage.
+
+        `revisit` is the mean time between the moments the whole band
+        had been covered once more.
+        """
+        now = time.time()
+        visited = self.visits > 0
+        if len(self.full_times) > 1:
+            revisit = float(np.mean(np.diff(self.full_times)))
+        else:
+            revisit = None
+        if np.any(visited):
+            max_age = float(now - np.nanmin(self.last_seen))
+        else:
+            max_age = None
+        return {
+            'cells': self.cell_cnt,
+            'fraction': float(np.mean(visited)),
+            'hops': self.hops,
+            'passes': self.full_level,
+            'first_pass': (self.full_times[0] - self.started) if self.full_times else None,
+            'revisit': revisit,
+            'max_age': max_age if np.all(visited) else None,
+        }
+
+    def report(self) -> str:
+        s = self.stats()
+        def fmt(v):
+            return '-' if v is None else '%.1fs' % v
+        return 'coverage %.1f%% of %d cells passes %d first pass %s revisit %s oldest %s' % (
+            s['fraction'] * 100.0, s['cells'], s['passes'],
+            fmt(s['first_pass']), fmt(s['revisit']), fmt(s['max_age'])
+        )
+
+class RandomScheduler:
+    """Picks each frequency uniformly at random.
+
+    If `quantize` is given the frequencies are multiples of it from
+    `freq_min` which is needed for the quick tune table.
+    """
+    def __init__(
+            self,
+            freq_min: int,
+            freq_max: int,
+            sps: float,
+            quantize: float = None,
+            priority: list = None):
+        self.freq_min = int(freq_min)
+        self.freq_max = int(freq_max)
+        self.sps = sps
+        self.quantize = quantize
+        self.coverage = Coverage(freq_min, freq_max, sps)
+
+    def grid(self) -> list:
+        """Returns every frequency that can be picked or `None` if unbounded.
+        """
+        if self.quantize is None:
+            return None
+        return list(range(self.freq_min, self.freq_max + 1, int(self.quantize)))
+
+    def _quantize(self, freq: float) -> int:
+        if self.quantize is None:
+            return int(freq)
+        step = int(self.quantize)
+        ndx = int(round((freq - self.freq_min) / step))
+        ndx = min(max(ndx, 0), (self.freq_max - self.freq_min) // step)
+        return self.freq_min + ndx * step
+
+    def _pick(self) -> float:
+        return random.randint(self.freq_min, self.freq_max)
+
+    def next(self) -> int:
+        return self._quantize(self._pick())
+
+    def captured(self, freq: int):
+        """Marks the baseband around `freq` as covered after a good capture.
+        """
+        self.coverage.mark(freq, self.sps)
+
+class StratifiedScheduler(RandomScheduler):
+    """Visits every baseband wide cell once per pass in a random order.
+    """
+    jitter = True
+
+    def __init__(
+            self,
+            freq_min: int,
+            freq_max: int,
+            sps: float,
+            quantize: float = None,
+            priority: list = None):
+        super().__init__(freq_min, freq_max, sps, quantize, priority)
+        cell_cnt = self.coverage.cell_cnt
+        self.starts = self.freq_min + np.arange(cell_cnt) * sps
+        self.weights = np.ones(cell_cnt, np.int64)
+        for band in priority or []:
+            lo = float(band['min'])
+            hi = float(band['max'])
+            weight = int(band.get('weight', 1))
+            hit = (self.starts < hi) & (self.starts + sps > lo)
+            self.weights[hit] = np.maximum(self.weights[hit], weight)
+        self.order = []
+
+    def _new_pass(self):
+        """Builds the order of the next pass.
+
+        A cell with weight `w` gets `w` visits with sort keys spread
+        evenly over the pass so repeated visits do not bunch up.
+        """
+        keys = []
+        for ndx, weight in enumerate(self.weights.tolist()):
+            for r in range(weight):
+                keys.append(((r + random.random()) / weight, ndx))
+        keys.sort()
+        # Popped from the end.
+        self.order = [ndx for _, ndx in reversed(keys)]
+
+    def _center(self, ndx: int) -> float:
+        lo = self.starts[ndx]
+        hi = min(lo + self.sps, self.freq_max)
+        if self.jitter:
+            return random.uniform(lo, hi)
+        return (lo + hi) * 0.5
+
+    def _pick(self) -> float:
+        if len(self.order) == 0:
+            self._new_pass()
+        return self._center(self.order.pop())
+
+class GridScheduler(StratifiedScheduler):
+    """Visits the center of every cell once per pass.
+
+    The centers are `sps` apart so the channel outputs of the hops
+    tile the band exactly. The grid is always quantized to whole
+    hertz. A last cell cut short by `freq_max` is still visited at its
+    grid center so it tiles with the others, even though that center
+    may lie above `freq_max`.
+    """
+    jitter = False
+
+    def __init__(
+            self,
+            freq_min: int,
+            freq_max: int,
+            sps: float,
+            quantize: float = None,
+            priority: list = None):
+        super().__init__(freq_min, freq_max, sps, None, priority)
+
+    def _center(self, ndx: int) -> float:
+        return self.starts[ndx] + self.sps * 0.5
+
+    def grid(self) -> list:
+        return sorted(set(
+            int(self._center(ndx)) for ndx in range(len(self.starts))
+        ))
+
+    def _quantize(self, freq: float) -> int:
+        return int(freq)
+
+SCHEDULERS = {
+    'random': RandomScheduler,
+    'stratified': StratifiedScheduler,
+    'grid': GridScheduler,
+}
+
+def create(kind: str, freq_min, freq_max, sps, quantize=None, priority=None):
+    """Creates a scheduler by name.
+    """
+    return SCHEDULERS[kind](
+        int(float(freq_min)), int(float(freq_max)), sps, quantize, priority
+    )
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(
+        description='Compares how many hops each scheduler needs to cover the band.'
+    )
+    ap.add_argument('--freq-min', type=float, default=70e6)
+    ap.add_argument('--freq-max', type=float, default=6e9)
+    ap.add_argument('--sps', type=float, default=1e6)
+    args = ap.parse_args()
+    for kind in SCHEDULERS:
+        sch = create(kind, args.freq_min, args.freq_max, args.sps)
+        while sch.coverage.full_level < 2:
+            sch.captured(sch.next())
+        print('%-10s %d cells covered twice after %d hops' % (
+            kind, sch.coverage.cell_cnt, sch.coverage.hops
+        ))
@@ -0,0 +1,189 @@
+"""A small object store interface with S3 and filesystem implementations.
+
+`s3shuffle.py` and `s3fetch.py` only need to put, list, and get whole
+objects plus multipart uploads for large ones. `S3Store` does these
+with a boto3 client and `FileStore` with a local directory so the
+whole shuffle and fetch path can be run and load tested without AWS.
+`FileStore` can add latency and fail a fraction of calls to act like
+a slow or flaky link.
+
+`list` returns dictionaries with `Key` and `Size` in key order, at
+most 1000 at a time, like `list_objects_v2`.
+"""
+import abc
+import os
+import random
+import time
+import uuid
+
+class ObjectStoreError(Exception):
+    pass
+
+class ObjectStore(abc.ABC):
+    """The operations an object store provides.
+    """
+    @abc.abstractmethod
+    def put(self, key: str, data):
+        pass
+
+    @abc.abstractmethod
+    def get(self, key: str) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def list(self, start_after: str = None) -> list:
+        pass
+
+    @abc.abstractmethod
+    def create_multipart(self, key: str) -> str:
+        """Starts a multipart upload and returns its id.
+        """
+
+    @abc.abstractmethod
+    def upload_part(self, key: str, upload_id: str, part_number: int, data) -> str:
+        """Uploads one part, numbered from 1, and returns its etag.
+        """
+
+    @abc.abstractmethod
+    def complete_multipart(self, key: str, upload_id: str, etags: list):
+        """Joins the parts, whose etags are given in order, into the object.
+        """
+
+    @abc.abstractmethod
+    def abort_multipart(self, key: str, upload_id: str):
+        pass
+
+class S3Store(ObjectStore):
+    """A bucket reached through a boto3 S3 client.
+    """
+    def __init__(self, client, bucket: str, storage_class: str = 'STANDARD'):
+        self.client = client
+        self.bucket = bucket
+        self.storage_class = storage_class
+
+    def put(self, key: str, data):
+        self.client.put_object(
+            Bucket=self.bucket, Key=key, Body=bytes(data),
+            StorageClass=self.storage_class
+        )
+
+    def get(self, key: str) -> bytes:
+        resp = self.client.get_object(Bucket=self.bucket, Key=key)
+        return resp['Body'].read()
+
+    def list(self, start_after: str = None) -> list:
+        if start_after is None:
+            resp = self.client.list_objects_v2(Bucket=self.bucket)
+        else:
+            resp = self.client.list_objects_v2(Bucket=self.bucket, StartAfter=start_after)
+        return [
+            {'Key': node['Key'], 'Size': node['Size']}
+            for node in resp.get('Contents', [])
+        ]
+
+    def create_multipart(self, key: str) -> str:
+        resp = self.client.create_multipart_upload(
+            Bucket=self.bucket, Key=key, StorageClass=self.storage_class
+        )
+        return resp['UploadId']
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, data) -> str:
+        resp = self.client.upload_part(
+            Bucket=self.bucket, Key=key, UploadId=upload_id,
+            PartNumber=part_number, Body=bytes(data)
+        )
+        return resp['ETag']
+
+    def complete_multipart(self, key: str, upload_id: str, etags: list):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': [
+                {'ETag': etag, 'PartNumber': ndx + 1}
+                for ndx, etag in enumerate(etags)
+            ]}
+        )
+
+    def abort_multipart(self, key: str, upload_id: str):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+class FileStore(ObjectStore):
+    """A directory standing in for a bucket.
+
+    Objects are files named by their key and appear only once complete.
+    Every call sleeps `latency` seconds and then fails with
+    `ObjectStoreError` with probability `fail_rate`.
+    """
+    def __init__(self, root: str, latency: float = 0.0, fail_rate: float = 0.0):
+        self.root = root
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.parts_dir = os.path.join(root, '.multipart')
+        os.makedirs(self.parts_dir, exist_ok=True)
+
+    def _call(self, what: str):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        if self.fail_rate > 0 and random.random() < self.fail_rate:
+            raise ObjectStoreError('simulated failure in %s' % what)
+
+    def _write(self, path: str, parts: list):
+        tmp = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        with open(tmp, 'wb') as fd:
+            for part in parts:
+                fd.write(part)
+        os.replace(tmp, path)
+
+    def put(self, key: str, data):
+        self._call('put')
+        self._write(os.path.join(self.root, key), [data])
+
+    def get(self, key: str) -> bytes:
+        self._call('get')
+        with open(os.path.join(self.root, key), 'rb') as fd:
+            return fd.read()
+
+    def list(self, start_after: str = None) -> list:
+        self._call('list')
+        keys = sorted(
+            node for node in os.listdir(self.root)
+            if not node.startswith('.') and not node.endswith('.tmp')
+        )
+        if start_after is not None:
+            keys = [key for key in keys if key > start_after]
+        return [
+            {'Key': key, 'Size': os.path.getsize(os.path.join(self.root, key))}
+            for key in keys[:1000]
+        ]
+
+    def create_multipart(self, key: str) -> str:
+        self._call('create_multipart')
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.parts_dir, upload_id))
+        return upload_id
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, data) -> str:
+        self._call('upload_part')
+        etag = uuid.uuid4().hex
+        self._write(os.path.join(self.parts_dir, upload_id, '%05d-%s' % (part_number, etag)), [data])
+        return etag
+
+    def complete_multipart(self, key: str, upload_id: str, etags: list):
+        self._call('complete_multipart')
+        pdir = os.path.join(self.parts_dir, upload_id)
+        parts = []
+        for ndx, etag in enumerate(etags):
+            with open(os.path.join(pdir, '%05d-%s' % (ndx + 1, etag)), 'rb') as fd:
+                parts.append(fd.read())
+        self._write(os.path.join(self.root, key), parts)
+        self._remove_parts(upload_id)
+
+    def abort_multipart(self, key: str, upload_id: str):
+        self._remove_parts(upload_id)
+
+    def _remove_parts(self, upload_id: str):
+        pdir = os.path.join(self.parts_dir, upload_id)
+        if not os.path.isdir(pdir):
+            return
+        for node in os.listdir(pdir):
+            os.remove(os.path.join(pdir, node))
+        os.rmdir(pdir)
@@ -0,0 +1,141 @@
+"""Encodes the packages `s3shuffle.py` uploads.
+
+A package used to be pickles of `{'data': measurement, 'src_ndx': n}`
+one after another. It is now a small header followed by blocks, each
+holding the measurements gathered since the previous block as a
+`lib.colstore` block that is byte shuffled and zlib compressed.
+
+    header  magic 'NBPK', version, flags
+    block   big endian 32-bit compressed length, 32-bit raw length,
+            then the compressed block
+
+Shuffling stores the first byte of every 8 byte value, then all the
+second bytes, and so on. The slowly changing high bytes of the floats
+end up next to each other and compress far better. Only the fields
+the columnar store keeps are packaged: time, freq, b0, b1, channels,
+and the source index.
+
+`blocks` and `samples` read both kinds of package.
+"""
+import io
+import pickle
+import struct
+import zlib
+import numpy as np
+import lib.colstore as colstore
+
+MAGIC = b'NBPK'
+VERSION = 1
+
+FLAG_SHUFFLE = 1
+
+HEADER = struct.Struct('<4sBB2x')
+BLOCK = struct.Struct('>II')
+
+def shuffle(raw) -> bytes:
+    return np.frombuffer(raw, np.uint8).reshape(-1, 8).T.tobytes()
+
+def unshuffle(data) -> bytes:
+    return np.frombuffer(data, np.uint8).reshape(8, -1).T.tobytes()
+
+class PackageBuilder:
+    """Builds one package as measurements arrive.
+
+    A block is encoded and compressed every `block_records`
+    measurements or once they would take `block_bytes` unencoded.
+    `size` is the compressed size so far plus the measurements not yet
+    compressed at the ratio of the last block. The package is written
+    into one buffer that `finish` returns without a copy.
+    """
+    def __init__(
+            self,
+            level: int = 6,
+            block_records: int = 256,
+            block_bytes: int = 256 * 1024,
+            byte_shuffle: bool = True):
+        self.level = level
+        self.block_records = block_records
+        self.block_bytes = block_bytes
+        self.flags = FLAG_SHUFFLE if byte_shuffle else 0
+        self.buf = io.BytesIO()
+        self.buf.write(HEADER.pack(MAGIC, VERSION, self.flags))
+        self.samples = []
+        self.pending_bytes = 0
+        self.ratio = 0.5
+        self.records = 0
+        self.raw_bytes = 0
+
+    def add(self, data: dict, src_ndx: int):
+        self.samples.append({'data': data, 'src_ndx': src_ndx})
+        self.records += 1
+        # What the measurement adds to an encoded block.
+        self.pending_bytes += 48 + 32 * len(data.get('channel') or [])
+        if len(self.samples) >= self.block_records or self.pending_bytes >= self.block_bytes:
+            self._flush()
+
+    def _flush(self):
+        if len(self.samples) == 0:
+            return
+        raw = colstore.encode_block('', self.samples)
+        self.samples = []
+        self.pending_bytes = 0
+        self.raw_bytes += len(raw)
+        raw_len = len(raw)
+        if self.flags & FLAG_SHUFFLE:
+            raw = shuffle(raw)
+        data = zlib.compress(raw, self.level)
+        self.ratio = len(data) / raw_len
+        self.buf.write(BLOCK.pack(len(data), raw_len))
+        self.buf.write(data)
+
+    def size(self) -> int:
+        """Returns the compressed size of the package so far.
+        """
+        return self.buf.tell() + int(self.pending_bytes * self.ratio)
+
+    def finish(self) -> memoryview:
+        """Encodes what is left and returns the package.
+        """
+        self._flush()
+        return self.buf.getbuffer()
+
+def is_package(data) -> bool:
+    return bytes(memoryview(data)[:len(MAGIC)]) == MAGIC
+
+def blocks(data):
+    """Yields the `lib.colstore` blocks of a package as bytes.
+    """
+    magic, version, flags = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a version %d package' % VERSION)
+    view = memoryview(data)
+    pos = HEADER.size
+    while pos < len(view):
+        clen, raw_len = BLOCK.unpack_from(view, pos)
+        pos += BLOCK.size
+        raw = zlib.decompress(view[pos:pos + clen])
+        pos += clen
+        if len(raw) != raw_len:
+            raise ValueError('package block is %d bytes not %d' % (len(raw), raw_len))
+        if flags & FLAG_SHUFFLE:
+            raw = unshuffle(raw)
+        yield raw
+
+def samples(data) -> list:
+    """Returns the `{'data': measurement, 'src_ndx': n}` of either kind of package.
+    """
+    if not is_package(data):
+        out = []
+        fd = io.BytesIO(data)
+        try:
+            while True:
+                out.append(pickle.load(fd))
+        except EOFError:
+            pass
+        return out
+
+    out = []
+    for raw in blocks(data):
+        for block in colstore.read_blocks(raw):
+            out.extend(block.samples())
+    return out
@@ -0,0 +1,231 @@
+"""Pipelined capture for the frequency scanner server.
+
+The capture thread keeps the radio busy by only tuning and filling
+sample buffers. The buffers live in shared memory and a pool of
+worker processes converts them, computes the `b0` and `b1` means,
+and channelizes them. The results come back out of order and are
+put back into capture order before being queued for the client.
+
+A worker that dies takes its capture with it and the ones after it
+could never be put in order, so the pipeline fails instead. The next
+`acquire` or `submit` raises the error.
+"""
+import heapq
+import multiprocessing
+import multiprocessing.shared_memory as shared_memory
+import queue
+import threading
+import numpy as np
+import lib.channelizer as channelizer
+from lib.bladeandnumpy import sc16_to_complex
+
+def _worker(
+        shm_name: str,
+        shape: tuple,
+        task_q,
+        result_q,
+        sps: float,
+        channel_bw: float,
+        channelizer_kind: str,
+        plan_cache: str):
+    """The worker process entry.
+
+    Each worker builds its own channelizer plan because a plan owns
+    scratch buffers and can not be shared.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slots = np.ndarray(shape, np.int16, buffer=shm.buf)
+    cbuf = [np.empty(shape[1], np.complex128) for _ in range(2)]
+    mag = np.empty(shape[1], np.float64)
+
+    if channel_bw is not None:
+        chz = channelizer.get_plan(
+            channelizer_kind, sps, channel_bw, shape[1], np.complex128, plan_cache
+        )
+    else:
+        chz = None
+
+    while True:
+        task = task_q.get()
+        if task is None:
+            break
+        seq, slot_ndx = task
+        try:
+            b0, b1 = sc16_to_complex(slots[slot_ndx], out=cbuf)
+            b0m = np.mean(np.abs(b0, out=mag))
+            b1m = np.mean(np.abs(b1, out=mag))
+            if chz is not None:
+                m0, m1 = chz.compute(b0, b1)
+                # The plan owns the outputs so they are copied by pickling.
+                result_q.put((seq, slot_ndx, b0m, b1m, m0, m1, None))
+            else:
+                result_q.put((seq, slot_ndx, b0m, b1m, None, None, None))
+        except Exception as e:
+            result_q.put((seq, slot_ndx, None, None, None, None, repr(e)))
+
+    del slots
+    shm.close()
+
+class CapturePipeline:
+    """Hands captured sample buffers to a pool of worker processes.
+
+    `acquire` returns a free slot in shared memory to capture into and
+    `submit` queues it for processing. `acquire` blocks when every
+    slot is in use which keeps the capture from running ahead of the
+    workers. The measurements are put onto `out_q` in capture order.
+    Workers are checked every `check_s` seconds while waiting.
+    """
+    def __init__(
+            self,
+            workers: int,
+            samp_count: int,
+            sps: float,
+            bw: float,
+            channel_bw: float,
+            channelizer_kind: str,
+            plan_cache: str,
+            out_q,
+            slots: int = None,
+            check_s: float = 1.0):
+        if slots is None:
+            slots = workers * 2 + 2
+
+        self.sps = sps
+        self.bw = bw
+        self.out_q = out_q
+        self.check_s = check_s
+        self.shape = (slots, samp_count, 2, 2)
+
+        if channel_bw is not None:
+            self.freqs = channelizer.CHANNELIZERS[channelizer_kind].centers(
+                sps, channel_bw
+            )
+        else:
+            self.freqs = None
+
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=int(np.prod(self.shape)) * 2
+        )
+        self.slots = np.ndarray(self.shape, np.int16, buffer=self.shm.buf)
+
+        self.free_q = queue.Queue()
+        for slot_ndx in range(slots):
+            self.free_q.put(slot_ndx)
+
+        ctx = multiprocessing.get_context('spawn')
+        self.task_q = ctx.Queue()
+        self.result_q = ctx.Queue()
+        self.procs = []
+        for _ in range(workers):
+            proc = ctx.Process(
+                target=_worker,
+                args=(
+                    self.shm.name, self.shape, self.task_q, self.result_q,
+                    sps, channel_bw, channelizer_kind, plan_cache
+                ),
+                daemon=True
+            )
+            proc.start()
+            self.procs.append(proc)
+
+        self.seq = 0
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.error = None
+        self.closed = False
+
+        self.collector_th = threading.Thread(target=self._collector, daemon=True)
+        self.collector_th.start()
+
+    def acquire(self):
+        """Returns a free slot index and its `(samp_count, 2, 2)` int16 buffer.
+        """
+        while True:
+            if self.error is not None:
+                raise self.error
+            try:
+                slot_ndx = self.free_q.get(timeout=self.check_s)
+            except queue.Empty:
+                continue
+            return slot_ndx, self.slots[slot_ndx]
+
+    def release(self, slot_ndx: int):
+        """Returns an acquired slot that was not submitted.
+        """
+        self.free_q.put(slot_ndx)
+
+    def submit(self, slot_ndx: int, freq: int, capture_time: float):
+        """Queues a filled slot for processing.
+        """
+        if self.error is not None:
+            raise self.error
+        seq = self.seq
+        self.seq += 1
+        with self.pending_lock:
+            self.pending[seq] = (capture_time, freq)
+        self.task_q.put((seq, slot_ndx))
+
+    def _collector(self):
+        """Receives results and queues them in capture order.
+        """
+        heap = []
+        next_seq = 0
+        while not self.closed:
+            try:
+                result = self.result_q.get(timeout=self.check_s)
+            except queue.Empty:
+                dead = [proc for proc in self.procs if proc.exitcode is not None]
+                if len(dead) > 0 and not self.closed:
+                    self.error = RuntimeError(
+                        'capture worker %d exited with code %d' % (
+                            dead[0].pid, dead[0].exitcode
+                        )
+                    )
+                    print(self.error)
+                    return
+                continue
+            seq, slot_ndx = result[0], result[1]
+            self.free_q.put(slot_ndx)
+            heapq.heappush(heap, result)
+
+            while len(heap) > 0 and heap[0][0] == next_seq:
+                seq, _, b0m, b1m, m0, m1, error = heapq.heappop(heap)
+                next_seq += 1
+                with self.pending_lock:
+                    capture_time, freq = self.pending.pop(seq)
+
+                if error is not None:
+                    print('worker error', freq, error)
+                    continue
+
+                if m0 is not None:
+                    cout = channelizer.to_channel_list(self.freqs, m0, m1)
+                else:
+                    cout = None
+
+                print('loaded', freq, b0m, b1m)
+                self.out_q.put({
+                    'time': capture_time,
+                    'freq': freq,
+                    'b0': b0m,
+                    'b1': b1m,
+                    'bw': self.bw,
+                    'sps': self.sps,
+                    'channel': cout,
+                })
+
+    def close(self):
+        """Stops the workers and frees the shared memory.
+        """
+        self.closed = True
+        for _ in self.procs:
+            self.task_q.put(None)
+        for proc in self.procs:
+            proc.join(self.check_s * 5)
+            if proc.exitcode is None:
+                proc.terminate()
+                proc.join()
+        self.collector_th.join()
+        del self.slots
+        self.shm.close()
+        self.shm.unlink()
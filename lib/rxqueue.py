@@ -0,0 +1,246 @@
+"""A bounded queue of measurements with overflow policies.
+
+The receive loop produces measurements faster than a slow client may
+take them. When the queue is full one of the following is done.
+
+    block        wait for the consumer to make room
+    drop-oldest  discard the oldest queued measurement
+    drop-newest  discard the new measurement
+    coalesce     average the new measurement into a queued measurement
+                 of the same frequency or drop the oldest if there
+                 is none
+
+Waiting is done on a condition variable so no CPU is burned while
+the consumer catches up.
+
+If a `SpillLog` is given then while no client is live the oldest
+queued measurement is written to disk instead of applying the policy.
+The log holds the oldest measurements and the queue the newest so
+replaying the log and then reading the queue keeps capture order.
+
+Every measurement put is given a `seq` one higher than the last. The
+numbering continues after what is in the spill log. `epoch` is chosen
+at random when the queue is made so a client can tell a restarted
+server from the one it was reading.
+"""
+import collections
+import queue
+import random
+import threading
+import time
+from lib.spill import SpillLog
+
+POLICIES = ['block', 'drop-oldest', 'drop-newest', 'coalesce']
+
+def coalesce_into(dst: dict, src: dict):
+    """Averages the measurement `src` into `dst`.
+
+    `dst['count']` holds the number of measurements averaged so far and
+    `dst['time']` becomes the time of the newest.
+    """
+    n = dst.get('count', 1) + 1
+    dst['count'] = n
+    dst['time'] = src['time']
+    for key in ('b0', 'b1'):
+        dst[key] += (src[key] - dst[key]) / n
+    if dst.get('channel') is not None and src.get('channel') is not None:
+        for a, b in zip(dst['channel'], src['channel']):
+            a['b0'] += (b['b0'] - a['b0']) / n
+            a['b1'] += (b['b1'] - a['b1']) / n
+
+class RecordQueue:
+    """A bounded FIFO of measurement dictionaries.
+
+    This has the `put`, `get`, and `qsize` methods of `queue.Queue`
+    so it can be used in its place.
+    """
+    def __init__(
+            self,
+            maxsize: int = 100,
+            policy: str = 'block',
+            spill: SpillLog = None):
+        if policy not in POLICIES:
+            raise ValueError('unknown queue policy %s' % policy)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items = collections.deque()
+        # Queued measurements by frequency for the coalesce policy.
+        self.by_freq = {}
+        self.cond = threading.Condition()
+        self.spill = spill
+        # Set while a client has caught up with the spill log.
+        self.live = False
+        self.epoch = random.getrandbits(62)
+        self.next_seq = spill.max_seq + 1 if spill is not None else 0
+
+        self.puts = 0
+        self.gets = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.spilled = 0
+        self.max_depth = 0
+        self.blocked_time = 0.0
+
+    def qsize(self) -> int:
+        with self.cond:
+            return len(self.items)
+
+    def _append(self, item: dict):
+        self.items.append(item)
+        if self.policy == 'coalesce':
+            self.by_freq[item['freq']] = item
+        self.max_depth = max(self.max_depth, len(self.items))
+        self.cond.notify_all()
+
+    def _popleft(self) -> dict:
+        item = self.items.popleft()
+        if self.policy == 'coalesce' and self.by_freq.get(item['freq']) is item:
+            del self.by_freq[item['freq']]
+        self.cond.notify_all()
+        return item
+
+    def _spilling(self) -> bool:
+        return self.spill is not None and not self.live
+
+    def put(self, item: dict):
+        with self.cond:
+            self.puts += 1
+            item['seq'] = self.next_seq
+            self.next_seq += 1
+
+            if len(self.items) < self.maxsize:
+                self._append(item)
+                return
+
+            if self.policy == 'block' and not self._spilling():
+                st = time.time()
+                self.cond.wait_for(
+                    lambda: len(self.items) < self.maxsize or self._spilling()
+                )
+                self.blocked_time += time.time() - st
+                if len(self.items) < self.maxsize:
+                    self._append(item)
+                    return
+
+            if self._spilling():
+                self.spill.append(self._popleft())
+                self.spilled += 1
+                self._append(item)
+            elif self.policy == 'drop-newest':
+                self.dropped += 1
+            elif self.policy == 'coalesce' and item['freq'] in self.by_freq:
+                coalesce_into(self.by_freq[item['freq']], item)
+                self.coalesced += 1
+            else:
+                self._popleft()
+                self.dropped += 1
+                self._append(item)
+
+    def get(self, block: bool = True, timeout: float = None) -> dict:
+        """Returns the oldest measurement.
+
+        Raises `queue.Empty` if nothing arrives within `timeout` or if
+        `block` is false and the queue is empty.
+        """
+        with self.cond:
+            if not block:
+                timeout = 0
+            if not self.cond.wait_for(lambda: len(self.items) > 0, timeout):
+                raise queue.Empty()
+            self.gets += 1
+            return self._popleft()
+
+    def get_batch(self, max_items: int, max_wait: float) -> list:
+        """Returns up to `max_items` of the oldest measurements.
+
+        This blocks until one measurement is queued then waits up to
+        `max_wait` seconds for more to arrive.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.items) > 0)
+            deadline = time.time() + max_wait
+            while len(self.items) < max_items:
+                left = deadline - time.time()
+                if left <= 0:
+                    break
+                if not self.cond.wait_for(lambda: len(self.items) >= max_items, left):
+                    break
+            batch = [self._popleft() for _ in range(min(max_items, len(self.items)))]
+            self.gets += len(batch)
+            return batch
+
+    def set_live(self, live: bool):
+        """Marks whether a client is taking measurements as they arrive.
+
+        This is cleared when the client disconnects so the queue starts
+        spilling again.
+        """
+        with self.cond:
+            self.live = live
+            self.cond.notify_all()
+
+    def spill_segments(self) -> list:
+        """Seals the spill log and returns its segments oldest first.
+
+        If the log is empty the queue becomes live and an empty list is
+        returned.
+        """
+        with self.cond:
+            segs = self.spill.seal()
+            if len(segs) == 0:
+                self.live = True
+                self.cond.notify_all()
+            return segs
+
+    def remove_spilled(self, path: str):
+        """Deletes a spill segment once it has been sent.
+        """
+        with self.cond:
+            self.spill.remove(path)
+
+    def stats(self) -> dict:
+        with self.cond:
+            return {
+                'depth': len(self.items),
+                'max_depth': self.max_depth,
+                'puts': self.puts,
+                'gets': self.gets,
+                'dropped': self.dropped,
+                'coalesced': self.coalesced,
+                'spilled': self.spilled,
+                'spill_bytes': self.spill.size() if self.spill is not None else 0,
+                'spill_dropped': self.spill.dropped_segments if self.spill is not None else 0,
+                'blocked_time': self.blocked_time,
+            }
+
+    def report(self) -> str:
+        s = self.stats()
+        text = 'queue depth %d (max %d) puts %d gets %d dropped %d coalesced %d blocked %.1fs' % (
+            s['depth'], s['max_depth'], s['puts'], s['gets'],
+            s['dropped'], s['coalesced'], s['blocked_time']
+        )
+        if self.spill is not None:
+            text += ' spilled %d (%d bytes on disk, %d segments dropped)' % (
+                s['spilled'], s['spill_bytes'], s['spill_dropped']
+            )
+        return text
+
+class RetentionWindow:
+    """The most recently sent measurements.
+
+    They are kept so a client that reconnects can be sent what it
+    missed.
+    """
+    def __init__(self, size: int = 1000):
+        self.items = collections.deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def add(self, items: list):
+        with self.lock:
+            self.items.extend(items)
+
+    def after(self, seq: int) -> list:
+        """Returns the kept measurements with a `seq` above `seq`.
+        """
+        with self.lock:
+            return [item for item in self.items if item['seq'] > seq]
@@ -0,0 +1,438 @@
+"""Reads measurements from several scan servers at once.
+
+Every server connection is non-blocking and driven by one selector so
+whichever server has data is read first and a slow or silent server
+does not hold up the others. A connection that fails, is reset, or
+goes quiet for longer than `idle_timeout` is closed and opened again
+after a backoff that doubles up to `max_backoff`. Reconnects happen
+from the same loop so nothing stops while a server is down.
+
+Each connection sends the hello of `lib.wire` and reads either binary
+frames or pickles depending on the answer. The connection remembers
+the server `epoch` and the last `seq` received and sends them in the
+hello when it reconnects so the server can resend what was missed.
+Anything at or below the last `seq` is dropped as a duplicate.
+
+With `credit_records` or `credit_bytes` the connection asks the server
+for flow control as in `lib.credit`. That much is granted in the hello
+and more is granted only after the measurements have been taken from
+the generator, so a caller that stops reading stops the server.
+
+A server on the same host may instead hand over its frames through a
+`lib.shmring` segment. Its `ShmConnection` is polled every pass of
+the loop, with the selector waiting at most `poll_s`, and reads every
+waiting frame without a system call. The server never hears from such
+a client so a subscription is applied here as the frames are read.
+Flow control is not available as the ring itself is bounded.
+"""
+import errno
+import pickle
+import selectors
+import socket
+import struct
+import time
+import numpy as np
+import lib.wire as wire
+from lib.credit import grant_message
+from lib.shmring import ShmRing
+from lib.subscription import Subscription
+
+class ServerConnection:
+    """The state of one server connection.
+    """
+    # The most messages handled per readiness event so a busy server
+    # can not starve the others.
+    burst = 64
+    # Read by `poll` instead of the selector.
+    polled = False
+
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            src_ndx: int,
+            raw: bool = False,
+            idle_timeout: float = 60.0,
+            subscribe: dict = None,
+            credit_records: int = None,
+            credit_bytes: int = None,
+            min_backoff: float = 0.5,
+            max_backoff: float = 30.0):
+        self.host = host
+        self.port = port
+        self.src_ndx = src_ndx
+        self.raw = raw
+        self.idle_timeout = idle_timeout
+        self.subscribe = subscribe
+        self.credit_records = credit_records
+        self.credit_bytes = credit_bytes
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+
+        self.sock = None
+        self.state = 'idle'
+        self.retry_at = 0.0
+        self.last_rx = 0.0
+        self.outbox = bytearray()
+        # The protocol or `None` until the first message.
+        self.proto = None
+        self.hdr = bytearray(4)
+        self.hdr_got = 0
+        self.payload = None
+        self.payload_got = 0
+
+        # Set once the server agreed to flow control and what was
+        # received since credit was last granted.
+        self.credit = False
+        self.owed_records = 0
+        self.owed_bytes = 0
+
+        # Kept across reconnects for resuming.
+        self.epoch = None
+        self.last_seq = -1
+
+        self.connects = 0
+        self.messages = 0
+        self.duplicates = 0
+
+    def connect(self, sel: selectors.BaseSelector):
+        """Starts a non-blocking connect.
+        """
+        print('connecting', self.host, self.port)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.sock.setblocking(False)
+        self.state = 'connecting'
+        self.proto = None
+        self.hdr_got = 0
+        self.payload = None
+        self.outbox = bytearray()
+        self.credit = False
+        self.owed_records = 0
+        self.owed_bytes = 0
+        self.last_rx = time.time()
+        err = self.sock.connect_ex((self.host, self.port))
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.sock.close()
+            self.sock = None
+            self._schedule_retry('connect error %d' % err)
+            return
+        sel.register(self.sock, selectors.EVENT_WRITE, self)
+
+    def _schedule_retry(self, reason: str):
+        print('disconnected', self.host, self.port, reason, 'retry in %.1fs' % self.backoff)
+        self.state = 'idle'
+        self.retry_at = time.time() + self.backoff
+        self.backoff = min(self.backoff * 2, self.max_backoff)
+
+    def close(self, sel: selectors.BaseSelector, reason: str):
+        if self.sock is not None:
+            try:
+                sel.unregister(self.sock)
+            except (KeyError, ValueError):
+                pass
+            self.sock.close()
+            self.sock = None
+        self._schedule_retry(reason)
+
+    def send(self, sel: selectors.BaseSelector, data: bytes):
+        """Queues data to be written when the socket is writable.
+        """
+        self.outbox += data
+        self._flush(sel)
+
+    def _flush(self, sel: selectors.BaseSelector):
+        if len(self.outbox) > 0:
+            try:
+                wrote = self.sock.send(self.outbox)
+            except BlockingIOError:
+                wrote = 0
+            del self.outbox[:wrote]
+        events = selectors.EVENT_READ
+        if len(self.outbox) > 0:
+            events |= selectors.EVENT_WRITE
+        sel.modify(self.sock, events, self)
+
+    def _on_connected(self, sel: selectors.BaseSelector):
+        err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err != 0:
+            self.close(sel, 'connect error %d' % err)
+            return
+        print('connected', self.host, self.port)
+        self.state = 'open'
+        self.connects += 1
+        self.backoff = self.min_backoff
+        self.last_rx = time.time()
+        hello = {}
+        if self.epoch is not None:
+            hello['epoch'] = self.epoch
+            hello['seq'] = self.last_seq
+        if self.subscribe is not None:
+            hello['subscribe'] = self.subscribe
+        if self.credit_records is not None or self.credit_bytes is not None:
+            hello['credit'] = {}
+            if self.credit_records is not None:
+                hello['credit']['records'] = int(self.credit_records)
+            if self.credit_bytes is not None:
+                hello['credit']['bytes'] = int(self.credit_bytes)
+        self.send(sel, wire.hello_message(**hello))
+
+    def _read_messages(self) -> list:
+        """Reads whatever is available and returns the complete messages.
+
+        Returns `None` if the server closed the connection.
+        """
+        out = []
+        while len(out) < self.burst:
+            try:
+                if self.payload is None:
+                    n = self.sock.recv_into(memoryview(self.hdr)[self.hdr_got:])
+                else:
+                    n = self.sock.recv_into(
+                        memoryview(self.payload)[self.payload_got:]
+                    )
+            except BlockingIOError:
+                break
+            if n == 0:
+                return None
+
+            if self.payload is None:
+                self.hdr_got += n
+                if self.hdr_got == 4:
+                    self.payload = bytearray(struct.unpack('>I', self.hdr)[0])
+                    self.payload_got = 0
+            else:
+                self.payload_got += n
+
+            if self.payload is not None and self.payload_got == len(self.payload):
+                # The message owns its buffer since a decoded frame is a view of it.
+                out.append(self.payload)
+                self.payload = None
+                self.hdr_got = 0
+        return out
+
+    def _decode(self, data) -> list:
+        """Returns the measurements in a message as `execute` yields them.
+        """
+        if self.proto is None or self.proto == 0:
+            if self.proto is None:
+                msg = wire.parse_ack(data)
+                if msg is not None:
+                    self.proto = msg['proto']
+                    print('server protocol', self.host, self.port, self.proto)
+                    self.credit = bool(msg.get('credit'))
+                    if msg.get('error') is not None:
+                        print('server error', self.host, self.port, msg['error'])
+                    if msg.get('epoch') != self.epoch:
+                        # A different server run numbers from scratch.
+                        self.epoch = msg.get('epoch')
+                        self.last_seq = -1
+                    return []
+                # An older server that ignored the hello.
+                self.proto = 0
+            msg = pickle.loads(data)
+            seq = msg.get('seq')
+            if seq is not None:
+                if seq <= self.last_seq:
+                    self.duplicates += 1
+                    return []
+                self.last_seq = seq
+            if self.raw:
+                return [wire.from_records([msg])]
+            return [msg]
+
+        frame = wire.decode(data)
+        if frame.has_seq():
+            seqs = frame.headers['seq']
+            keep = (seqs > self.last_seq) | (seqs < 0)
+            if not np.all(keep):
+                self.duplicates += int(np.count_nonzero(~keep))
+                frame = frame.subset(keep)
+            if len(frame) > 0:
+                self.last_seq = max(self.last_seq, int(np.max(frame.headers['seq'])))
+            if len(frame) == 0:
+                return []
+        if self.raw:
+            return [frame]
+        return frame.records()
+
+    def handle(self, sel: selectors.BaseSelector, mask: int) -> list:
+        """Handles a readiness event and returns the measurements read.
+        """
+        try:
+            if self.state == 'connecting':
+                self._on_connected(sel)
+                return []
+            if mask & selectors.EVENT_WRITE:
+                self._flush(sel)
+            if not (mask & selectors.EVENT_READ):
+                return []
+            msgs = self._read_messages()
+        except OSError as e:
+            self.close(sel, repr(e))
+            return []
+
+        if msgs is None:
+            self.close(sel, 'closed by server')
+            return []
+
+        out = []
+        if len(msgs) > 0:
+            self.last_rx = time.time()
+        for data in msgs:
+            self.messages += 1
+            if self.credit:
+                self.owed_records += wire.FRAME.unpack_from(data, 0)[4]
+                self.owed_bytes += len(data) + 4
+            out.extend(self._decode(data))
+        return out
+
+    def grant(self, sel: selectors.BaseSelector):
+        """Grants the server credit for what was received once it is half the window.
+        """
+        if not self.credit or self.state != 'open':
+            return
+        due = (
+            (self.credit_records is not None and self.owed_records * 2 >= self.credit_records) or
+            (self.credit_bytes is not None and self.owed_bytes * 2 >= self.credit_bytes)
+        )
+        if not due:
+            return
+        try:
+            self.send(sel, grant_message(self.owed_records, self.owed_bytes))
+        except OSError as e:
+            self.close(sel, repr(e))
+            return
+        self.owed_records = 0
+        self.owed_bytes = 0
+
+class ShmConnection(ServerConnection):
+    """Reads a server on the same host through shared memory.
+
+    Attaching is retried with the same backoff as a TCP connect until
+    the server has created the segment. The epoch is read from the
+    segment so `seq` numbering works the same as over TCP. A
+    `subscribe` dictionary is applied to what is read.
+    """
+    polled = True
+
+    def __init__(
+            self,
+            name: str,
+            src_ndx: int,
+            raw: bool = False,
+            idle_timeout: float = 60.0,
+            poll_s: float = 0.001,
+            subscribe: dict = None,
+            min_backoff: float = 0.5,
+            max_backoff: float = 30.0):
+        super().__init__(
+            'shm', name, src_ndx, raw, idle_timeout,
+            min_backoff=min_backoff, max_backoff=max_backoff
+        )
+        self.name = name
+        self.poll_s = poll_s
+        self.ring = None
+        self.filt = Subscription(subscribe) if subscribe is not None else None
+
+    def connect(self, sel: selectors.BaseSelector):
+        print('attaching', self.name)
+        try:
+            self.ring = ShmRing.attach(self.name)
+        except (FileNotFoundError, ValueError) as e:
+            self._schedule_retry(repr(e))
+            return
+        print('attached', self.name, self.ring.slots, 'slots')
+        self.state = 'open'
+        self.connects += 1
+        self.backoff = self.min_backoff
+        self.last_rx = time.time()
+        self.proto = wire.VERSION
+        if self.ring.epoch != self.epoch:
+            self.epoch = self.ring.epoch
+            self.last_seq = -1
+
+    def close(self, sel: selectors.BaseSelector, reason: str):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        self._schedule_retry(reason)
+
+    def poll(self) -> list:
+        """Returns the measurements waiting in the ring.
+        """
+        msgs = self.ring.get_many(self.burst)
+        out = []
+        if len(msgs) > 0:
+            self.last_rx = time.time()
+        for data in msgs:
+            self.messages += 1
+            out.extend(self._decode(data))
+        if self.filt is None or len(out) == 0:
+            return out
+        if not self.raw:
+            return self.filt.apply(out)
+        records = []
+        for frame in out:
+            records.extend(frame.records())
+        records = self.filt.apply(records)
+        if len(records) == 0:
+            return []
+        return [wire.from_records(records)]
+
+def read_servers(conns: list):
+    """Yields `(measurement, source index)` from every connection as it arrives.
+
+    This runs forever and reconnects connections that fail.
+    """
+    sel = selectors.DefaultSelector()
+    for conn in conns:
+        conn.connect(sel)
+
+    busy = False
+    while True:
+        # Time the caller spends on what was yielded is not silence from
+        # the servers, so it is taken off every idle clock below.
+        away = 0.0
+        now = time.time()
+        timeout = 0.0 if busy else 1.0
+        busy = False
+        for conn in conns:
+            if conn.state == 'idle':
+                if now >= conn.retry_at:
+                    conn.connect(sel)
+                else:
+                    timeout = min(timeout, conn.retry_at - now)
+            elif conn.state == 'open' and now - conn.last_rx > conn.idle_timeout:
+                conn.close(sel, 'silent for %.0fs' % (now - conn.last_rx))
+            elif conn.state == 'open' and conn.polled:
+                timeout = min(timeout, conn.poll_s)
+
+        if len(sel.get_map()) == 0:
+            time.sleep(max(timeout, 0))
+        else:
+            for key, mask in sel.select(max(timeout, 0)):
+                conn = key.data
+                for item in conn.handle(sel, mask):
+                    st = time.time()
+                    yield item, conn.src_ndx
+                    away += time.time() - st
+                # Only now were the measurements taken by the caller.
+                conn.grant(sel)
+
+        for conn in conns:
+            if conn.polled and conn.state == 'open':
+                items = conn.poll()
+                # More is waiting than one burst so do not sleep.
+                if conn.ring.used() > 0:
+                    busy = True
+                for item in items:
+                    st = time.time()
+                    yield item, conn.src_ndx
+                    away += time.time() - st
+
+        now = time.time()
+        for conn in conns:
+            if conn.state == 'open':
+                conn.last_rx = min(conn.last_rx + away, now)
@@ -0,0 +1,280 @@
+"""A simulated BladeRF card for running without hardware.
+
+`SimBladeRF` implements the parts of `bladerf.BladeRF` used by the
+scanner and produces SC16_Q11 samples from a configurable scene. It
+subclasses `BladeRFAndNumpy` so the numpy helpers work unchanged.
+
+The scene is a YAML file like the following.
+
+    noise: 0.01          # noise floor (rms) per channel or [ch0, ch1]
+    tune-delay: 0.0005   # seconds `set_frequency` blocks
+    settle-time: 0.002   # seconds of garbage samples after a retune
+    realtime: true       # pace `sync_rx` at the sample rate
+    seed: 0
+    carriers:
+      - freq: 101.1e6
+        amplitude: 0.3   # full scale is 1.0
+        channels: [0, 1]
+
+When `realtime` is enabled the device clock follows the wall clock
+and samples which are not read in time are lost, like an overrun on
+the real card. When disabled the samples are produced as fast as
+they are read which is useful for measuring the DSP alone.
+"""
+import time
+import yaml
+import numpy as np
+import bladerf
+from bladerf import _bladerf
+from lib.bladeandnumpy import BladeRFAndNumpy
+
+_ffi = _bladerf.ffi
+
+def load_scene(path: str) -> dict:
+    """Loads a scene from a YAML file.
+    """
+    with open(path, 'r') as fd:
+        scene = yaml.safe_load(fd)
+    return scene or {}
+
+class SimQuickTune:
+    """Stands in for `struct bladerf_quick_tune`.
+    """
+    def __init__(self, frequency: float):
+        self.frequency = frequency
+
+class SimBladeRF(BladeRFAndNumpy):
+    """A simulated two channel BladeRF.
+
+    Both RX channels share one LO just like the bladeRF 2.0 so tuning
+    either channel retunes both.
+    """
+    def __init__(self, scene: dict = None, device_identifier: str = None):
+        print('opened simulated device', device_identifier)
+        scene = scene or {}
+        self.scene = scene
+        self.device_identifier = device_identifier
+
+        noise = scene.get('noise', 0.01)
+        if not isinstance(noise, (list, tuple)):
+            noise = [noise, noise]
+        self.noise = [float(v) for v in noise]
+        self.tune_delay = float(scene.get('tune-delay', 0.0005))
+        self.settle_time = float(scene.get('settle-time', 0.002))
+        self.realtime = bool(scene.get('realtime', True))
+        self.carriers = [
+            (
+                float(c['freq']),
+                float(c.get('amplitude', 0.1)),
+                list(c.get('channels', [0, 1]))
+            )
+            for c in scene.get('carriers', [])
+        ]
+        self.rng = np.random.default_rng(scene.get('seed', None))
+
+        self.sps = 1e6
+        self.bandwidth = 200e3
+        self.gain = {}
+        self.gain_mode = {}
+        self.bias_tee = {}
+        self.enabled = set()
+        self.buffer_samps = 16 * 8192
+
+        # The LO history as `(timestamp, frequency)` so a block of samples
+        # spanning a retune is generated correctly.
+        self.tunes = [(0, 70e6)]
+        self.epoch = time.time()
+        self.rx_ts = 0
+
+    def __repr__(self):
+        return '<SimBladeRF({!r})>'.format(self.device_identifier)
+
+    def close(self):
+        pass
+
+    # Device clock
+
+    def _now_ts(self) -> int:
+        """Returns the current value of the device sample counter.
+        """
+        if self.realtime:
+            return int((time.time() - self.epoch) * self.sps)
+        return self.rx_ts
+
+    def get_timestamp(self, direction):
+        return self._now_ts()
+
+    # Configuration
+
+    def sync_config(self, layout, fmt, num_buffers, buffer_size, num_transfers,
+                    stream_timeout):
+        if fmt not in (bladerf.Format.SC16_Q11, bladerf.Format.SC16_Q11_META):
+            raise _bladerf.UnsupportedError('only SC16_Q11 is simulated')
+        self.layout = layout
+        self.buffer_samps = int(num_buffers * buffer_size)
+
+    def enable_module(self, ch, enable):
+        if enable:
+            self.enabled.add(ch)
+        else:
+            self.enabled.discard(ch)
+
+    def set_gain(self, ch, gain):
+        self.gain[ch] = gain
+
+    def get_gain(self, ch):
+        return self.gain.get(ch, 0)
+
+    def set_gain_mode(self, ch, mode):
+        self.gain_mode[ch] = mode
+
+    def get_gain_mode(self, ch):
+        return self.gain_mode.get(ch, bladerf.GainMode.Default)
+
+    def set_bias_tee(self, ch, enable):
+        self.bias_tee[ch] = bool(enable)
+
+    def get_bias_tee(self, ch):
+        return self.bias_tee.get(ch, False)
+
+    def set_sample_rate(self, ch, rate):
+        # Keep the device clock continuous across the rate change.
+        now = self._now_ts()
+        self.sps = float(rate)
+        if self.realtime:
+            self.epoch = time.time() - now / self.sps
+        return int(rate)
+
+    def get_sample_rate(self, ch):
+        return int(self.sps)
+
+    def set_bandwidth(self, ch, bandwidth):
+        self.bandwidth = float(bandwidth)
+        return int(bandwidth)
+
+    def get_bandwidth(self, ch):
+        return int(self.bandwidth)
+
+    def set_frequency(self, ch, frequency):
+        time.sleep(self.tune_delay)
+        self._retune(self._now_ts(), float(frequency))
+
+    def get_frequency(self, ch):
+        return int(self.tunes[-1][1])
+
+    def get_quick_tune(self, ch):
+        # The real structure holds synthesizer settings. Keeping the
+        # frequency is enough to reproduce the tuning here.
+        return SimQuickTune(self.tunes[-1][1])
+
+    def schedule_retune(self, ch, timestamp, frequency, quick_tune=None):
+        if quick_tune is not None:
+            frequency = quick_tune.frequency
+        if timestamp == 0:
+            # BLADERF_RETUNE_NOW
+            timestamp = self._now_ts()
+        self._retune(timestamp, float(frequency))
+
+    def cancel_scheduled_retunes(self, ch):
+        now = self._now_ts()
+        self.tunes = [item for item in self.tunes if item[0] <= now]
+
+    def _retune(self, ts: int, frequency: float):
+        self.tunes.append((int(ts), frequency))
+        self.tunes.sort(key=lambda item: item[0])
+        # Only the history that can still be read is needed.
+        while len(self.tunes) > 2 and self.tunes[1][0] < self.rx_ts - self.buffer_samps:
+            self.tunes.pop(0)
+
+    # Sample generation
+
+    def _generate(self, ts: int, count: int) -> np.ndarray:
+        """Returns `count` samples starting at `ts` as interleaved int16.
+        """
+        out = np.zeros((count, 2), np.complex128)
+        t = ts + np.arange(count)
+        settle = int(self.settle_time * self.sps)
+
+        for ndx, (tune_ts, lo) in enumerate(self.tunes):
+            if ndx + 1 < len(self.tunes):
+                end_ts = self.tunes[ndx + 1][0]
+            else:
+                end_ts = ts + count
+            a = max(tune_ts, ts) - ts
+            b = min(end_ts, ts + count) - ts
+            if a >= b:
+                continue
+            seg_t = t[a:b] / self.sps
+            for c_freq, c_amp, c_chans in self.carriers:
+                off = c_freq - lo
+                if abs(off) >= self.bandwidth * 0.5 or abs(off) >= self.sps * 0.5:
+                    continue
+                tone = c_amp * np.exp(2j * np.pi * off * seg_t)
+                for ch in c_chans:
+                    out[a:b, ch] += tone
+            # The synthesizer is still locking so the output is a mess.
+            s_end = min(tune_ts + settle, ts + count) - ts
+            if ndx > 0 and s_end > a:
+                out[a:s_end, :] = 0.5 + 0.5j
+
+        for ch in range(2):
+            out[:, ch] += (
+                self.rng.standard_normal(count) +
+                1j * self.rng.standard_normal(count)
+            ) * (self.noise[ch] / np.sqrt(2))
+
+        iq = np.empty((count, 2, 2), np.float64)
+        iq[:, :, 0] = out.real
+        iq[:, :, 1] = out.imag
+        iq *= 2048
+        np.clip(iq, -2048, 2047, out=iq)
+        return np.rint(iq).astype(np.int16)
+
+    def _read(self, buf, num_samples: int, start_ts: int, timeout_ms) -> int:
+        """Fills `buf` with `num_samples` interleaved samples from `start_ts`.
+        """
+        count = num_samples // 2
+        end_ts = start_ts + count
+
+        if self.realtime:
+            wait = (end_ts - self._now_ts()) / self.sps
+            if timeout_ms and wait > timeout_ms / 1000:
+                raise _bladerf.TimeoutError('simulated timeout')
+            if wait > 0:
+                time.sleep(wait)
+
+        samples = self._generate(start_ts, count)
+        _ffi.memmove(_ffi.from_buffer(buf), samples.tobytes(), samples.nbytes)
+        self.rx_ts = end_ts
+        return start_ts
+
+    def _stream_ts(self) -> int:
+        """Returns the timestamp of the next sample in the stream.
+
+        Samples older than the stream buffers have been overwritten
+        and are skipped just like an overrun on the card.
+        """
+        if self.realtime:
+            oldest = self._now_ts() - self.buffer_samps
+            if self.rx_ts < oldest:
+                self.rx_ts = oldest
+        return self.rx_ts
+
+    def sync_rx(self, buf, num_samples, timeout_ms=None, meta=None):
+        self._read(buf, num_samples, self._stream_ts(), timeout_ms)
+
+    def sync_rx_with_metadata(
+            self,
+            buf,
+            num_samples,
+            timeout_ms=None,
+            meta_flags=None,
+            meta_timestamp=0):
+        if meta_flags is None or meta_flags & _bladerf.MetadataFlags.NOW.value:
+            start_ts = self._stream_ts()
+        else:
+            start_ts = int(meta_timestamp)
+            if self.realtime and start_ts < self._now_ts() - self.buffer_samps:
+                raise _bladerf.TimePastError('simulated time past')
+        ts = self._read(buf, num_samples, start_ts, timeout_ms)
+        return 0, num_samples, ts
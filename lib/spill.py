@@ -0,0 +1,165 @@
+"""An append-only on-disk log used when no client is connected.
+
+Measurements that do not fit in memory are written to segment files
+in a directory. Each segment is a sequence of frames in exactly the
+format `bsocket.send_pickle` puts on the wire, a big endian 32-bit
+length followed by the pickle. A whole segment can therefore be sent
+to a client with bulk reads and no decoding.
+
+Segments are named `spill-<number>.log` and rotated once they reach
+`segment_bytes`. If `max_bytes` is given the oldest segments are
+deleted to stay under it. Segments left by a previous run are picked
+up when the log is opened and a frame cut short by a crash is
+truncated away.
+"""
+import os
+import pickle
+import struct
+
+class SpillLog:
+    """A directory of segment files holding length prefixed pickles.
+    """
+    def __init__(
+            self,
+            directory: str,
+            segment_bytes: int = 64 * 1024 * 1024,
+            max_bytes: int = None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        # Sealed segments oldest first as `(path, size)`.
+        self.sealed = []
+        self.next_ndx = 0
+        self.fd = None
+        self.fd_path = None
+        self.fd_size = 0
+        self.dropped_bytes = 0
+        self.dropped_segments = 0
+
+        nodes = sorted(
+            node for node in os.listdir(directory)
+            if node.startswith('spill-') and node.endswith('.log')
+        )
+        for node in nodes:
+            path = os.path.join(directory, node)
+            size = self._repair(path)
+            self.next_ndx = max(self.next_ndx, int(node[6:-4]) + 1)
+            if size == 0:
+                os.remove(path)
+            else:
+                self.sealed.append((path, size))
+
+        # The highest `seq` in the log so numbering can continue after it.
+        self.max_seq = -1
+        if len(self.sealed) > 0:
+            print('spill log has %d bytes from a previous run' % self.size())
+            for item in self.read_items(self.sealed[-1][0]):
+                self.max_seq = max(self.max_seq, item.get('seq', -1))
+
+    @staticmethod
+    def _repair(path: str) -> int:
+        """Truncates a partially written frame at the end of a segment.
+
+        Returns the size of the segment afterwards.
+        """
+        good = 0
+        with open(path, 'r+b') as fd:
+            end = fd.seek(0, 2)
+            while good + 4 <= end:
+                fd.seek(good)
+                sz = struct.unpack('>I', fd.read(4))[0]
+                if good + 4 + sz > end:
+                    break
+                good += 4 + sz
+            if good != end:
+                print('truncating partial frame in', path)
+                fd.truncate(good)
+        return good
+
+    def size(self) -> int:
+        """Returns the number of bytes in the log.
+        """
+        return sum(size for _, size in self.sealed) + self.fd_size
+
+    def __len__(self) -> int:
+        return len(self.sealed) + (1 if self.fd_size > 0 else 0)
+
+    def append(self, item):
+        """Appends one measurement to the log.
+        """
+        data = pickle.dumps(item)
+
+        if self.fd is None:
+            self.fd_path = os.path.join(
+                self.directory, 'spill-%010d.log' % self.next_ndx
+            )
+            self.next_ndx += 1
+            self.fd = open(self.fd_path, 'ab')
+            self.fd_size = 0
+
+        self.fd.write(struct.pack('>I', len(data)))
+        self.fd.write(data)
+        self.fd_size += 4 + len(data)
+
+        if self.fd_size >= self.segment_bytes:
+            self.seal()
+
+        if self.max_bytes is not None:
+            while len(self.sealed) > 0 and self.size() > self.max_bytes:
+                path, size = self.sealed.pop(0)
+                os.remove(path)
+                self.dropped_bytes += size
+                self.dropped_segments += 1
+                print('spill log is full, dropped', path)
+
+    def seal(self) -> list:
+        """Closes the segment being written and returns all sealed segments.
+
+        The returned list is oldest first. Call `remove` once a segment
+        has been sent. With `max_bytes` a returned segment can still be
+        dropped before it is read, opening it then raises
+        `FileNotFoundError`.
+        """
+        if self.fd is not None:
+            self.fd.close()
+            if self.fd_size > 0:
+                self.sealed.append((self.fd_path, self.fd_size))
+            else:
+                os.remove(self.fd_path)
+            self.fd = None
+            self.fd_size = 0
+        return [path for path, _ in self.sealed]
+
+    def remove(self, path: str):
+        """Deletes a sealed segment after it has been sent.
+        """
+        before = len(self.sealed)
+        self.sealed = [item for item in self.sealed if item[0] != path]
+        # It may have been dropped by `max_bytes` while being sent.
+        if len(self.sealed) != before:
+            os.remove(path)
+
+    @staticmethod
+    def read_items(path: str):
+        """Yields the measurements of a segment.
+        """
+        with open(path, 'rb') as fd:
+            while True:
+                sz_field = fd.read(4)
+                if len(sz_field) < 4:
+                    break
+                sz = struct.unpack('>I', sz_field)[0]
+                yield pickle.loads(fd.read(sz))
+
+    @staticmethod
+    def read_chunks(path: str, chunk_size: int = 4 * 1024 * 1024):
+        """Yields the raw bytes of a segment in large chunks.
+        """
+        with open(path, 'rb') as fd:
+            while True:
+                chunk = fd.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
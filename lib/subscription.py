@@ -0,0 +1,128 @@
+"""Filters and decimates the measurements sent to one client.
+
+A client may send a subscription in its hello as a dictionary. Every
+key is optional and may be written with `-` in place of `_`.
+
+    freq_min, freq_max  only measurements whose band overlaps this
+                        range, and of those only the channels inside it
+    channels            the indexes of the channels to keep, an empty
+                        list drops the channel data
+    aggregate           'max' or 'mean' to combine measurements of the
+                        same baseband wide cell
+    hops                how many measurements are combined, 1 default
+    min_interval        the fewest seconds between measurements sent
+                        for the same cell
+
+Without `aggregate` a measurement that arrives within `min_interval`
+of the last one sent for its cell is dropped. With it the measurement
+is combined into the pending one which is sent once it holds `hops`
+measurements and `min_interval` has passed. The combined measurement
+has the time, frequency, and `seq` of the newest one and its `count`
+is the number combined.
+
+The measurements given to `apply` are never changed because with
+`--fanout` they are shared by every client.
+"""
+import math
+
+AGGREGATES = ['max', 'mean']
+
+KEYS = ['freq_min', 'freq_max', 'channels', 'aggregate', 'hops', 'min_interval']
+
+class Subscription:
+    def __init__(self, spec: dict):
+        spec = {key.replace('-', '_'): value for key, value in spec.items()}
+        unknown = set(spec) - set(KEYS)
+        if len(unknown) > 0:
+            raise ValueError('unknown subscription keys %s' % sorted(unknown))
+
+        self.freq_min = float(spec.get('freq_min', -math.inf))
+        self.freq_max = float(spec.get('freq_max', math.inf))
+        channels = spec.get('channels')
+        self.channels = None if channels is None else [int(c) for c in channels]
+        self.aggregate = spec.get('aggregate')
+        if self.aggregate is not None and self.aggregate not in AGGREGATES:
+            raise ValueError('unknown aggregate %s' % self.aggregate)
+        self.hops = max(1, int(spec.get('hops', 1)))
+        self.min_interval = float(spec.get('min_interval', 0.0))
+
+        # The pending combined measurement and the time of the last
+        # one sent for each cell.
+        self.pending = {}
+        self.last_sent = {}
+
+    def _select(self, rec: dict):
+        """Returns a copy of `rec` with only the wanted channels or `None`.
+        """
+        half = rec.get('sps', 0) * 0.5
+        freq = rec['freq']
+        if freq + half < self.freq_min or freq - half > self.freq_max:
+            return None
+
+        out = dict(rec)
+        ch = rec.get('channel')
+        if ch is not None:
+            if self.channels is not None:
+                ch = [ch[ndx] for ndx in self.channels if ndx < len(ch)]
+            ch = [
+                dict(c) for c in ch
+                if self.freq_min <= freq + c['freq'] <= self.freq_max
+            ]
+            out['channel'] = ch
+        return out
+
+    def _combine(self, dst: dict, src: dict):
+        """Combines `src` into the pending measurement `dst`.
+        """
+        n = dst.get('count', 1)
+        m = src.get('count', 1)
+        if self.aggregate == 'max':
+            def comb(a, b):
+                return max(a, b)
+        else:
+            def comb(a, b):
+                return (a * n + b * m) / (n + m)
+
+        for key in ('b0', 'b1'):
+            dst[key] = comb(dst[key], src[key])
+        if dst.get('channel') is not None and src.get('channel') is not None:
+            for a, b in zip(dst['channel'], src['channel']):
+                a['b0'] = comb(a['b0'], b['b0'])
+                a['b1'] = comb(a['b1'], b['b1'])
+        for key in ('time', 'freq', 'seq'):
+            if key in src:
+                dst[key] = src[key]
+        dst['count'] = n + m
+
+    def apply(self, records: list) -> list:
+        """Returns what should be sent of `records`.
+        """
+        out = []
+        for rec in records:
+            rec = self._select(rec)
+            if rec is None:
+                continue
+
+            sps = rec.get('sps') or 1
+            cell = int(rec['freq'] // sps)
+            last = self.last_sent.get(cell)
+            due = last is None or rec['time'] - last >= self.min_interval
+
+            if self.aggregate is None:
+                if due:
+                    self.last_sent[cell] = rec['time']
+                    out.append(rec)
+                continue
+
+            pend = self.pending.get(cell)
+            if pend is None:
+                pend = rec
+                self.pending[cell] = pend
+            else:
+                self._combine(pend, rec)
+
+            if pend.get('count', 1) >= self.hops and due:
+                del self.pending[cell]
+                self.last_sent[cell] = pend['time']
+                out.append(pend)
+        return out
@@ -0,0 +1,171 @@
+"""Helpers for retuning the card quickly.
+
+After a retune the synthesizer needs time to lock and the samples
+captured during that time are garbage. Instead of reading and
+throwing away a fixed number of samples the capture can start at a
+device timestamp a known settle time after the retune. The samples
+before it are dropped by the library and never converted.
+
+A tuner retunes the card and captures one hop into a caller owned
+`(n, 2, 2)` int16 array. `BufferTuner` is the original behavior,
+`TimestampTuner` starts the capture at a timestamp, and
+`QuickTuneTuner` uses a precomputed quick tune table and schedules
+the retune to the next frequency to happen the moment the current
+capture ends.
+"""
+import time
+import numpy as np
+import bladerf
+from bladerf import _bladerf
+from lib.bladeandnumpy import BladeRFAndNumpy, sc16_to_complex
+
+def settle_timestamp(dev: BladeRFAndNumpy, settle_samps: int) -> int:
+    """Returns the device timestamp at which a capture may start.
+
+    This should be called right after the retune has returned.
+    """
+    return dev.get_timestamp(bladerf.Direction.RX) + int(settle_samps)
+
+def measure_settle_time(
+        dev: BladeRFAndNumpy,
+        sps: float,
+        freqs: list,
+        window: float = 0.02,
+        block: int = 256,
+        tolerance: float = 4.0) -> float:
+    """Measures how long the samples take to settle after a retune.
+
+    The card is retuned to each frequency in `freqs` and `window`
+    seconds of samples are captured starting at the retune. The
+    magnitude is averaged over blocks of `block` samples and the
+    capture is considered settled at the first block after which every
+    block is within `tolerance` robust deviations of the steady state
+    in the second half of the window. The worst case in seconds is
+    returned. The stream must use `Format.SC16_Q11_META`.
+    """
+    samps = int(window * sps) // block * block
+    raw = np.zeros((samps, 2, 2), np.int16)
+    worst = 0
+
+    for freq in freqs:
+        dev.set_frequency(0, freq)
+        dev.sample_into_i16(raw, timestamp=settle_timestamp(dev, 0))
+        b0, b1 = sc16_to_complex(raw)
+        mag = (np.abs(b0) + np.abs(b1)).reshape(-1, block).mean(axis=1)
+        steady = mag[len(mag) // 2:]
+        center = np.median(steady)
+        spread = np.median(np.abs(steady - center)) * 1.4826 + 1e-9
+        bad = np.nonzero(np.abs(mag - center) > spread * tolerance)[0]
+        bad = bad[bad < len(mag) // 2]
+        if len(bad) > 0:
+            worst = max(worst, (bad[-1] + 1) * block)
+
+    return worst / sps
+
+class BufferTuner:
+    """Retunes then reads and discards a fixed number of samples.
+    """
+    def __init__(self, dev: BladeRFAndNumpy, discard_samps: int):
+        self.dev = dev
+        self.discard_samps = int(discard_samps)
+
+    def capture(self, freq: int, next_freq: int, out: np.ndarray) -> bool:
+        self.dev.set_frequency(0, freq)
+        self.dev.sample_as_null(self.discard_samps, 2, 4, 0)
+        self.dev.sample_into_i16(out, 0)
+        return True
+
+class TimestampTuner:
+    """Retunes then captures starting the settle time after the retune.
+    """
+    def __init__(self, dev: BladeRFAndNumpy, settle_samps: int):
+        self.dev = dev
+        self.settle_samps = int(settle_samps)
+
+    def capture(self, freq: int, next_freq: int, out: np.ndarray) -> bool:
+        self.dev.set_frequency(0, freq)
+        try:
+            self.dev.sample_into_i16(
+                out, timestamp=settle_timestamp(self.dev, self.settle_samps)
+            )
+        except _bladerf.TimePastError:
+            print('capture time has past', freq)
+            return False
+        return True
+
+class QuickTuneTable:
+    """Quick tune entries for a grid of frequencies.
+
+    Building the table does a full retune for every frequency so it
+    takes a while for a large grid. Afterwards a retune to any of the
+    frequencies skips the synthesizer calculations.
+    """
+    def __init__(self, dev: BladeRFAndNumpy, freqs, ch: int = 0):
+        self.entries = {}
+        st = time.time()
+        lt = time.time()
+        for ndx, freq in enumerate(freqs):
+            freq = int(freq)
+            dev.set_frequency(ch, freq)
+            self.entries[freq] = dev.get_quick_tune(ch)
+            if time.time() - lt > 5:
+                lt = time.time()
+                print('[building quick tune table] %.2f%%' % (ndx / len(freqs) * 100.0))
+        print('built quick tune table of %d entries in %.1f seconds' % (
+            len(self.entries), time.time() - st
+        ))
+
+    def __contains__(self, freq) -> bool:
+        return int(freq) in self.entries
+
+    def __getitem__(self, freq):
+        return self.entries[int(freq)]
+
+class QuickTuneTuner:
+    """Hops using quick tune entries and scheduled retunes.
+
+    While the capture of the current frequency is in flight the retune
+    to the next frequency is already scheduled for the timestamp where
+    the capture ends. Only the settle time is lost between hops. The
+    frequencies must be in the quick tune table.
+    """
+    def __init__(
+            self,
+            dev: BladeRFAndNumpy,
+            settle_samps: int,
+            table: QuickTuneTable,
+            lead_samps: int):
+        self.dev = dev
+        self.settle_samps = int(settle_samps)
+        self.table = table
+        self.lead_samps = int(lead_samps)
+        # The frequency and timestamp of the retune already scheduled.
+        self.pending = None
+
+    def _resync(self, freq: int):
+        self.dev.cancel_scheduled_retunes(0)
+        ts = self.dev.get_timestamp(bladerf.Direction.RX) + self.lead_samps
+        self.dev.schedule_retune(0, ts, freq, self.table[freq])
+        self.pending = (freq, ts)
+
+    def capture(self, freq: int, next_freq: int, out: np.ndarray) -> bool:
+        if self.pending is None or self.pending[0] != freq:
+            self._resync(freq)
+
+        start = self.pending[1] + self.settle_samps
+        end = start + out.shape[0]
+
+        try:
+            self.dev.schedule_retune(0, end, next_freq, self.table[next_freq])
+            self.dev.sample_into_i16(out, timestamp=start)
+        except _bladerf.TimePastError:
+            print('capture time has past', freq)
+            self.pending = None
+            return False
+        except _bladerf.QueueFullError:
+            print('retune queue is full', freq)
+            self.pending = None
+            return False
+
+        self.pending = (next_freq, end)
+        return True
@@ -0,0 +1,144 @@
+"""Uploads packages to an object store from a pool of threads.
+
+`Uploader.submit` queues a package and returns. Each of `workers`
+threads takes the next package and uploads it, so one slow upload no
+longer holds up the ones behind it. A package larger than
+`multipart_bytes` is sent as a multipart upload of `part_bytes`
+parts. Every call is retried up to `attempts` times with a backoff
+that doubles from `min_backoff` to `max_backoff` plus some jitter, and
+a multipart upload only retries the part that failed.
+
+A package is handed to `on_fail(key, data)` if it still fails, or at
+once if more than `max_queued` are already waiting, which is where
+`s3shuffle.py` writes it to disk.
+"""
+import queue
+import random
+import threading
+import time
+
+class Uploader:
+    def __init__(
+            self,
+            store,
+            on_fail,
+            workers: int = 4,
+            max_queued: int = 16,
+            multipart_bytes: int = 16 * 1024 * 1024,
+            part_bytes: int = 8 * 1024 * 1024,
+            attempts: int = 5,
+            min_backoff: float = 0.5,
+            max_backoff: float = 30.0):
+        self.store = store
+        self.on_fail = on_fail
+        self.max_queued = max_queued
+        self.multipart_bytes = multipart_bytes
+        self.part_bytes = part_bytes
+        self.attempts = attempts
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.q = queue.Queue()
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.uploaded = 0
+        self.uploaded_bytes = 0
+        self.upload_time = 0.0
+        self.retries = 0
+        self.failed = 0
+        self.busy = 0
+
+        self.threads = []
+        for _ in range(workers):
+            th = threading.Thread(target=self._worker, daemon=True)
+            th.start()
+            self.threads.append(th)
+
+    def submit(self, key: str, data):
+        """Queues a package to be uploaded.
+        """
+        if self.q.qsize() >= self.max_queued:
+            print('[UP] %d packages waiting, sending %s to on_fail' % (self.q.qsize(), key))
+            with self.lock:
+                self.failed += 1
+            self.on_fail(key, data)
+            return
+        self.q.put((key, data))
+
+    def pending(self) -> int:
+        """Returns the number of packages queued or being uploaded.
+        """
+        return self.q.unfinished_tasks
+
+    def _retry(self, what: str, func, *args):
+        """Calls `func` until it succeeds or runs out of attempts.
+        """
+        backoff = self.min_backoff
+        for attempt in range(self.attempts):
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt + 1 == self.attempts:
+                    raise
+                print('[UP] %s failed: %s, retry in %.1fs' % (what, e, backoff))
+                with self.lock:
+                    self.retries += 1
+                time.sleep(backoff * random.uniform(1.0, 1.5))
+                backoff = min(backoff * 2, self.max_backoff)
+
+    def upload(self, key: str, data):
+        """Uploads one package with retries from the calling thread.
+
+        Raises the last error if every attempt failed.
+        """
+        view = memoryview(data)
+        if len(view) <= self.multipart_bytes:
+            self._retry('put ' + key, self.store.put, key, view)
+            return
+
+        upload_id = self._retry('create ' + key, self.store.create_multipart, key)
+        try:
+            etags = []
+            for ndx, start in enumerate(range(0, len(view), self.part_bytes)):
+                etags.append(self._retry(
+                    'part %d of %s' % (ndx + 1, key), self.store.upload_part,
+                    key, upload_id, ndx + 1, view[start:start + self.part_bytes]
+                ))
+            self._retry('complete ' + key, self.store.complete_multipart, key, upload_id, etags)
+        except Exception:
+            try:
+                self.store.abort_multipart(key, upload_id)
+            except Exception as e:
+                print('[UP] abort of', key, 'failed', e)
+            raise
+
+    def _worker(self):
+        while True:
+            key, data = self.q.get()
+            with self.lock:
+                self.busy += 1
+            st = time.time()
+            try:
+                self.upload(key, data)
+                with self.lock:
+                    self.uploaded += 1
+                    self.uploaded_bytes += len(data)
+                    self.upload_time += time.time() - st
+            except Exception as e:
+                print('[UP] giving up on', key, e)
+                with self.lock:
+                    self.failed += 1
+                self.on_fail(key, data)
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                self.q.task_done()
+
+    def report(self) -> str:
+        with self.lock:
+            dt = max(time.time() - self.start, 1e-6)
+            per = self.upload_time / self.uploaded if self.uploaded > 0 else 0.0
+            return '[UP] uploaded %d (%.1f MB, %.2f MB/s) %.2fs each, retries %d, failed %d, queued %d, busy %d' % (
+                self.uploaded, self.uploaded_bytes / 1e6, self.uploaded_bytes / dt / 1e6,
+                per, self.retries, self.failed, self.q.qsize(), self.busy
+            )
@@ -0,0 +1,235 @@
+"""A spill directory for packages that could not be uploaded.
+
+Packages are written to `path` as `<key>.pkg` and recorded in an
+append only journal of
+
+    add <key> <bytes> <created>
+    del <key>
+
+lines, so the pending packages are known at start without listing the
+directory and nothing is scanned while running. The journal is
+rewritten with only the live packages when opened and after every
+`COMPACT_EVERY` lines.
+
+The pending packages are kept in memory in a heap ordered by when they
+may next be tried and then by age, so the oldest goes first. `take`
+blocks until one is due. A package that fails again waits twice as long
+as the last time, from `min_backoff` up to `max_backoff`, and one that
+uploads makes all the others due at once since the link is back, which
+lets several threads drain the backlog together.
+
+Once the packages take more than `max_bytes` the oldest waiting ones
+are deleted to make room for new ones.
+"""
+import heapq
+import os
+import threading
+import time
+import uuid
+
+COMPACT_EVERY = 10000
+
+class SpillDir:
+    def __init__(
+            self,
+            path: str,
+            max_bytes: int = 1024 * 1024 * 1024,
+            min_backoff: float = 5.0,
+            max_backoff: float = 600.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.journal_path = os.path.join(path, 'journal')
+
+        # key -> [not_before, created, size, backoff]
+        self.entries = {}
+        self.heap = []
+        self.taken = {}
+        self.bytes = 0
+        self.added = 0
+        self.uploaded = 0
+        self.retries = 0
+        self.dropped = 0
+        self.journal_lines = 0
+        self.cond = threading.Condition()
+
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key + '.pkg')
+
+    def _load(self):
+        """Replays the journal and rewrites it with what is left.
+        """
+        live = {}
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'r') as fd:
+                for line in fd:
+                    parts = line.split()
+                    if len(parts) == 4 and parts[0] == 'add':
+                        live[parts[1]] = (int(parts[2]), float(parts[3]))
+                    elif len(parts) == 2 and parts[0] == 'del':
+                        live.pop(parts[1], None)
+                    # A torn last line is ignored.
+
+        for key, (size, created) in live.items():
+            if not os.path.exists(self._file(key)):
+                print('[SPILL] journal lists missing package', key)
+                continue
+            self._push(key, size, created)
+            self.bytes += size
+
+        self._compact()
+        if len(self.entries) > 0:
+            print('[SPILL] %d packages (%.1f MB) waiting in %s' % (
+                len(self.entries), self.bytes / 1e6, self.path
+            ))
+
+    def _compact(self):
+        tmp = self.journal_path + '.tmp'
+        with open(tmp, 'w') as fd:
+            for key, entry in self.entries.items():
+                fd.write('add %s %d %r\n' % (key, entry[2], entry[1]))
+            for key, entry in self.taken.items():
+                fd.write('add %s %d %r\n' % (key, entry[2], entry[1]))
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp, self.journal_path)
+        self.journal = open(self.journal_path, 'a')
+        self.journal_lines = len(self.entries) + len(self.taken)
+
+    def _log(self, line: str):
+        self.journal.write(line + '\n')
+        self.journal.flush()
+        self.journal_lines += 1
+        if self.journal_lines > COMPACT_EVERY:
+            self.journal.close()
+            self._compact()
+
+    def _push(self, key: str, size: int, created: float, not_before: float = 0.0, backoff: float = 0.0):
+        self.entries[key] = [not_before, created, size, backoff]
+        heapq.heappush(self.heap, (not_before, created, key))
+
+    def _drop_oldest(self):
+        key = min(self.entries, key=lambda k: self.entries[k][1])
+        size = self.entries.pop(key)[2]
+        self.bytes -= size
+        self.dropped += 1
+        self._log('del ' + key)
+        os.remove(self._file(key))
+        print('[SPILL] over %.1f MB, dropped %s' % (self.max_bytes / 1e6, key))
+
+    def add(self, key: str, data):
+        """Writes a package to the spill directory.
+        """
+        size = len(memoryview(data))
+        path = self._file(key)
+        tmp = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        with open(tmp, 'wb') as fd:
+            fd.write(data)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.replace(tmp, path)
+
+        with self.cond:
+            while len(self.entries) > 0 and self.bytes + size > self.max_bytes:
+                self._drop_oldest()
+            created = time.time()
+            self._log('add %s %d %r' % (key, size, created))
+            self._push(key, size, created)
+            self.bytes += size
+            self.added += 1
+            self.cond.notify()
+
+    def _pop_due(self, now: float):
+        """Returns the key of the next due package, or how long until one is.
+        """
+        while len(self.heap) > 0:
+            not_before, created, key = self.heap[0]
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != not_before:
+                # Dropped or made due again since it was pushed.
+                heapq.heappop(self.heap)
+                continue
+            if not_before > now:
+                return None, not_before - now
+            heapq.heappop(self.heap)
+            self.taken[key] = self.entries.pop(key)
+            return key, None
+        return None, None
+
+    def take(self):
+        """Waits for a package to be due and returns `(key, data)`.
+
+        The package must be given back to `done` or `retry`.
+        """
+        while True:
+            with self.cond:
+                while True:
+                    key, wait = self._pop_due(time.time())
+                    if key is not None:
+                        break
+                    self.cond.wait(wait)
+            try:
+                with open(self._file(key), 'rb') as fd:
+                    return key, fd.read()
+            except OSError as e:
+                print('[SPILL] lost package', key, e)
+                with self.cond:
+                    self._forget(key)
+
+    def _forget(self, key: str) -> bool:
+        entry = self.taken.pop(key, None)
+        if entry is None:
+            return False
+        self.bytes -= entry[2]
+        self._log('del ' + key)
+        try:
+            os.remove(self._file(key))
+        except FileNotFoundError:
+            pass
+        return True
+
+    def done(self, key: str):
+        """Forgets an uploaded package and makes the rest due.
+        """
+        with self.cond:
+            if self._forget(key):
+                self.uploaded += 1
+                self._wake()
+
+    def retry(self, key: str):
+        """Puts a package back to be tried again after its backoff.
+        """
+        with self.cond:
+            entry = self.taken.pop(key, None)
+            if entry is None:
+                return
+            _, created, size, backoff = entry
+            backoff = min(max(backoff * 2, self.min_backoff), self.max_backoff)
+            self.retries += 1
+            self._push(key, size, created, time.time() + backoff, backoff)
+            self.cond.notify()
+
+    def _wake(self):
+        if all(entry[0] == 0.0 for entry in self.entries.values()):
+            return
+        for entry in self.entries.values():
+            entry[0] = 0.0
+            entry[3] = 0.0
+        self.heap = [(0.0, entry[1], key) for key, entry in self.entries.items()]
+        heapq.heapify(self.heap)
+        self.cond.notify_all()
+
+    def pending(self) -> int:
+        with self.cond:
+            return len(self.entries) + len(self.taken)
+
+    def report(self) -> str:
+        with self.cond:
+            return '[SPILL] waiting %d busy %d (%.1f MB), added %d, uploaded %d, retries %d, dropped %d' % (
+                len(self.entries), len(self.taken), self.bytes / 1e6,
+                self.added, self.uploaded, self.retries, self.dropped
+            )
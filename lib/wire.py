@@ -0,0 +1,313 @@
+"""A compact binary format for sending measurements.
+
+A frame holds one or more measurements. It starts with a fixed frame
+header followed by one fixed size record header per measurement and
+then the channel data of every measurement as packed arrays.
+
+    frame header   magic 'NB', version, flags, channel dtype, count
+    record header  time, freq, b0, b1, bw, sps, src, count, nchan, seq
+    channel data   per record nchan freqs, nchan b0, nchan b1
+
+The `seq` field was added in version 2. If `FLAG_ZLIB` is set in the
+flags everything after the frame header is zlib compressed.
+Everything is little endian. The record headers are laid out as the
+numpy structured dtypes in `HEADER_DTYPES` so decoding a frame is a
+view of the buffer and no dictionaries are built.
+
+Frames are sent with the same 32-bit length prefix as
+`bsocket.send_pickle`. A client that understands this format sends
+`HELLO` as a JSON object right after connecting. The server answers
+with a JSON object holding the chosen `proto` version and binary
+frames follow. A server that does not answer within a short time, or
+a client that does not send a hello, keeps using one pickle per
+measurement so older peers still work. The server never unpickles
+what a client sends. A hello longer than `MAX_HELLO`, one that is not
+a JSON object naming `nbfreqscan`, or one with fields of the wrong
+type gets the client disconnected.
+
+The hello may also hold the `epoch` of the server run and the last
+`seq` the client received. The answer holds the server `epoch` and if
+it matches the server resends what it still has after that `seq`.
+A `subscribe` dictionary in the hello is read by `lib.subscription`.
+"""
+import json
+import socket
+import struct
+import zlib
+import numpy as np
+import lib.bsocket as bsocket
+
+VERSION = 2
+MAGIC = b'NB'
+
+# The frame header.
+FRAME = struct.Struct('<2sBBB3xI')
+
+FLAG_ZLIB = 1
+
+_HEADER_FIELDS = [
+    ('time', '<f8'),
+    ('freq', '<i8'),
+    ('b0', '<f8'),
+    ('b1', '<f8'),
+    ('bw', '<f8'),
+    ('sps', '<f8'),
+    ('src', '<u4'),
+    ('count', '<u4'),
+    ('nchan', '<u4'),
+    ('pad', '<u4'),
+]
+
+HEADER_DTYPES = {
+    1: np.dtype(_HEADER_FIELDS),
+    2: np.dtype(_HEADER_FIELDS + [('seq', '<i8')]),
+}
+
+HEADER_DTYPE = HEADER_DTYPES[VERSION]
+
+CHANNEL_DTYPES = {
+    1: np.dtype('<f4'),
+    2: np.dtype('<f8'),
+}
+
+CHANNEL_CODES = {
+    'float32': 1,
+    'float64': 2,
+}
+
+HELLO = {'hello': 'nbfreqscan', 'proto': [1, 2]}
+
+MAX_HELLO = 0x10000
+
+# The optional hello fields and the types they must have.
+_HELLO_FIELDS = {
+    'epoch': int,
+    'seq': int,
+    'subscribe': dict,
+    'credit': dict,
+}
+
+def encode(
+        records: list,
+        channel_dtype: str = 'float64',
+        src: int = 0,
+        level: int = 0,
+        version: int = VERSION) -> bytes:
+    """Encodes measurement dictionaries into one frame.
+
+    If `level` is not zero the frame is compressed with zlib at that
+    level. A measurement without a `seq` gets -1.
+    """
+    code = CHANNEL_CODES[channel_dtype]
+    cdt = CHANNEL_DTYPES[code]
+
+    rows = []
+    chans = []
+    for rec in records:
+        ch = rec.get('channel')
+        nchan = len(ch) if ch is not None else 0
+        row = (
+            rec['time'], rec['freq'], rec['b0'], rec['b1'],
+            rec.get('bw', 0), rec.get('sps', 0), rec.get('src', src),
+            rec.get('count', 1), nchan, 0
+        )
+        if version >= 2:
+            row += (rec.get('seq', -1),)
+        rows.append(row)
+        if nchan > 0:
+            # Stored as all freqs, then all b0, then all b1.
+            chans.append(np.array([
+                [c['freq'] for c in ch],
+                [c['b0'] for c in ch],
+                [c['b1'] for c in ch],
+            ], cdt).tobytes())
+    headers = np.array(rows, HEADER_DTYPES[version])
+
+    body = b''.join([headers.tobytes()] + chans)
+    flags = 0
+    if level:
+        body = zlib.compress(body, level)
+        flags |= FLAG_ZLIB
+    return FRAME.pack(MAGIC, version, flags, code, len(records)) + body
+
+class Frame:
+    """A decoded frame.
+
+    `headers` is a structured array of `HEADER_DTYPES` with one entry
+    per measurement. The channel arrays are read with `channels`.
+    Both are views of the frame buffer.
+    """
+    def __init__(self, headers: np.ndarray, channel_dtype: np.dtype, data, offsets):
+        self.headers = headers
+        self.channel_dtype = channel_dtype
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.headers)
+
+    def has_seq(self) -> bool:
+        return 'seq' in self.headers.dtype.names
+
+    def subset(self, ndxs) -> 'Frame':
+        """Returns a frame of only the measurements selected by `ndxs`.
+
+        `ndxs` may be indexes or a boolean mask. The buffer is shared.
+        """
+        return Frame(self.headers[ndxs], self.channel_dtype, self.data, self.offsets[ndxs])
+
+    def channels(self, ndx: int):
+        """Returns the `(freqs, b0, b1)` arrays of a measurement or `None`.
+        """
+        nchan = int(self.headers['nchan'][ndx])
+        if nchan == 0:
+            return None
+        arr = np.frombuffer(
+            self.data, self.channel_dtype, nchan * 3, int(self.offsets[ndx])
+        ).reshape(3, nchan)
+        return arr[0], arr[1], arr[2]
+
+    def records(self) -> list:
+        """Returns the measurements as dictionaries like the pickle format.
+        """
+        out = []
+        has_seq = self.has_seq()
+        for ndx, h in enumerate(self.headers.tolist()):
+            time_, freq, b0, b1, bw, sps, src, count = h[:8]
+            rec = {
+                'time': time_,
+                'freq': freq,
+                'b0': b0,
+                'b1': b1,
+                'bw': bw,
+                'sps': sps,
+                'src': src,
+                'channel': None,
+            }
+            if count > 1:
+                rec['count'] = count
+            if has_seq and h[10] >= 0:
+                rec['seq'] = h[10]
+            ch = self.channels(ndx)
+            if ch is not None:
+                rec['channel'] = [
+                    {'freq': f, 'b0': x, 'b1': y}
+                    for f, x, y in zip(ch[0].tolist(), ch[1].tolist(), ch[2].tolist())
+                ]
+            out.append(rec)
+        return out
+
+def decode(data) -> Frame:
+    """Decodes a frame without copying it unless it is compressed.
+    """
+    magic, version, flags, code, count = FRAME.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('not a measurement frame')
+    if version not in HEADER_DTYPES:
+        raise ValueError('unsupported frame version %d' % version)
+    cdt = CHANNEL_DTYPES[code]
+
+    pos = FRAME.size
+    if flags & FLAG_ZLIB:
+        data = zlib.decompress(memoryview(data)[pos:])
+        pos = 0
+    headers = np.frombuffer(data, HEADER_DTYPES[version], count, pos)
+    pos += headers.nbytes
+
+    sizes = headers['nchan'].astype(np.int64) * 3 * cdt.itemsize
+    offsets = pos + np.cumsum(sizes) - sizes
+    return Frame(headers, cdt, data, offsets)
+
+def from_records(records: list) -> Frame:
+    """Builds a frame from measurement dictionaries.
+
+    This is used for peers that only speak pickle so every source can
+    be read the same way.
+    """
+    return decode(encode(records))
+
+def _is_int(v) -> bool:
+    return isinstance(v, int) and not isinstance(v, bool)
+
+def _json_message(msg: dict) -> bytes:
+    data = json.dumps(msg).encode('utf8')
+    return struct.pack('>I', len(data)) + data
+
+def hello_message(**extra) -> bytes:
+    """Returns a length prefixed hello ready to send.
+    """
+    return _json_message(dict(HELLO, **extra))
+
+def send_hello(sock, **extra):
+    bsocket.send_exact(sock, hello_message(**extra))
+
+def parse_hello(data) -> dict:
+    """Checks a hello and returns it.
+
+    Raises `bsocket.SocketException` if it is malformed.
+    """
+    try:
+        msg = json.loads(bytes(data).decode('utf8'))
+    except (UnicodeDecodeError, ValueError):
+        raise bsocket.SocketException('malformed hello')
+    if not isinstance(msg, dict) or msg.get('hello') != HELLO['hello']:
+        raise bsocket.SocketException('not a hello')
+    proto = msg.get('proto')
+    if not isinstance(proto, list) or not all(_is_int(v) for v in proto):
+        raise bsocket.SocketException('bad hello proto %r' % (proto,))
+    for name, kind in _HELLO_FIELDS.items():
+        v = msg.get(name)
+        if v is None:
+            continue
+        if not (_is_int(v) if kind is int else isinstance(v, kind)):
+            raise bsocket.SocketException('bad hello %s' % name)
+    for v in (msg.get('credit') or {}).values():
+        if not _is_int(v) or v < 0:
+            raise bsocket.SocketException('bad hello credit')
+    return msg
+
+def parse_ack(data):
+    """Returns the handshake answer in a message or `None`.
+
+    The answer is JSON and a pickled measurement never starts with a
+    brace so the first message tells if the server answered.
+    """
+    if bytes(data[:1]) != b'{':
+        return None
+    try:
+        msg = json.loads(bytes(data).decode('utf8'))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if not isinstance(msg, dict) or not _is_int(msg.get('proto')):
+        return None
+    if msg['proto'] != 0 and msg['proto'] not in HEADER_DTYPES:
+        return None
+    return msg
+
+def read_hello(sock, timeout: float = 0.5):
+    """Waits for a client hello.
+
+    Returns the protocol version to use, with zero meaning one pickle
+    per measurement, and the hello or `None` if none was sent. If a
+    hello was sent it must be answered with `send_ack`. Raises
+    `bsocket.SocketException` for a hello that is too long or malformed.
+    """
+    sock.settimeout(timeout)
+    try:
+        sz_field = bsocket.recv_exact(sock, 4)
+    except socket.timeout:
+        return 0, None
+    finally:
+        sock.settimeout(None)
+
+    sz = struct.unpack('>I', sz_field)[0]
+    if sz > MAX_HELLO:
+        raise bsocket.SocketException('hello of %d bytes' % sz)
+    msg = parse_hello(bsocket.recv_exact(sock, sz))
+
+    common = [v for v in msg.get('proto', []) if v in HEADER_DTYPES]
+    proto = max(common) if len(common) > 0 else 0
+    return proto, msg
+
+def send_ack(sock, proto: int, **extra):
+    bsocket.send_exact(sock, _json_message(dict(extra, proto=proto)))
@@ -3,16 +3,30 @@
 This uses an AWS access key to download from an S3 bucket previously
 or currently being filled by `s3shuffle.py`. It stores the data into
 the local file.
+
+The local file is a columnar store, see `lib/colstore.py`, unless
+`--format pickle` is given to keep appending to an older pickle store.
+`convert_local_store.py` converts a pickle store.
+
+With `--store-path` the packages are read from a local directory
+written by `s3shuffle.py --store-path` instead of S3.
+
+Packages are downloaded and unpacked `--workers` at a time by
+`lib.downloader.fetch` and appended in timestamp order by this thread.
 """
 import pickle
-import boto3
-import pprint
-import io
 import datetime as dt
 import os
+import time
 import argparse
+from lib.colstore import ColumnStore, ColumnWriter, is_colstore, encode_block, rekey
+from lib.objectstore import FileStore, S3Store
+from lib.downloader import fetch
+import lib.package as package
 
 def get_boto3_s3_client(cred_file: str, region='us-east-2'):
+    import boto3
+
     with open(cred_file, 'r') as fd:
         lines = list(fd.readlines())
         access_key = lines[0].strip()
@@ -29,8 +43,35 @@ def get_boto3_s3_client(cred_file: str, region='us-east-2'):
 
     return c
 
-def main(cred_path: str, bucket_name: str, data_path: str):
-    s3c = get_boto3_s3_client(cred_path)
+def decode_columnar(s3_key: str, payload) -> list:
+    """Returns the blocks of a package ready to append to a columnar store.
+    """
+    if package.is_package(payload):
+        # The blocks are stored as they are with the key set.
+        return [rekey(raw, s3_key) for raw in package.blocks(payload)]
+    return [encode_block(s3_key, package.samples(payload))]
+
+def decode_pickle(s3_key: str, payload) -> list:
+    """Returns the samples of a package for a pickle store.
+    """
+    return package.samples(payload)
+
+def main(
+        store,
+        data_path: str,
+        store_format: str = 'columnar',
+        workers: int = 8,
+        max_buffered: int = 16):
+    """Appends every package in `store` not yet in `data_path`.
+
+    `store` is a `lib.objectstore.ObjectStore`. Up to `max_buffered`
+    packages are downloaded ahead of the one being appended.
+    """
+    if os.path.exists(data_path) and os.path.getsize(data_path) > 0:
+        if is_colstore(data_path) != (store_format == 'columnar'):
+            raise ValueError(
+                '%s is not a %s store, see convert_local_store.py' % (data_path, store_format)
+            )
 
     start_after = None
 
@@ -41,17 +82,7 @@ def main(cred_path: str, bucket_name: str, data_path: str):
     while True:
         print('Fetching S3 index.')
 
-        if start_after is None:
-            resp = s3c.list_objects_v2(
-                Bucket=bucket_name,
-            )
-        else:
-            resp = s3c.list_objects_v2(
-                Bucket=bucket_name,
-                StartAfter=start_after
-            )
-
-        nodes = resp['Contents']
+        nodes = store.list(start_after)
 
         for node in nodes:
             key = node['Key']
@@ -87,36 +118,51 @@ def main(cred_path: str, bucket_name: str, data_path: str):
 
         print('Scanning existing data to build index of downloaded bucket nodes..')
         try:
-            with open(data_path, 'rb') as fd:
-                try:
-                    while True:
-                        s3_key, _ = pickle.load(fd)
-                        s3_fetched.add('-'.join([str(v) for v in s3_key]))
-                except EOFError:
-                    pass
+            if store_format == 'columnar':
+                # Only the block headers are read.
+                s3_fetched.update(ColumnStore(data_path).keys())
+            else:
+                with open(data_path, 'rb') as fd:
+                    try:
+                        while True:
+                            s3_key, _ = pickle.load(fd)
+                            s3_fetched.add('-'.join([str(v) for v in s3_key]))
+                    except EOFError:
+                        pass
         except FileNotFoundError:
             pass
     
     s3_online.sort(key=lambda item: item[1])
 
-    with open(data_path, 'ab') as plot_fd:
-        for key, _ in s3_online:
-            if key in s3_fetched:
-                print('skipped', key)
-                continue
+    if store_format == 'columnar':
+        plot_fd = ColumnWriter(data_path)
+        decode = decode_columnar
+    else:
+        plot_fd = open(data_path, 'ab')
+        decode = decode_pickle
+
+    wanted = []
+    for key, _ in s3_online:
+        if key in s3_fetched:
+            print('skipped', key)
+            continue
+        wanted.append(key)
+
+    print(f'Downloading {len(wanted)} items {workers} at a time.')
 
-            s3_fetched.add(key)
+    st = time.time()
+    got_bytes = 0
 
-            data_fd = io.BytesIO()
-            
-            ts = float(key.split('-')[1])
+    with plot_fd:
+        for s3_key, size, items in fetch(store, wanted, decode, workers, max_buffered):
+            got_bytes += size
 
-            print('Downloading.', dt.datetime.fromtimestamp(ts))
-            s3c.download_fileobj(bucket_name, key, data_fd)
-            print('Appending.')
-            data_fd.seek(0)
+            ts = float(s3_key.split('-')[1])
+            print('Appending.', dt.datetime.fromtimestamp(ts), '%.2f MB/s' % (
+                got_bytes / max(time.time() - st, 1e-6) / 1e6
+            ))
 
-            key = key.split('-')
+            key = s3_key.split('-')
             key = (
                 key[0],
                 float(key[1]),
@@ -124,17 +170,15 @@ def main(cred_path: str, bucket_name: str, data_path: str):
                 float(key[3]),
             )
 
-            data = []
-            try:
-                while True:
-                    item = pickle.load(data_fd)
-                    data.append(item)
-            except EOFError:
-                pass
+            if store_format == 'columnar':
+                for raw in items:
+                    plot_fd.append_raw(raw)
+            else:
+                pickle.dump((
+                    (key, items)
+                ), plot_fd)
 
-            pickle.dump((
-                (key, data)
-            ), plot_fd)
+            s3_fetched.add(s3_key)
 
     with open(data_path + '.index', 'wb') as fd:
         pickle.dump(s3_fetched, fd)
@@ -142,11 +186,25 @@ def main(cred_path: str, bucket_name: str, data_path: str):
 if __name__ == '__main__':
     ap = argparse.ArgumentParser()
     c_help = 'The path to the credentials. The AWS access key and AWS secret key on seperate lines in text UTF-8 format.'
-    ap.add_argument('--cred-path', type=str, required=True, help=c_help)
+    ap.add_argument('--cred-path', type=str, default=None, help=c_help)
     c_help = 'The S3 bucket name.'
-    ap.add_argument('--bucket-name', type=str, required=True, help=c_help)
+    ap.add_argument('--bucket-name', type=str, default=None, help=c_help)
+    c_help = 'Read the packages from this local directory, written by s3shuffle.py --store-path, instead of S3.'
+    ap.add_argument('--store-path', type=str, default=None, help=c_help)
     c_help = 'The path to the local data store file.'
     ap.add_argument('--data-path', type=str, required=True, help=c_help)
+    c_help = 'The format of the local data store. The pickle format is the one older versions wrote.'
+    ap.add_argument('--format', type=str, default='columnar', choices=['columnar', 'pickle'], help=c_help)
+    c_help = 'The number of packages downloaded at once.'
+    ap.add_argument('--workers', type=int, default=8, help=c_help)
+    c_help = 'The most packages downloaded ahead of the one being appended.'
+    ap.add_argument('--max-buffered', type=int, default=16, help=c_help)
     #main('z:\\nbfreqscan\\s3sak.txt', 'radio248', 's3radio248.pickle')
     args = ap.parse_args()
-    main(args.cred_path, args.bucket_name, args.data_path)
\ No newline at end of file
+    if args.store_path is not None:
+        store = FileStore(args.store_path)
+    elif args.cred_path is None or args.bucket_name is None:
+        ap.error('--cred-path and --bucket-name are needed unless --store-path is given')
+    else:
+        store = S3Store(get_boto3_s3_client(args.cred_path), args.bucket_name)
+    main(store, args.data_path, args.format, args.workers, args.max_buffered)
\ No newline at end of file
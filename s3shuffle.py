@@ -11,22 +11,34 @@ There is currently only one third-party dependency.
     the interface with Amazon S3.
 
     python3 -m pip install boto3
+
+It is not needed with `--store-path`, which writes the packages to a
+local directory through `lib.objectstore.FileStore` instead. This is
+meant for testing the shuffle and fetch path without AWS.
+
+Packages are uploaded by the worker pool of `lib.uploader.Uploader`.
+They are compressed columnar blocks, see `lib.package`, and are closed
+once their compressed size passes `--package-mb`. Those that fail go to
+the spill directory of `lib.uploadspill.SpillDir` which `--spill-workers`
+threads drain.
 """
 import freqscanclient
-import io
 import time
 import uuid
-import pickle
-import boto3
-import os.path
 import os
-import queue
 import threading
+import argparse
+from lib.objectstore import FileStore, S3Store
+from lib.uploader import Uploader
+from lib.package import PackageBuilder
+from lib.uploadspill import SpillDir
 
 def get_boto3_s3_client(region='us-east-2'):
     """Get a Boto3 S3 client using the local credential
     file s3sak.txt and return it.
     """
+    import boto3
+
     with open('s3sak.txt', 'r') as fd:
         lines = list(fd.readlines())
         access_key = lines[0].strip()
@@ -44,32 +56,49 @@ def get_boto3_s3_client(region='us-east-2'):
     return c
 
 
-def main():
+def get_store(args):
+    """Returns the object store packages are uploaded to.
+    """
+    if args.store_path is not None:
+        return FileStore(args.store_path, args.store_latency, args.store_fail_rate)
+    return S3Store(get_boto3_s3_client(), args.bucket)
+
+def main(args):
     """The main entry point for the program if run standalone.
     """
-    s3c = get_boto3_s3_client()
+    store = get_store(args)
 
-    source = freqscanclient.execute('config.yaml')
+    spill = SpillDir(
+        args.spill_path,
+        max_bytes=int(args.spill_mb * 1024 * 1024),
+        min_backoff=args.spill_min_backoff,
+        max_backoff=args.spill_max_backoff
+    )
+    import_old_spill(spill)
 
-    q = queue.Queue()
+    source = freqscanclient.execute(args.config)
 
-    upload_worker_th = threading.Thread(
-        target=upload_worker,
-        args=(s3c, q),
-        daemon=True
+    uploader = Uploader(
+        store,
+        spill.add,
+        workers=args.workers,
+        max_queued=args.max_queued,
+        multipart_bytes=int(args.multipart_mb * 1024 * 1024),
+        part_bytes=int(args.part_mb * 1024 * 1024)
     )
 
-    disk_worker_th = threading.Thread(
-        target=disk_worker,
-        args=(s3c,),
-        daemon=True
-    )
+    for _ in range(args.spill_workers):
+        disk_worker_th = threading.Thread(
+            target=disk_worker,
+            args=(uploader, spill),
+            daemon=True
+        )
+        disk_worker_th.start()
 
-    upload_worker_th.start()
-    disk_worker_th.start()
+    package_bytes = int(args.package_mb * 1024 * 1024)
 
     while True:
-        pkg = io.BytesIO()
+        pkg = PackageBuilder(args.compress_level)
 
         newest = None
         oldest = None
@@ -86,87 +115,89 @@ def main():
             if oldest is None or ts < oldest:
                 oldest = ts
 
-            pickle.dump({
-                'data': data,
-                'src_ndx': src_ndx,
-            }, pkg)
+            pkg.add(data, src_ndx)
 
             if time.time() - ist > 3:
                 ist = time.time()
-                prog = pkg.tell() / (1024 * 1024 * 4) * 100.0
+                prog = pkg.size() / package_bytes * 100.0
                 print('package progress: %.02f' % prog)
 
-            if pkg.tell() > 1024 * 1024 * 4:
+            if pkg.size() > package_bytes:
                 break
-        
-        print('package ready', time.time())
-        
-        # Save the buffer in the event it is needed because
-        # s3c calls close on the BytesIO object rendering
-        # it unusable.
-        buf = pkg.getvalue()
-        
-        pkg.seek(0)
+
+        data = pkg.finish()
+        print('package ready', time.time(), '%d records %d bytes from %d' % (
+            pkg.records, len(data), pkg.raw_bytes
+        ))
+        print(uploader.report())
+        print(spill.report())
+
         ct = time.time()
         uid = uuid.uuid4().hex
         pkg_key = f'{uid}-{ct}-{oldest}-{newest}'
 
-        q.put((pkg_key, pkg))
-
-def upload_worker(s3c, q):
-    """Upload items from queue to Amazon S3.
+        uploader.submit(pkg_key, data)
 
-    The main thread sends item via the queue, these
-    are uploaded, and if the upload fails for any
-    reason the package is written out to disk.
+def import_old_spill(spill):
+    """Moves packages left in the working directory as `s3.<key>`
+    files by older versions into the spill directory.
+    """
+    for node in os.listdir('.'):
+        if not node.startswith('s3.') or not os.path.isfile(node):
+            continue
+        print('[DISK] importing', node)
+        with open(node, 'rb') as fd:
+            spill.add(node[3:], fd.read())
+        os.remove(node)
+
+def disk_worker(uploader, spill):
+    """Upload packages from the spill directory.
+
+    Takes the oldest package that is due, tries to upload
+    it and either forgets it or puts it back to wait out
+    its backoff.
     """
     while True:
-        pkg_key, pkg = q.get()
-        buf = pkg.getvalue()
+        pkg_key, data = spill.take()
         try:
-            if q.qsize() > 6:
-                raise Exception('queue size is too big forcing disk dump')
-            print('[UP] uploading', pkg_key)
-            s3c.upload_fileobj(pkg, 'radio248', pkg_key)
-            print('[UP] upload successful')
+            print('[DISK] uploading', pkg_key)
+            uploader.upload(pkg_key, data)
+            spill.done(pkg_key)
         except Exception as e:
-            print(e)
-            print('[UP] dumped to disk', e)
-            with open('s3.' + pkg_key, 'wb') as fd:
-                fd.write(buf)
-
-def disk_worker(s3c):
-    """Upload items from disk to Amazon S3.
-
-    Scan the disk on interval and locate S3 package
-    that failed to upload the first time. Try to
-    upload each package and on success delete the
-    disk file.
-    """
-    while True:
-        for node in os.listdir('.'):
-            if not node.startswith('s3.'):
-                continue
-
-            pkg_key = node[3:]
-            
-            try:
-                print('[DISK] uploading', node)
-                with open(node, 'rb') as fd:
-                    s3c.upload_fileobj(
-                        fd, 
-                        'radio248', 
-                        pkg_key,
-                        ExtraArgs={
-                            'StorageClass': 'STANDARD',
-                        }
-                    )
-                os.remove(node)          
-            except Exception as e:
-                print('[DISK]', e)
-        
-        print('[DISK] sleeping')
-        time.sleep(30)
+            print('[DISK]', pkg_key, e)
+            spill.retry(pkg_key)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--config', type=str, default='config.yaml')
+    b_help = 'The S3 bucket name.'
+    ap.add_argument('--bucket', type=str, default='radio248', help=b_help)
+    sp_help = 'Upload to this local directory instead of S3, for testing without AWS.'
+    ap.add_argument('--store-path', type=str, default=None, help=sp_help)
+    sl_help = 'Seconds of latency added to every call to the --store-path store.'
+    ap.add_argument('--store-latency', type=float, default=0.0, help=sl_help)
+    sf_help = 'The fraction of calls to the --store-path store that fail.'
+    ap.add_argument('--store-fail-rate', type=float, default=0.0, help=sf_help)
+    pk_help = 'The compressed size in megabytes at which a package is uploaded.'
+    ap.add_argument('--package-mb', type=float, default=4.0, help=pk_help)
+    cl_help = 'The zlib level packages are compressed with.'
+    ap.add_argument('--compress-level', type=int, default=6, choices=range(10), help=cl_help)
+    w_help = 'The number of packages uploaded at once.'
+    ap.add_argument('--workers', type=int, default=4, help=w_help)
+    mq_help = 'The most packages waiting to upload before new ones are written to disk.'
+    ap.add_argument('--max-queued', type=int, default=16, help=mq_help)
+    mm_help = 'Packages larger than this many megabytes are sent as multipart uploads.'
+    ap.add_argument('--multipart-mb', type=float, default=16.0, help=mm_help)
+    pm_help = 'The size in megabytes of each part of a multipart upload. S3 needs at least 5.'
+    ap.add_argument('--part-mb', type=float, default=8.0, help=pm_help)
+    spp_help = 'The directory packages that failed to upload are kept in.'
+    ap.add_argument('--spill-path', type=str, default='s3spill', help=spp_help)
+    spm_help = 'The most megabytes kept in --spill-path, the oldest packages are dropped past it.'
+    ap.add_argument('--spill-mb', type=float, default=1024.0, help=spm_help)
+    spw_help = 'The number of packages uploaded from --spill-path at once.'
+    ap.add_argument('--spill-workers', type=int, default=4, help=spw_help)
+    spb_help = 'The seconds a spilled package waits after its first failed retry, doubling each time.'
+    ap.add_argument('--spill-min-backoff', type=float, default=5.0, help=spb_help)
+    spx_help = 'The most seconds a spilled package waits between retries.'
+    ap.add_argument('--spill-max-backoff', type=float, default=600.0, help=spx_help)
+    main(ap.parse_args())
\ No newline at end of file
@@ -0,0 +1,32 @@
+"""Checks the polyphase channelizer against the original sosfilt one.
+"""
+import numpy as np
+import pytest
+import lib.channelizer as channelizer
+
+SPS = 1e6
+SAMP_COUNT = 25000
+
+# The power of each channel in dB relative to sosfilt. The start up
+# transient of the Butterworth filter sets the worst case.
+MEDIAN_DB = 0.5
+MAX_DB = 2.0
+
+@pytest.mark.parametrize('channel_bw', [10e3, 25e3, 50e3])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_pfb_power_error(channel_bw, seed):
+    err, _, _ = channelizer.compare('pfb', SPS, channel_bw, SAMP_COUNT, seed)
+    err = np.abs(err)
+    assert np.median(err) < MEDIAN_DB
+    assert np.max(err) < MAX_DB
+
+def test_pfb_centers_match_sosfilt():
+    for channel_bw in (10e3, 25e3, 50e3, 100e3):
+        pfb = channelizer.PolyphaseChannelizer.centers(SPS, channel_bw)
+        ref = channelizer.SosfiltChannelizer.centers(SPS, channel_bw)
+        assert np.allclose(pfb, ref)
+
+def test_pfb_refuses_uneven_bandwidth():
+    assert not channelizer.whole_channels(SPS, 30e3)
+    with pytest.raises(ValueError, match='whole multiple'):
+        channelizer.create('pfb', SPS, 30e3, SAMP_COUNT)
@@ -0,0 +1,92 @@
+"""Checks the chunked measurement file and its crash repair.
+"""
+import os
+import pickle
+import struct
+import pytest
+import lib.groupwriter as groupwriter
+from lib.groupwriter import GroupWriter, read_records
+
+def record(ndx):
+    return (1700000000.0 + ndx, int(900e6) + ndx, 0.5, 0.25, 0)
+
+def write(path, start, count, max_records=10):
+    writer = GroupWriter(path, max_records=max_records, max_ms=10000.0)
+    writer.write_many([record(ndx) for ndx in range(start, start + count)])
+    writer.close()
+    return writer
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'out.plot')
+    writer = write(path, 0, 25)
+    assert writer.records == 25
+    assert list(read_records(path)) == [record(ndx) for ndx in range(25)]
+
+def test_append_after_reopen(tmp_path):
+    path = str(tmp_path / 'out.plot')
+    write(path, 0, 10)
+    write(path, 10, 10)
+    assert list(read_records(path)) == [record(ndx) for ndx in range(20)]
+
+def test_fsync_every_chunk(tmp_path):
+    path = str(tmp_path / 'out.plot')
+    writer = GroupWriter(path, max_records=5, fsync_s=0)
+    writer.write_many([record(ndx) for ndx in range(20)])
+    writer.close()
+    assert writer.syncs > 0
+    assert len(list(read_records(path))) == 20
+
+@pytest.mark.parametrize('tail', [
+    # A header cut short.
+    groupwriter.MAGIC + b'\x00\x00',
+    # A payload shorter than its length.
+    groupwriter.CHUNK.pack(groupwriter.MAGIC, 100, 0) + b'abc',
+    # Garbage that is not a chunk.
+    b'garbage after the last chunk',
+])
+def test_torn_tail_is_truncated(tmp_path, tail):
+    path = str(tmp_path / 'out.plot')
+    write(path, 0, 20)
+    good = os.path.getsize(path)
+    with open(path, 'ab') as fd:
+        fd.write(tail)
+    assert list(read_records(path)) == [record(ndx) for ndx in range(20)]
+
+    write(path, 20, 5)
+    assert os.path.getsize(path) > good
+    assert list(read_records(path)) == [record(ndx) for ndx in range(25)]
+
+def test_bad_checksum_stops_reading(tmp_path):
+    path = str(tmp_path / 'out.plot')
+    # One chunk per writer.
+    for start in (0, 10, 20):
+        write(path, start, 10)
+    with open(path, 'r+b') as fd:
+        # Flip a byte in the payload of the second chunk.
+        _, sz, _ = groupwriter.CHUNK.unpack(fd.read(groupwriter.CHUNK.size))
+        pos = groupwriter.CHUNK.size * 2 + sz + 5
+        fd.seek(pos)
+        byte = fd.read(1)
+        fd.seek(pos)
+        fd.write(bytes([byte[0] ^ 0xff]))
+    assert list(read_records(path)) == [record(ndx) for ndx in range(10)]
+
+    # Reopening truncates the bad chunk and everything after it.
+    write(path, 10, 5)
+    assert list(read_records(path)) == [record(ndx) for ndx in range(15)]
+
+def test_legacy_file_is_moved(tmp_path):
+    path = str(tmp_path / 'out.plot')
+    with open(path, 'wb') as fd:
+        for ndx in range(3):
+            pickle.dump(record(ndx), fd)
+    write(path, 10, 5)
+    assert os.path.exists(path + '.legacy')
+    assert list(read_records(path)) == [record(ndx) for ndx in range(10, 15)]
+
+def test_unknown_file_is_refused(tmp_path):
+    path = str(tmp_path / 'out.plot')
+    with open(path, 'wb') as fd:
+        fd.write(struct.pack('>I', 7) + b'not ours')
+    with pytest.raises(ValueError, match='not a chunked measurement file'):
+        GroupWriter(path)
@@ -0,0 +1,109 @@
+"""Checks the binary frame format and the JSON handshake.
+"""
+import pickle
+import numpy as np
+import pytest
+import lib.bsocket as bsocket
+import lib.wire as wire
+
+def records(count=5, nchan=4):
+    out = []
+    for ndx in range(count):
+        out.append({
+            'time': 1700000000.0 + ndx,
+            'freq': int(900e6) + ndx * int(1e6),
+            'b0': 0.25 * ndx,
+            'b1': 0.5 * ndx,
+            'bw': 200e3,
+            'sps': 1e6,
+            'src': 0,
+            'seq': 100 + ndx,
+            # Every other measurement has no channels.
+            'channel': [
+                {'freq': 1e3 * c, 'b0': 0.125 * c, 'b1': 0.0625 * c}
+                for c in range(nchan)
+            ] if ndx % 2 == 0 else None,
+        })
+    return out
+
+@pytest.mark.parametrize('level', [0, 6])
+@pytest.mark.parametrize('version', [1, 2])
+def test_round_trip(version, level):
+    recs = records()
+    frame = wire.decode(wire.encode(recs, level=level, version=version))
+    assert len(frame) == len(recs)
+    assert frame.has_seq() == (version >= 2)
+    out = frame.records()
+    for rec, got in zip(recs, out):
+        if version < 2:
+            rec = dict(rec)
+            del rec['seq']
+        assert got == rec
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_round_trip_float32(version):
+    recs = records()
+    frame = wire.decode(wire.encode(recs, 'float32', level=1, version=version))
+    freqs, b0, b1 = frame.channels(0)
+    assert freqs.dtype == np.float32
+    assert np.allclose(b0, [c['b0'] for c in recs[0]['channel']])
+    assert frame.channels(1) is None
+
+def test_compression_flag():
+    recs = records(20, 64)
+    plain = wire.encode(recs)
+    packed = wire.encode(recs, level=6)
+    assert plain[3] & wire.FLAG_ZLIB == 0
+    assert packed[3] & wire.FLAG_ZLIB
+    assert len(packed) < len(plain)
+
+def test_missing_seq():
+    recs = records()
+    del recs[1]['seq']
+    out = wire.decode(wire.encode(recs)).records()
+    assert 'seq' not in out[1]
+    assert out[2]['seq'] == 102
+
+def test_decode_rejects_bad_frames():
+    data = bytearray(wire.encode(records()))
+    data[0:2] = b'XX'
+    with pytest.raises(ValueError, match='not a measurement frame'):
+        wire.decode(bytes(data))
+    data = bytearray(wire.encode(records()))
+    data[2] = 9
+    with pytest.raises(ValueError, match='unsupported frame version'):
+        wire.decode(bytes(data))
+
+def test_hello_round_trip():
+    data = wire.hello_message(epoch=7, seq=11, credit={'records': 5})[4:]
+    msg = wire.parse_hello(data)
+    assert msg['proto'] == wire.HELLO['proto']
+    assert msg['epoch'] == 7
+    assert msg['seq'] == 11
+
+@pytest.mark.parametrize('data', [
+    b'\x80\x04K\x01.',
+    pickle.dumps(wire.HELLO),
+    b'\xff\xfe',
+    b'[1, 2]',
+    b'{"hello": "other", "proto": [1, 2]}',
+    b'{"hello": "nbfreqscan"}',
+    b'{"hello": "nbfreqscan", "proto": [1, "2"]}',
+    b'{"hello": "nbfreqscan", "proto": [1, 2], "epoch": "7"}',
+    b'{"hello": "nbfreqscan", "proto": [1, 2], "seq": true}',
+    b'{"hello": "nbfreqscan", "proto": [1, 2], "subscribe": []}',
+    b'{"hello": "nbfreqscan", "proto": [1, 2], "credit": {"records": -1}}',
+    b'{"hello": "nbfreqscan", "proto": [1, 2], "credit": {"bytes": 1.5}}',
+])
+def test_parse_hello_rejects(data):
+    with pytest.raises(bsocket.SocketException):
+        wire.parse_hello(data)
+
+def test_parse_ack():
+    assert wire.parse_ack(b'{"proto": 2, "epoch": 3}') == {'proto': 2, 'epoch': 3}
+    assert wire.parse_ack(b'{"proto": 0}') == {'proto': 0}
+    # Pickles, unknown versions and junk are not an answer.
+    assert wire.parse_ack(pickle.dumps({'freq': 1})) is None
+    assert wire.parse_ack(b'{"proto": 9}') is None
+    assert wire.parse_ack(b'{"proto": "2"}') is None
+    assert wire.parse_ack(b'{not json') is None
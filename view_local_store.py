@@ -11,6 +11,7 @@ import argparse
 import threading
 import queue
 import matplotlib.dates as mdates
+from lib.colstore import ColumnStore, is_colstore
 
 def enumerate_samples():
     with open('s3radio248.pickle', 'rb') as fd:
@@ -122,6 +123,10 @@ def enumerate_channel(data_path, status_prefix, dtl_start, dtl_end):
     if dtl_end is not None:
         dtl_end = dtl_end.timestamp()
 
+    if is_colstore(data_path):
+        yield from enumerate_channel_columnar(data_path, status_prefix, dtl_start, dtl_end)
+        return
+
     for blob in generator_func(dtl_start, dtl_end):
         for sample in blob:
             src_ndx = sample['src_ndx']
@@ -139,6 +144,34 @@ def enumerate_channel(data_path, status_prefix, dtl_start, dtl_end):
                     freqs[ndx] = item['freq'] + freq
                 yield ts, points, freqs
 
+def enumerate_channel_columnar(data_path, status_prefix, ts_start, ts_end):
+    """Does what `enumerate_channel` does for a columnar store.
+
+    Blocks outside the time range are skipped by their footers and the
+    channel arrays are sliced from the mapped file. The yielded arrays
+    are copies since the callers scale them in place.
+    """
+    store = ColumnStore(data_path)
+    blocks = list(store.select(ts_start, ts_end))
+    lti = time.time()
+    for ndx, block in enumerate(blocks):
+        if time.time() - lti > 5:
+            lti = time.time()
+            print('[%s] %.2f' % (status_prefix, ndx / max(len(blocks) - 1, 1) * 100.0))
+        times = block.time
+        freqs = block.freq
+        srcs = block.src
+        starts = block.chan_start
+        for hop in np.nonzero(srcs == 0)[0]:
+            a, b = starts[hop], starts[hop + 1]
+            if a == b:
+                continue
+            yield (
+                float(times[hop]),
+                np.array(block.chan_b1[a:b], np.float64),
+                block.chan_freq[a:b] + float(freqs[hop]),
+            )
+
 
 def build_mask(args):
     """Writes out a spectral mask in the form of coeffients multiplied with each channel.